@@ -0,0 +1,192 @@
+"""
+Measure subscription write latency while a risk cycle is reading and writing the database.
+Each database profile runs in a fresh process against a throwaway test database.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+
+PROFILES = {
+    'sqlite-default': 'SQLite without the tuned options',
+    'sqlite-tuned': 'SQLite with WAL, synchronous=NORMAL and busy timeout',
+    'postgresql': 'PostgreSQL from the DATABASE_* variables',
+    'postgresql-pool': 'PostgreSQL with the psycopg connection pool',
+}
+
+
+def configure(profile):
+    """Point Django at a test database for the profile before anything connects"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    os.environ['DATABASE_ENGINE'] = 'postgresql' if profile.startswith('postgresql') else 'sqlite'
+    os.environ['DATABASE_POOL'] = str(profile == 'postgresql-pool')
+
+    from django.conf import settings
+    database = settings.DATABASES['default']
+    if profile.startswith('sqlite'):
+        # The default SQLite test database lives in memory, which would hide lock contention
+        database['TEST'] = {'NAME': os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')}
+        if profile == 'sqlite-default':
+            database['OPTIONS'] = {}
+    # Every pass of the cycle writes to the alert ledger, like a cycle full of new alerts
+    settings.ALERT_COOLDOWN = 0
+
+    import django
+    django.setup()
+
+
+def new_subscription(rng, i):
+    from users.models import UserSubscription
+    return UserSubscription(
+        phone_number='1234567890',
+        email=f'benchmark{i}@example.com',
+        primary_location_name='Benchmark',
+        latitude=rng.uniform(8, 35),
+        longitude=rng.uniform(68, 97),
+    )
+
+
+def run_cycle(stop, stats):
+    """Stream subscribers and upsert alert ledger rows for some of them, until stopped"""
+    from django.db import connection
+    from users.alert_ledger import record_alerts, select_new_alerts
+    from users.models import AlertLedger
+    from users.subscribers import iter_subscriber_chunks
+
+    rng = random.Random(1)
+    try:
+        while not stop.is_set():
+            for chunk in iter_subscriber_chunks(chunk_size=500):
+                candidates = [
+                    (user, AlertLedger.EARTHQUAKE, rng.randint(1, 3), 'Earthquake Alert', 'Benchmark')
+                    for user in chunk if rng.random() < 0.3
+                ]
+                record_alerts(select_new_alerts(candidates)[0])
+                stats['chunks'] += 1
+                if stop.is_set():
+                    break
+            stats['passes'] += 1
+    except Exception as e:
+        stats['errors'].append(str(e))
+    finally:
+        connection.close()
+
+
+def run_writer(seed, deadline, latencies, errors, pks):
+    """Create and edit subscriptions the way the subscription views do"""
+    from django.db import connection
+    from users.models import UserSubscription
+
+    rng = random.Random(seed)
+    i = 0
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    new_subscription(rng, f'{seed}-{i}').save()
+                else:
+                    subscription = UserSubscription.objects.get(pk=rng.choice(pks))
+                    subscription.latitude = rng.uniform(8, 35)
+                    subscription.save()
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(str(e))
+            i += 1
+            # Think time between form submissions
+            time.sleep(0.005)
+    finally:
+        connection.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else float('nan')
+
+
+def run_worker(profile, subscribers, writers, duration):
+    configure(profile)
+    from django.db import connection
+    from users.models import UserSubscription
+    from users.subscribers import backfill_grid_cells
+
+    test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        rng = random.Random(0)
+        UserSubscription.objects.bulk_create(
+            [new_subscription(rng, i) for i in range(subscribers)], batch_size=1000
+        )
+        backfill_grid_cells()
+        pks = list(UserSubscription.objects.values_list('pk', flat=True))
+        connection.close()
+
+        stop = threading.Event()
+        cycle_stats = {'chunks': 0, 'passes': 0, 'errors': []}
+        cycle = threading.Thread(target=run_cycle, args=(stop, cycle_stats))
+        cycle.start()
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + duration
+        threads = [
+            threading.Thread(target=run_writer, args=(seed, deadline, latencies, errors, pks))
+            for seed in range(writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        cycle.join()
+    finally:
+        connection.creation.destroy_test_db(test_name, verbosity=0)
+
+    print(json.dumps({
+        'writes': len(latencies),
+        'writes_per_s': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'max_ms': max(latencies, default=float('nan')) * 1000,
+        'write_errors': len(errors),
+        'cycle_chunks_per_s': cycle_stats['chunks'] / duration,
+        'cycle_errors': len(cycle_stats['errors']),
+        'first_error': (errors or cycle_stats['errors'] or [''])[0][:80],
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark subscription writes during a risk cycle per database profile.')
+    parser.add_argument('--profiles', default='sqlite-default,sqlite-tuned',
+                        help=f"Comma-separated profiles: {', '.join(PROFILES)}. "
+                             "PostgreSQL profiles need the DATABASE_* variables and psycopg")
+    parser.add_argument('--subscribers', type=int, default=20000, help='Subscribers seeded before the run')
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent threads writing subscriptions')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds of concurrent load per profile')
+    parser.add_argument('--worker', choices=list(PROFILES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.subscribers, args.writers, args.duration)
+    else:
+        print(f"=== Database load benchmark ({args.subscribers} subscribers, {args.writers} writers, {args.duration:.0f}s) ===")
+        print(f"{'Profile':<16}{'Writes/s':>10}{'p50':>10}{'p95':>10}{'Max':>10}{'Errors':>8}{'Cycle chunks/s':>16}")
+        for profile in args.profiles.split(','):
+            output = subprocess.run(
+                [sys.executable, __file__, '--worker', profile, '--subscribers', str(args.subscribers),
+                 '--writers', str(args.writers), '--duration', str(args.duration)],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                print(f"{profile:<16}failed: {output.stderr.strip().splitlines()[-1] if output.stderr.strip() else output.returncode}")
+                continue
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{profile:<16}{result['writes_per_s']:>10.1f}{result['p50_ms']:>8.1f}ms{result['p95_ms']:>8.1f}ms"
+                  f"{result['max_ms']:>8.0f}ms{result['write_errors'] + result['cycle_errors']:>8}"
+                  f"{result['cycle_chunks_per_s']:>16.1f}")
+            if result['first_error']:
+                print(f"{'':<16}first error: {result['first_error']}")
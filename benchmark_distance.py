@@ -0,0 +1,69 @@
+"""
+Benchmark the vectorized haversine engine against the old scalar calculate_distance.
+Computes a 1,000 x 10,000 distance matrix (locations x earthquakes) both ways.
+"""
+
+import time
+import argparse
+import numpy as np
+from math import radians, sin, cos, sqrt, atan2
+
+from users.distance import haversine_matrix
+
+
+def legacy_calculate_distance(lat1, lon1, lat2, lon2):
+    """The scalar implementation previously in users.tasks.calculate_distance"""
+    try:
+        R = 6371  # Earth's radius in kilometers
+
+        lat1, lon1, lat2, lon2 = map(radians, [float(lat1), float(lon1), float(lat2), float(lon2)])
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+
+        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+        c = 2 * atan2(sqrt(a), sqrt(1-a))
+        return R * c
+    except Exception:
+        return float('inf')
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def legacy_matrix(lats1, lons1, lats2, lons2):
+    return [[legacy_calculate_distance(a, b, c, d) for c, d in zip(lats2, lons2)]
+            for a, b in zip(lats1, lons1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark haversine distance implementations.')
+    parser.add_argument('--locations', type=int, default=1000, help='Number of locations (rows)')
+    parser.add_argument('--events', type=int, default=10000, help='Number of earthquakes (columns)')
+    parser.add_argument('--chunk-size', type=int, default=256, help='Rows per chunk in chunked mode')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    lats1, lons1 = rng.uniform(8, 35, args.locations), rng.uniform(68, 97, args.locations)
+    lats2, lons2 = rng.uniform(-60, 60, args.events), rng.uniform(-180, 180, args.events)
+
+    print(f"=== Haversine benchmark: {args.locations} x {args.events} points ===")
+
+    legacy, legacy_time = time_call(legacy_matrix, lats1.tolist(), lons1.tolist(), lats2.tolist(), lons2.tolist())
+    legacy = np.array(legacy)
+    print(f"Scalar calculate_distance:  {legacy_time:8.3f}s")
+
+    results = [
+        ('Vectorized float64:', time_call(haversine_matrix, lats1, lons1, lats2, lons2)),
+        ('Vectorized float32:', time_call(haversine_matrix, lats1, lons1, lats2, lons2, dtype=np.float32)),
+        (f'Chunked float64 ({args.chunk_size} rows):',
+         time_call(haversine_matrix, lats1, lons1, lats2, lons2, chunk_size=args.chunk_size)),
+        (f'Chunked float32 ({args.chunk_size} rows):',
+         time_call(haversine_matrix, lats1, lons1, lats2, lons2, dtype=np.float32, chunk_size=args.chunk_size)),
+    ]
+    for label, (matrix, elapsed) in results:
+        max_error = float(np.max(np.abs(matrix.astype(np.float64) - legacy)))
+        print(f"{label:<28}{elapsed:8.3f}s  speedup {legacy_time / elapsed:7.1f}x  "
+              f"max error {max_error:.6f} km")
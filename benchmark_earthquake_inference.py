@@ -0,0 +1,90 @@
+"""
+Compare the torch earthquake model with the fused NumPy model.
+Each backend runs in a fresh process so import time and peak memory are measured separately.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return float('nan')
+
+
+def run_worker(backend, rows, repeats):
+    """Load one backend and time single-row and batched predictions"""
+    start = time.perf_counter()
+    import numpy as np
+    if backend == 'torch':
+        from earthquakes.torch_model import EarthquakePredictor
+        import_time = time.perf_counter() - start
+        predictor = EarthquakePredictor()
+    else:
+        from earthquakes.fused_model import FusedEarthquakePredictor
+        import_time = time.perf_counter() - start
+        predictor = FusedEarthquakePredictor()
+    load_time = time.perf_counter() - start - import_time
+
+    rng = np.random.default_rng(0)
+    features = np.column_stack([
+        rng.uniform(8, 35, rows), rng.uniform(68, 97, rows), rng.integers(0, 50, rows),
+        rng.uniform(0, 8, rows), rng.uniform(0, 1000, rows), rng.uniform(0, 200, rows),
+    ])
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predictor.predict(features[0])
+    single = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    predictor.predict_batch(features)
+    batch = time.perf_counter() - start
+
+    print(json.dumps({
+        'import_s': import_time,
+        'load_s': load_time,
+        'single_ms': single * 1000,
+        'batch_ms': batch * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark earthquake model inference backends.')
+    parser.add_argument('--rows', type=int, default=2500, help='Rows in the batched prediction (heatmap grid size)')
+    parser.add_argument('--repeats', type=int, default=200, help='Single-row predictions to average')
+    parser.add_argument('--worker', choices=['torch', 'numpy'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.rows, args.repeats)
+    else:
+        print(f"=== Earthquake inference benchmark ({args.rows} rows per batch) ===")
+        print(f"{'Backend':<8}{'Import':>10}{'Load':>10}{'Single':>12}{'Batch':>12}{'Peak RSS':>12}")
+        for backend in ['torch', 'numpy']:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', backend,
+                 '--rows', str(args.rows), '--repeats', str(args.repeats)],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            if output.returncode != 0:
+                print(f"{backend:<8}failed: {output.stderr.strip().splitlines()[-1]}")
+                continue
+            stats = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"{backend:<8}{stats['import_s']:>9.2f}s{stats['load_s']:>9.2f}s"
+                  f"{stats['single_ms']:>10.3f}ms{stats['batch_ms']:>10.2f}ms{stats['peak_rss_mb']:>10.1f}MB")
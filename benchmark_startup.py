@@ -0,0 +1,88 @@
+"""
+Measure how long a web worker takes to start and how much memory it holds before serving a request.
+The worker imports run in a fresh process with -X importtime, so every module they load is accounted for.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules a web worker should not need until a request or task actually uses them
+HEAVY_MODULES = ['xgboost', 'sklearn', 'scipy', 'pandas', 'joblib', 'torch', 'folium', 'pywhatkit', 'pyautogui', 'selenium']
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return float('nan')
+
+
+def run_worker():
+    """Start Django and load the URL configuration, as a web worker does before its first request"""
+    import time
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    import django
+    django.setup()
+    import myproject.urls  # noqa: F401
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'startup_s': elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'modules': len(sys.modules),
+        'heavy': [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def parse_importtime(stderr):
+    """(cumulative seconds, module) pairs from -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        imports.append((int(cumulative) / 1e6, name.rstrip()))
+    return imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark web worker startup time and memory.')
+    parser.add_argument('--repeats', type=int, default=3, help='Fresh processes to start; the fastest is reported')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+    else:
+        runs = []
+        for _ in range(args.repeats):
+            output = subprocess.run(
+                [sys.executable, '-X', 'importtime', __file__, '--worker'],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                sys.exit(f"Worker failed: {output.stderr.strip().splitlines()[-1] if output.stderr.strip() else output.returncode}")
+            runs.append((json.loads(output.stdout.strip().splitlines()[-1]), parse_importtime(output.stderr)))
+        result, imports = min(runs, key=lambda run: run[0]['startup_s'])
+
+        print("=== Web worker startup (django.setup() + URL configuration) ===")
+        print(f"Startup:        {result['startup_s']:.2f}s (fastest of {args.repeats})")
+        print(f"Peak RSS:       {result['peak_rss_mb']:.0f} MB")
+        print(f"Modules loaded: {result['modules']}")
+        print(f"Heavy modules:  {', '.join(result['heavy']) or 'none'}")
+        print("\nSlowest imports (cumulative, including the modules they import):")
+        for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+            print(f"{cumulative:>8.3f}s  {name}")
@@ -1,29 +1,38 @@
-import joblib
 import numpy as np
-import pandas as pd
 import logging
-from django.conf import settings
 import os
+import threading
 from datetime import datetime
 import math
 
 logger = logging.getLogger(__name__)
 
-# Load the XGBoost model
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'baseline_xgboost_model.pkl')
-try:
-    xgb_model = joblib.load(MODEL_PATH)
-    logger.info("XGBoost cyclone model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading XGBoost model: {str(e)}")
-    xgb_model = None
-
-def calculate_wind_components(wind_speed, wind_direction):
-    """Calculate U and V components of wind"""
-    wind_direction_rad = math.radians(wind_direction)
-    wind_u = -wind_speed * math.sin(wind_direction_rad)
-    wind_v = -wind_speed * math.cos(wind_direction_rad)
-    return wind_u, wind_v
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+def get_cyclone_model():
+    """
+    Load the XGBoost cyclone model on first use.
+    
+    Unpickling the pipeline imports xgboost, sklearn and scipy, so it is kept
+    out of module import for processes that never predict, like web workers.
+    Returns None when the model could not be loaded.
+    """
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                try:
+                    import joblib
+                    _model = joblib.load(MODEL_PATH)
+                    logger.info("XGBoost cyclone model loaded successfully")
+                except Exception as e:
+                    logger.error(f"Error loading XGBoost model: {str(e)}")
+                _model_loaded = True
+    return _model
 
 def is_monsoon_season(month):
     """Check if current month is in monsoon season (June to September)"""
@@ -33,131 +42,223 @@ def is_cyclone_season(month):
     """Check if current month is in cyclone season (April-June or September-December)"""
     return month in [4, 5, 6, 9, 10, 11, 12]
 
-def check_location(lat, lon):
-    """Check if location is in Bay of Bengal or Arabian Sea"""
-    in_bay_of_bengal = (85 <= lon <= 95) and (10 <= lat <= 22)
-    in_arabian_sea = (60 <= lon <= 75) and (10 <= lat <= 22)
-    return in_bay_of_bengal, in_arabian_sea
+# Column order of the engineered feature frame passed to the model
+FEATURE_COLUMNS = [
+    'temperature_2m', 'relative_humidity_2m', 'wind_speed_10m', 'wind_direction_10m',
+    'pressure_msl', 'cloud_cover', 'precipitation', 'wind_u', 'wind_v', 'final_lat',
+    'final_lon', 'abs_latitude', 'month', 'day', 'hour', 'sin_month', 'cos_month',
+    'sin_day', 'cos_day', 'sin_hour', 'cos_hour', 'is_monsoon', 'is_cyclone_season',
+    'in_bay_of_bengal', 'in_arabian_sea', 'temp_pressure_ratio', 'wind_pressure_interaction',
+    'humid_temp_index', 'precip_temp_humid', 'wind_fluctuation'
+]
 
-def predict_cyclone_risk(features):
+# Number of raw weather features produced by users.tasks.check_cyclone_risk
+RAW_FEATURE_COUNT = 30
+
+def build_feature_matrix(features, now=None):
     """
-    Predict cyclone risk using the XGBoost model.
+    Derive the engineered model features for many locations at once.
     
     Args:
-        features (list): List of weather features
+        features (array-like): (N, 30) raw weather features, one row per location
+        now (datetime): Time used for the seasonal features, defaults to now
         
     Returns:
-        dict: Dictionary containing risk level and details
+        np.ndarray: (N, 30) feature matrix in FEATURE_COLUMNS order
     """
-    try:
-        if xgb_model is None:
-            return {'risk_level': 0, 'details': 'Model not available', 'raw_prediction': None}
-        
-        # Extract basic features
-        wind_speed = features[0]
-        wind_direction = features[1]
-        pressure = features[2]
-        humidity = features[3]
-        temperature = features[4]
-        lat = features[10]
-        lon = features[11]
-        
-        # Get current time components
-        now = datetime.now()
-        month = now.month
-        day = now.day
-        hour = now.hour
-        
-        # Calculate cyclical time features
-        sin_month = math.sin(2 * math.pi * month / 12)
-        cos_month = math.cos(2 * math.pi * month / 12)
-        sin_day = math.sin(2 * math.pi * day / 31)
-        cos_day = math.cos(2 * math.pi * day / 31)
-        sin_hour = math.sin(2 * math.pi * hour / 24)
-        cos_hour = math.cos(2 * math.pi * hour / 24)
-        
-        # Calculate wind components
-        wind_u, wind_v = calculate_wind_components(wind_speed, wind_direction)
-        
-        # Location checks
-        in_bay_of_bengal, in_arabian_sea = check_location(lat, lon)
-        abs_latitude = abs(lat)
+    features = np.asarray(features, dtype=np.float64)
+    if features.ndim == 1:
+        features = features.reshape(1, -1)
+    
+    # Extract basic features
+    wind_speed = features[:, 0]
+    wind_direction = features[:, 1]
+    pressure = features[:, 2]
+    humidity = features[:, 3]
+    temperature = features[:, 4]
+    visibility = features[:, 8]
+    clouds = features[:, 9]
+    lat = features[:, 10]
+    lon = features[:, 11]
+    wind_speed_trend = features[:, 15]
+    
+    # Get current time components
+    now = now or datetime.now()
+    month, day, hour = now.month, now.day, now.hour
+    
+    # Calculate wind components
+    wind_direction_rad = np.radians(wind_direction)
+    wind_u = -wind_speed * np.sin(wind_direction_rad)
+    wind_v = -wind_speed * np.cos(wind_direction_rad)
+    
+    # Location checks
+    in_bay_of_bengal = (85 <= lon) & (lon <= 95) & (10 <= lat) & (lat <= 22)
+    in_arabian_sea = (60 <= lon) & (lon <= 75) & (10 <= lat) & (lat <= 22)
+    
+    # Calculate derived features
+    with np.errstate(divide='ignore', invalid='ignore'):
+        temp_pressure_ratio = np.where(pressure != 0, temperature / pressure, 0)
+    
+    n = len(features)
+    constant = lambda value: np.full(n, value, dtype=np.float64)
+    
+    return np.column_stack([
+        temperature,                                # temperature_2m
+        humidity,                                   # relative_humidity_2m
+        wind_speed,                                 # wind_speed_10m
+        wind_direction,                             # wind_direction_10m
+        pressure,                                   # pressure_msl
+        clouds,                                     # cloud_cover
+        visibility / 1000,                          # precipitation (from visibility)
+        wind_u,                                     # wind_u
+        wind_v,                                     # wind_v
+        lat,                                        # final_lat
+        lon,                                        # final_lon
+        np.abs(lat),                                # abs_latitude
+        constant(month),                            # month
+        constant(day),                              # day
+        constant(hour),                             # hour
+        constant(math.sin(2 * math.pi * month / 12)),   # sin_month
+        constant(math.cos(2 * math.pi * month / 12)),   # cos_month
+        constant(math.sin(2 * math.pi * day / 31)),     # sin_day
+        constant(math.cos(2 * math.pi * day / 31)),     # cos_day
+        constant(math.sin(2 * math.pi * hour / 24)),    # sin_hour
+        constant(math.cos(2 * math.pi * hour / 24)),    # cos_hour
+        constant(int(is_monsoon_season(month))),    # is_monsoon
+        constant(int(is_cyclone_season(month))),    # is_cyclone_season
+        in_bay_of_bengal.astype(np.float64),        # in_bay_of_bengal
+        in_arabian_sea.astype(np.float64),          # in_arabian_sea
+        temp_pressure_ratio,                        # temp_pressure_ratio
+        wind_speed * pressure / 1000,               # wind_pressure_interaction
+        humidity * temperature / 100,               # humid_temp_index
+        visibility * temperature * humidity / 1000, # precip_temp_humid (visibility as precipitation proxy)
+        np.abs(wind_speed - wind_speed_trend),      # wind_fluctuation
+    ])
+
+class _BoosterPath:
+    """
+    Pandas-free replay of the fitted pipeline: the RobustScaler step is applied
+    with numpy and the XGBoost booster is called through inplace_predict.
+    """
+    
+    def __init__(self, model):
+        preprocessor = model.named_steps['preprocessor']
+        classifier = model.named_steps['classifier']
+        fitted_names = list(preprocessor.feature_names_in_)
         
-        # Calculate derived features
-        temp_pressure_ratio = temperature / pressure if pressure != 0 else 0
-        wind_pressure_interaction = wind_speed * pressure / 1000
-        humid_temp_index = humidity * temperature / 100
-        precip_temp_humid = features[8] * temperature * humidity / 1000  # using visibility as proxy for precipitation
-        wind_fluctuation = abs(wind_speed - features[15])  # using wind_speed_trend
+        self.blocks = []
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop':
+                continue
+            names = [fitted_names[c] if isinstance(c, (int, np.integer)) else c for c in columns]
+            indices = np.array([FEATURE_COLUMNS.index(n) for n in names])
+            if transformer == 'passthrough' or getattr(transformer, 'func', False) is None:
+                self.blocks.append((indices, None, None))
+            elif type(transformer).__name__ == 'RobustScaler':
+                self.blocks.append((indices, transformer.center_, transformer.scale_))
+            else:
+                raise ValueError(f"Unsupported transformer {name}: {transformer}")
+        self.booster = classifier.get_booster()
+    
+    def predict_proba(self, feature_matrix):
+        parts = []
+        for indices, center, scale in self.blocks:
+            part = feature_matrix[:, indices]
+            if center is not None:
+                part = part - center
+            if scale is not None:
+                part = part / scale
+            parts.append(part)
+        X = np.ascontiguousarray(np.hstack(parts), dtype=np.float32)
+        return np.asarray(self.booster.inplace_predict(X), dtype=np.float64)
+
+_booster_path = None
+
+def _predict_probabilities(model, feature_matrix):
+    """Positive-class probabilities for an engineered feature matrix in one model call"""
+    global _booster_path
+    if _booster_path is None:
+        with _model_lock:
+            if _booster_path is None:
+                try:
+                    _booster_path = _BoosterPath(model)
+                except Exception as e:
+                    logger.warning(f"Falling back to pandas cyclone inference: {str(e)}")
+                    _booster_path = False
+    if _booster_path:
+        return _booster_path.predict_proba(feature_matrix)
+    import pandas as pd
+    X = pd.DataFrame(feature_matrix, columns=FEATURE_COLUMNS)
+    return model.predict_proba(X)[:, 1]
+
+def _risk_from_probability(raw_prediction):
+    """Convert model probability to risk level and details"""
+    if raw_prediction > 0.75:
+        return 3, "High cyclone risk predicted by ML model"
+    elif raw_prediction > 0.5:
+        return 2, "Moderate cyclone risk predicted by ML model"
+    elif raw_prediction > 0.25:
+        return 1, "Low cyclone risk predicted by ML model"
+    return 0, "No immediate cyclone risk predicted by ML model"
+
+def _as_feature_rows(feature_matrix):
+    """Stack feature rows into an (N, 30) array, zero-padding short rows"""
+    if isinstance(feature_matrix, np.ndarray):
+        return feature_matrix.reshape(1, -1) if feature_matrix.ndim == 1 else feature_matrix.astype(np.float64)
+    rows = np.zeros((len(feature_matrix), RAW_FEATURE_COUNT), dtype=np.float64)
+    for i, row in enumerate(feature_matrix):
+        # Rows can be short when the forecast had fewer than five entries
+        row = [np.nan if value is None else value for value in list(row)[:RAW_FEATURE_COUNT]]
+        rows[i, :len(row)] = row
+    return rows
+
+def predict_cyclone_risk_batch(feature_matrix):
+    """
+    Predict cyclone risk for many locations with a single XGBoost call.
+    
+    Args:
+        feature_matrix (array-like): (N, 30) raw weather features, one row per
+            location, in the order built by users.tasks.check_cyclone_risk
         
-        # Create feature array in exact order expected by model
-        feature_array = np.array([
-            temperature,           # temperature_2m
-            humidity,             # relative_humidity_2m
-            wind_speed,           # wind_speed_10m
-            wind_direction,       # wind_direction_10m
-            pressure,             # pressure_msl
-            features[9],          # cloud_cover
-            features[8] / 1000,   # precipitation (from visibility)
-            wind_u,              # wind_u
-            wind_v,              # wind_v
-            lat,                 # final_lat
-            lon,                 # final_lon
-            abs_latitude,        # abs_latitude
-            month,               # month
-            day,                 # day
-            hour,               # hour
-            sin_month,          # sin_month
-            cos_month,          # cos_month
-            sin_day,            # sin_day
-            cos_day,            # cos_day
-            sin_hour,           # sin_hour
-            cos_hour,           # cos_hour
-            int(is_monsoon_season(month)),     # is_monsoon
-            int(is_cyclone_season(month)),     # is_cyclone_season
-            int(in_bay_of_bengal),            # in_bay_of_bengal
-            int(in_arabian_sea),              # in_arabian_sea
-            temp_pressure_ratio,              # temp_pressure_ratio
-            wind_pressure_interaction,        # wind_pressure_interaction
-            humid_temp_index,                # humid_temp_index
-            precip_temp_humid,               # precip_temp_humid
-            wind_fluctuation                 # wind_fluctuation
-        ]).reshape(1, -1)
+    Returns:
+        list: One dict per row containing risk level and details
+    """
+    if len(feature_matrix) == 0:
+        return []
+    
+    try:
+        feature_matrix = _as_feature_rows(feature_matrix)
         
-        # Create DataFrame with correct column names
-        columns = [
-            'temperature_2m', 'relative_humidity_2m', 'wind_speed_10m', 'wind_direction_10m',
-            'pressure_msl', 'cloud_cover', 'precipitation', 'wind_u', 'wind_v', 'final_lat',
-            'final_lon', 'abs_latitude', 'month', 'day', 'hour', 'sin_month', 'cos_month',
-            'sin_day', 'cos_day', 'sin_hour', 'cos_hour', 'is_monsoon', 'is_cyclone_season',
-            'in_bay_of_bengal', 'in_arabian_sea', 'temp_pressure_ratio', 'wind_pressure_interaction',
-            'humid_temp_index', 'precip_temp_humid', 'wind_fluctuation'
-        ]
-        X = pd.DataFrame(feature_array, columns=columns)
+        model = get_cyclone_model()
+        if model is None:
+            return [{'risk_level': 0, 'details': 'Model not available', 'raw_prediction': None}
+                    for _ in range(len(feature_matrix))]
         
-        # Get model prediction
-        raw_prediction = float(xgb_model.predict_proba(X)[0][1])
+        probabilities = _predict_probabilities(model, build_feature_matrix(feature_matrix))
         
-        # Convert probability to risk level
-        if raw_prediction > 0.75:
-            risk_level = 3
-            details = "High cyclone risk predicted by ML model"
-        elif raw_prediction > 0.5:
-            risk_level = 2
-            details = "Moderate cyclone risk predicted by ML model"
-        elif raw_prediction > 0.25:
-            risk_level = 1
-            details = "Low cyclone risk predicted by ML model"
-        else:
-            risk_level = 0
-            details = "No immediate cyclone risk predicted by ML model"
-            
-        return {
-            'risk_level': risk_level,
-            'details': details,
-            'raw_prediction': raw_prediction
-        }
+        results = []
+        for raw_prediction in probabilities.tolist():
+            risk_level, details = _risk_from_probability(raw_prediction)
+            results.append({
+                'risk_level': risk_level,
+                'details': details,
+                'raw_prediction': raw_prediction
+            })
+        return results
         
     except Exception as e:
-        logger.error(f"Error in cyclone prediction: {str(e)}")
-        return {'risk_level': 0, 'details': 'Error in prediction', 'raw_prediction': None} 
\ No newline at end of file
+        logger.error(f"Error in batch cyclone prediction: {str(e)}")
+        return [{'risk_level': 0, 'details': 'Error in prediction', 'raw_prediction': None}
+                for _ in range(len(feature_matrix))]
+
+def predict_cyclone_risk(features):
+    """
+    Predict cyclone risk using the XGBoost model.
+    
+    Args:
+        features (list): List of weather features
+        
+    Returns:
+        dict: Dictionary containing risk level and details
+    """
+    return predict_cyclone_risk_batch([features])[0]
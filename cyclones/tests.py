@@ -0,0 +1,55 @@
+import unittest
+from datetime import datetime
+import numpy as np
+from django.test import SimpleTestCase
+from .model_utils import FEATURE_COLUMNS, RAW_FEATURE_COUNT, _BoosterPath, build_feature_matrix, get_cyclone_model
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# Create your tests here.
+
+@unittest.skipIf(pd is None, "pandas is not installed")
+class BoosterPathTests(SimpleTestCase):
+    """The NumPy replay of the pipeline must match the fitted sklearn pipeline"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = get_cyclone_model()
+        if cls.model is None:
+            raise unittest.SkipTest("The XGBoost cyclone model could not be loaded")
+
+    def sample_features(self, n=500):
+        rng = np.random.default_rng(0)
+        rows = np.zeros((n, RAW_FEATURE_COUNT))
+        rows[:, 0] = rng.uniform(0, 40, n)         # wind speed
+        rows[:, 1] = rng.uniform(0, 360, n)        # wind direction
+        rows[:, 2] = rng.uniform(950, 1030, n)     # pressure
+        rows[:, 3] = rng.uniform(20, 100, n)       # humidity
+        rows[:, 4] = rng.uniform(10, 40, n)        # temperature
+        rows[:, 8] = rng.uniform(0, 10000, n)      # visibility
+        rows[:, 9] = rng.uniform(0, 100, n)        # clouds
+        rows[:, 10] = rng.uniform(5, 30, n)        # latitude
+        rows[:, 11] = rng.uniform(60, 100, n)      # longitude
+        rows[:, 15] = rng.uniform(-5, 5, n)        # wind speed trend
+        return rows
+
+    def assertMatchesPipeline(self, features, now):
+        feature_matrix = build_feature_matrix(features, now=now)
+        expected = self.model.predict_proba(pd.DataFrame(feature_matrix, columns=FEATURE_COLUMNS))[:, 1]
+        actual = _BoosterPath(self.model).predict_proba(feature_matrix)
+        np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+    def test_batch_parity(self):
+        self.assertMatchesPipeline(self.sample_features(), datetime(2024, 10, 15, 6))
+        # Monsoon and off-season months flip the seasonal flags
+        self.assertMatchesPipeline(self.sample_features(), datetime(2024, 7, 1, 18))
+        self.assertMatchesPipeline(self.sample_features(), datetime(2024, 2, 28, 0))
+
+    def test_single_parity(self):
+        features = np.zeros((1, RAW_FEATURE_COUNT))
+        features[0, :12] = [35.0, 120.0, 968.0, 92.0, 29.0, 0, 0, 0, 2000.0, 95.0, 17.7, 88.2]
+        self.assertMatchesPipeline(features, datetime(2024, 5, 20, 12))
@@ -0,0 +1,164 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import EarthquakeEvent
+
+logger = logging.getLogger(__name__)
+
+USGS_SUMMARY_URL = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary'
+
+# Summary feeds used to catch up, from the smallest to the largest
+CATALOG_FEEDS = [
+    ('hour', timedelta(hours=1)),
+    ('day', timedelta(days=1)),
+    ('week', timedelta(days=7)),
+    ('month', timedelta(days=30)),
+]
+
+# Events upserted per query
+BATCH_SIZE = 1000
+
+_previous = {}
+_previous_lock = threading.Lock()
+
+
+def choose_feed(last_update, now=None):
+    """Smallest summary feed that still covers the time since the catalog was last updated"""
+    if last_update is None:
+        return CATALOG_FEEDS[-1][0]
+    now = now or datetime.now(timezone.utc)
+    # Leave a margin for events USGS revises some time after they happen
+    elapsed = (now - last_update) * 1.5
+    for name, span in CATALOG_FEEDS:
+        if elapsed <= span:
+            return name
+    return CATALOG_FEEDS[-1][0]
+
+
+def ingest_snapshot(snapshot):
+    """
+    Insert new events and update revised ones from a FeedSnapshot.
+
+    Returns:
+        int: Number of events written
+    """
+    events = [
+        EarthquakeEvent(
+            event_id=event_id,
+            latitude=lat,
+            longitude=lon,
+            depth=None if np.isnan(depth) else depth,
+            magnitude=magnitude,
+            time=datetime.fromtimestamp(event_ms / 1000, tz=timezone.utc),
+            updated=updated,
+        )
+        for event_id, lat, lon, depth, magnitude, event_ms, updated in zip(
+            snapshot.ids.tolist(), snapshot.latitudes.tolist(), snapshot.longitudes.tolist(),
+            snapshot.depths.tolist(), snapshot.magnitudes.tolist(), snapshot.times.tolist(),
+            snapshot.updated.tolist(),
+        )
+    ]
+    EarthquakeEvent.objects.bulk_create(
+        events,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['event_id'],
+        update_fields=['latitude', 'longitude', 'depth', 'magnitude', 'time', 'updated'],
+    )
+    return len(events)
+
+
+def update_catalog(feed=None):
+    """
+    Pull the latest USGS summary feed into the catalog.
+
+    Picks the hour, day, week or month feed depending on how long ago the
+    catalog was last updated, and revalidates it with the ETag of the
+    previous download so an unchanged feed costs a 304.
+
+    Returns:
+        tuple: (feed name, number of events written)
+    """
+    from users.usgs_feed import fetch_feed_snapshot
+
+    if feed is None:
+        last_updated = EarthquakeEvent.objects.aggregate(last=Max('updated'))['last']
+        last_update = datetime.fromtimestamp(last_updated / 1000, tz=timezone.utc) if last_updated else None
+        feed = choose_feed(last_update)
+
+    with _previous_lock:
+        previous = _previous.get(feed)
+    # Download without the lock so updates of other feeds are not held up
+    snapshot = fetch_feed_snapshot(previous=previous, url=f'{USGS_SUMMARY_URL}/all_{feed}.geojson')
+    with _previous_lock:
+        current = _previous.get(feed)
+        if snapshot is previous or (current is not previous and current.version == snapshot.version):
+            # Unchanged, or another update already stored this version of the feed
+            return feed, 0
+        _previous[feed] = snapshot
+
+    written = ingest_snapshot(snapshot)
+    logger.info(f"Earthquake catalog updated from the {feed} feed: {written} events")
+    return feed, written
+
+
+def prune_catalog(retention_days=None):
+    """Delete events older than EARTHQUAKE_CATALOG_RETENTION_DAYS, if set"""
+    if retention_days is None:
+        retention_days = getattr(settings, 'EARTHQUAKE_CATALOG_RETENTION_DAYS', None)
+    if not retention_days:
+        return 0
+    start = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted, _ = EarthquakeEvent.objects.filter(time__lt=start).delete()
+    return deleted
+
+
+def catalog_snapshot(days=None, previous=None):
+    """
+    Build a FeedSnapshot from the catalog's events of the last `days` days.
+
+    Risk checks can then run against the local catalog exactly as they do
+    against the downloaded feed. The previous snapshot is returned unchanged
+    when the catalog has not changed since it was built.
+    """
+    from users.usgs_feed import FeedSnapshot
+
+    if days is None:
+        days = getattr(settings, 'EARTHQUAKE_CATALOG_WINDOW_DAYS', 30)
+    events = EarthquakeEvent.objects.since(days=days)
+
+    summary = events.aggregate(count=Count('id'), last=Max('updated'))
+    version = f"catalog:{days}:{summary['count']}:{summary['last']}"
+    if previous is not None and previous.etag == version:
+        return previous
+
+    rows = list(events.order_by('time').values_list(
+        'event_id', 'latitude', 'longitude', 'magnitude', 'time', 'depth', 'updated'
+    ))
+    return FeedSnapshot(
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        [row[3] for row in rows],
+        [int(row[4].timestamp() * 1000) for row in rows],
+        [row[5] if row[5] is not None else np.nan for row in rows],
+        ids=[row[0] for row in rows],
+        updated=[row[6] for row in rows],
+        etag=version,
+    )
+
+
+def query_events(lat, lon, km, days):
+    """
+    Events within km of (lat, lon) in the last `days` days, nearest first.
+
+    Returns:
+        list: dicts with event_id, magnitude, time, depth and distance in km
+    """
+    return list(
+        EarthquakeEvent.objects.since(days=days).within_radius(lat, lon, km)
+        .order_by('distance')
+        .values('event_id', 'magnitude', 'time', 'depth', 'distance')
+    )
@@ -0,0 +1,103 @@
+import numpy as np
+from pathlib import Path
+
+# Number of input features the model and scaler were trained on
+INPUT_SIZE = 22
+
+# Largest number of rows sent through the network in one forward pass
+DEFAULT_MAX_BATCH_SIZE = 1024
+
+FUSED_MODEL_PATH = Path(__file__).parent / 'models' / 'earthquake_fused.npz'
+
+def pad_feature_rows(features):
+    """Stack feature rows into an (N, 22) float array, zero-padding missing features"""
+    if isinstance(features, np.ndarray) and features.ndim == 2:
+        rows = features[:, :INPUT_SIZE].astype(np.float64)
+        if rows.shape[1] < INPUT_SIZE:
+            rows = np.pad(rows, ((0, 0), (0, INPUT_SIZE - rows.shape[1])), 'constant')
+        return rows
+
+    rows = np.zeros((len(features), INPUT_SIZE), dtype=np.float64)
+    for i, row in enumerate(features):
+        row = list(row)[:INPUT_SIZE]
+        rows[i, :len(row)] = row
+    return rows
+
+def fold_earthquake_model(state_dict, scaler, layers, eps):
+    """
+    Fold input standardization and eval-mode BatchNorm into Linear layers.
+
+    Args:
+        state_dict (dict): numpy arrays keyed like the torch EarthquakeModel
+        scaler: Fitted StandardScaler applied to the inputs
+        layers (list): (linear_name, batchnorm_name or None) pairs in order
+        eps (list): BatchNorm epsilon per layer
+
+    Returns:
+        list: (weight, bias) pairs, weight shaped (in_features, out_features)
+    """
+    folded = []
+    for i, ((linear, bn), bn_eps) in enumerate(zip(layers, eps)):
+        weight = state_dict[f'{linear}.weight'].astype(np.float64).T
+        bias = state_dict[f'{linear}.bias'].astype(np.float64)
+
+        if i == 0:
+            # x_scaled = (x - mean) / scale, so x_scaled @ W = x @ (W / scale) - (mean / scale) @ W
+            mean = getattr(scaler, 'mean_', None)
+            scale = getattr(scaler, 'scale_', None)
+            if mean is None or not getattr(scaler, 'with_mean', True):
+                mean = np.zeros(weight.shape[0])
+            if scale is None or not getattr(scaler, 'with_std', True):
+                scale = np.ones(weight.shape[0])
+            bias = bias - (mean / scale) @ weight
+            weight = weight / scale[:, np.newaxis]
+
+        if bn:
+            gamma = state_dict[f'{bn}.weight'].astype(np.float64)
+            beta = state_dict[f'{bn}.bias'].astype(np.float64)
+            running_mean = state_dict[f'{bn}.running_mean'].astype(np.float64)
+            running_var = state_dict[f'{bn}.running_var'].astype(np.float64)
+            factor = gamma / np.sqrt(running_var + bn_eps)
+            weight = weight * factor
+            bias = (bias - running_mean) * factor + beta
+
+        folded.append((weight, bias))
+    return folded
+
+class FusedEarthquakePredictor:
+    """
+    Framework-free earthquake model: the scaler and BatchNorm layers are
+    folded into the Linear weights, so inference is four NumPy matmuls.
+    """
+
+    def __init__(self, model_path=FUSED_MODEL_PATH, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self.layers = []
+        self.max_batch_size = max_batch_size
+        self.load_model(model_path)
+
+    def load_model(self, model_path):
+        """Load the folded weights written by export_fused_model"""
+        with np.load(model_path) as data:
+            count = len([key for key in data.files if key.startswith('weight')])
+            self.layers = [(data[f'weight{i}'], data[f'bias{i}']) for i in range(count)]
+
+    def forward(self, rows):
+        x = rows
+        for weight, bias in self.layers[:-1]:
+            x = np.maximum(x @ weight + bias, 0)
+        weight, bias = self.layers[-1]
+        return 1 / (1 + np.exp(-(x @ weight + bias)))
+
+    def predict(self, features):
+        """Make a prediction for one feature row, shaped like EarthquakePredictor.predict"""
+        return self.predict_batch([features])[:1]
+
+    def predict_batch(self, features):
+        """Make predictions for an (N, k) array of feature rows"""
+        rows = pad_feature_rows(features)
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate([
+            self.forward(rows[start:start + self.max_batch_size])
+            for start in range(0, len(rows), self.max_batch_size)
+        ])[:, 0]
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from earthquakes.fused_model import FUSED_MODEL_PATH
+
+class Command(BaseCommand):
+    help = 'Export the torch earthquake model as fused NumPy weights for torch-free inference'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default=str(FUSED_MODEL_PATH), help='Path of the .npz file to write')
+
+    def handle(self, *args, **kwargs):
+        output = kwargs['output']
+        
+        try:
+            from earthquakes.torch_model import export_fused_model
+            export_fused_model(output)
+            self.stdout.write(self.style.SUCCESS(f'Fused earthquake model written to {output}'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error exporting earthquake model: {str(e)}'))
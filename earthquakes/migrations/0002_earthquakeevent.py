@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('earthquakes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarthquakeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('depth', models.FloatField(blank=True, null=True)),
+                ('magnitude', models.FloatField(default=0)),
+                ('time', models.DateTimeField(db_index=True)),
+                ('updated', models.BigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['latitude', 'longitude'], name='earthquake_event_location')],
+            },
+        ),
+    ]
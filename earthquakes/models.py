@@ -1,4 +1,7 @@
+from datetime import timedelta
 from django.db import models
+from django.utils import timezone
+from users.geo_queries import within_radius
 
 # Create your models here.
 
@@ -11,3 +14,35 @@ class EarthquakeAlert(models.Model):
 
     def __str__(self):
         return f"Magnitude {self.magnitude} - {self.location}"
+
+class EarthquakeEventQuerySet(models.QuerySet):
+    def since(self, days=None, start=None):
+        """Events in the last `days` days, or since a given datetime"""
+        if start is None:
+            start = timezone.now() - timedelta(days=days)
+        return self.filter(time__gte=start)
+
+    def within_radius(self, lat, lon, km):
+        """Events strictly closer than km to (lat, lon), annotated with `distance` in km"""
+        return within_radius(self, lat, lon, km)
+
+class EarthquakeEvent(models.Model):
+    """One USGS event in the local earthquake catalog, keyed by its USGS id"""
+    event_id = models.CharField(max_length=64, unique=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    depth = models.FloatField(null=True, blank=True)
+    magnitude = models.FloatField(default=0)
+    time = models.DateTimeField(db_index=True)
+    # USGS 'updated' timestamp in milliseconds, used to detect revised events
+    updated = models.BigIntegerField()
+
+    objects = EarthquakeEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='earthquake_event_location'),
+        ]
+
+    def __str__(self):
+        return f"M{self.magnitude} at {self.latitude}, {self.longitude} ({self.time:%Y-%m-%d %H:%M})"
@@ -0,0 +1,16 @@
+from celery import shared_task
+from .catalog import prune_catalog, update_catalog
+import logging
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def update_earthquake_catalog():
+    """Pull new and revised USGS events into the local earthquake catalog"""
+    try:
+        feed, written = update_catalog()
+        pruned = prune_catalog()
+        return f"Earthquake catalog updated from the {feed} feed: {written} events written, {pruned} pruned"
+    except Exception as e:
+        logger.error(f"Error updating earthquake catalog: {str(e)}")
+        return f"Error updating earthquake catalog: {str(e)}"
@@ -1,3 +1,208 @@
-from django.test import TestCase
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from users.distance import haversine_distances
+from users.usgs_feed import FeedSnapshot
+from . import catalog
+from .catalog import catalog_snapshot, choose_feed, update_catalog
+from .fused_model import FusedEarthquakePredictor, FUSED_MODEL_PATH
+from .models import EarthquakeEvent
+
+try:
+    import torch
+except ImportError:
+    torch = None
 
 # Create your tests here.
+
+@unittest.skipIf(torch is None, "torch is not installed")
+class FusedEarthquakeModelTests(SimpleTestCase):
+    """The fused NumPy model must match the torch model it was exported from"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .torch_model import EarthquakePredictor
+        cls.torch_predictor = EarthquakePredictor()
+        cls.fused_predictor = FusedEarthquakePredictor(FUSED_MODEL_PATH)
+
+    def sample_features(self, n=500):
+        rng = np.random.default_rng(0)
+        return np.column_stack([
+            rng.uniform(-60, 60, n),     # latitude
+            rng.uniform(-180, 180, n),   # longitude
+            rng.integers(0, 50, n),      # number of recent earthquakes
+            rng.uniform(0, 8, n),        # max magnitude
+            rng.uniform(0, 1000, n),     # closest distance
+            rng.uniform(0, 200, n),      # total magnitude
+        ])
+
+    def test_batch_parity(self):
+        features = self.sample_features()
+        expected = self.torch_predictor.predict_batch(features)
+        actual = self.fused_predictor.predict_batch(features)
+        np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+    def test_single_parity(self):
+        features = [17.38, 78.48, 3, 4.5, 42.0, 12.1]
+        expected = self.torch_predictor.predict(features)
+        actual = self.fused_predictor.predict(features)
+        self.assertEqual(actual.shape, expected.shape)
+        np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+    def test_exported_weights_match_checkpoint(self):
+        from .torch_model import export_fused_model
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fused.npz')
+            export_fused_model(path, predictor=self.torch_predictor)
+            exported = FusedEarthquakePredictor(path)
+        features = self.sample_features(50)
+        np.testing.assert_allclose(
+            exported.predict_batch(features), self.fused_predictor.predict_batch(features)
+        )
+
+
+def feed_snapshot(events, etag):
+    """FeedSnapshot of (event_id, lat, lon, magnitude, time, updated) tuples"""
+    return FeedSnapshot(
+        [event[1] for event in events],
+        [event[2] for event in events],
+        [event[3] for event in events],
+        [int(event[4].timestamp() * 1000) for event in events],
+        [10.0] * len(events),
+        ids=[event[0] for event in events],
+        updated=[event[5] for event in events],
+        etag=etag,
+    )
+
+
+class CatalogUpdateTests(TestCase):
+    def setUp(self):
+        catalog._previous.clear()
+        self.addCleanup(catalog._previous.clear)
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def test_choose_feed_covers_time_since_last_update(self):
+        now = datetime(2024, 1, 10, tzinfo=timezone.utc)
+        self.assertEqual(choose_feed(None, now), 'month')
+        self.assertEqual(choose_feed(now - timedelta(minutes=30), now), 'hour')
+        # The 1.5x margin moves 50 minutes past the hour feed
+        self.assertEqual(choose_feed(now - timedelta(minutes=50), now), 'day')
+        self.assertEqual(choose_feed(now - timedelta(days=3), now), 'week')
+        self.assertEqual(choose_feed(now - timedelta(days=6), now), 'month')
+        self.assertEqual(choose_feed(now - timedelta(days=90), now), 'month')
+
+    def test_update_picks_feed_from_last_update(self):
+        last = self.now - timedelta(hours=3)
+        EarthquakeEvent.objects.create(
+            event_id='old', latitude=0, longitude=0, magnitude=3, time=last, updated=int(last.timestamp() * 1000),
+        )
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', return_value=feed_snapshot([], 'a')) as fetch:
+            feed, _ = update_catalog()
+        self.assertEqual(feed, 'day')
+        self.assertTrue(fetch.call_args.kwargs['url'].endswith('/all_day.geojson'))
+
+    def test_update_inserts_and_revises_events(self):
+        first = feed_snapshot([
+            ('us1', 10.0, 20.0, 4.5, self.now, 1),
+            ('us2', -5.0, 100.0, 5.1, self.now, 1),
+        ], 'a')
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', return_value=first):
+            self.assertEqual(update_catalog('day'), ('day', 2))
+
+        revised = feed_snapshot([
+            ('us1', 10.0, 20.0, 4.8, self.now, 2),
+            ('us3', 35.0, 139.0, 6.0, self.now, 1),
+        ], 'b')
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', return_value=revised) as fetch:
+            self.assertEqual(update_catalog('day'), ('day', 2))
+        # The second download revalidates against the first
+        self.assertIs(fetch.call_args.kwargs['previous'], first)
+
+        self.assertEqual(EarthquakeEvent.objects.count(), 3)
+        event = EarthquakeEvent.objects.get(event_id='us1')
+        self.assertEqual((event.magnitude, event.updated), (4.8, 2))
+
+    def test_unchanged_feed_writes_nothing(self):
+        snapshot = feed_snapshot([('us1', 10.0, 20.0, 4.5, self.now, 1)], 'a')
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', return_value=snapshot):
+            update_catalog('hour')
+            self.assertEqual(update_catalog('hour'), ('hour', 0))
+
+    def test_download_does_not_hold_the_lock(self):
+        def fetch(previous=None, url=None):
+            self.assertFalse(catalog._previous_lock.locked())
+            return feed_snapshot([], 'a')
+
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', side_effect=fetch):
+            update_catalog('hour')
+
+    def test_same_version_from_a_concurrent_update_is_skipped(self):
+        stored = feed_snapshot([('us1', 10.0, 20.0, 4.5, self.now, 1)], 'a')
+
+        def fetch(previous=None, url=None):
+            # Another update stores the same feed version during this download
+            catalog._previous['hour'] = stored
+            return feed_snapshot([('us1', 10.0, 20.0, 4.5, self.now, 1)], 'a')
+
+        with mock.patch('users.usgs_feed.fetch_feed_snapshot', side_effect=fetch):
+            self.assertEqual(update_catalog('hour'), ('hour', 0))
+        self.assertIs(catalog._previous['hour'], stored)
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        for event_id, lat, lon, magnitude, age, depth in [
+            ('recent', 10.0, 20.0, 4.5, timedelta(days=1), 12.0),
+            ('shallow', -5.0, 100.0, 5.1, timedelta(days=3), None),
+            ('old', 35.0, 139.0, 6.0, timedelta(days=40), 30.0),
+        ]:
+            EarthquakeEvent.objects.create(
+                event_id=event_id, latitude=lat, longitude=lon, magnitude=magnitude,
+                time=now - age, depth=depth, updated=1,
+            )
+
+    def test_snapshot_holds_events_in_window(self):
+        snapshot = catalog_snapshot(days=30)
+        # Oldest first
+        self.assertEqual(snapshot.ids.tolist(), ['shallow', 'recent'])
+        np.testing.assert_array_equal(snapshot.latitudes, [-5.0, 10.0])
+        np.testing.assert_array_equal(snapshot.magnitudes, [5.1, 4.5])
+        self.assertTrue(np.isnan(snapshot.depths[0]))
+        self.assertEqual(snapshot.depths[1], 12.0)
+        self.assertEqual(len(catalog_snapshot(days=60)), 3)
+
+    def test_unchanged_catalog_reuses_snapshot(self):
+        snapshot = catalog_snapshot(days=30)
+        self.assertIs(catalog_snapshot(days=30, previous=snapshot), snapshot)
+
+        EarthquakeEvent.objects.filter(event_id='recent').update(updated=2)
+        revised = catalog_snapshot(days=30, previous=snapshot)
+        self.assertIsNot(revised, snapshot)
+        self.assertNotEqual(revised.etag, snapshot.etag)
+
+
+class EventWithinRadiusTests(TestCase):
+    def test_matches_haversine_distances(self):
+        rng = np.random.default_rng(0)
+        now = datetime.now(timezone.utc)
+        # Include points across the antimeridian and near the poles
+        lats = np.concatenate([rng.uniform(-89, 89, 150), [1.0, -1.0, 88.5, 89.9]])
+        lons = np.concatenate([rng.uniform(-180, 180, 150), [179.9, -179.9, 10.0, -170.0]])
+        EarthquakeEvent.objects.bulk_create([
+            EarthquakeEvent(event_id=f'ev{i}', latitude=lat, longitude=lon, time=now, updated=0)
+            for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist()))
+        ])
+
+        for lat, lon, km in [(0.0, 180.0, 500), (89.0, 0.0, 300), (20.0, 40.0, 3000), (-60.0, -100.0, 1500)]:
+            distances = haversine_distances(lat, lon, lats, lons)
+            expected = {f'ev{i}' for i in np.flatnonzero(distances < km)}
+            rows = EarthquakeEvent.objects.within_radius(lat, lon, km).values_list('event_id', 'distance')
+            self.assertEqual({event_id for event_id, _ in rows}, expected)
+            for event_id, distance in rows:
+                self.assertAlmostEqual(distance, distances[int(event_id[2:])], places=3)
@@ -0,0 +1,192 @@
+import torch
+import torch.nn as nn
+import pickle
+import numpy as np
+import os
+from pathlib import Path
+from .fused_model import INPUT_SIZE, DEFAULT_MAX_BATCH_SIZE, pad_feature_rows, fold_earthquake_model
+
+class EarthquakeModel(nn.Module):
+    def __init__(self, input_size=22):
+        super(EarthquakeModel, self).__init__()
+        self.linear1 = nn.Linear(input_size, 128)
+        self.bn1 = nn.BatchNorm1d(128)
+        self.relu1 = nn.ReLU()
+        self.linear2 = nn.Linear(128, 64)
+        self.bn2 = nn.BatchNorm1d(64)
+        self.relu2 = nn.ReLU()
+        self.linear3 = nn.Linear(64, 32)
+        self.bn3 = nn.BatchNorm1d(32)
+        self.relu3 = nn.ReLU()
+        self.linear4 = nn.Linear(32, 1)
+        self.sigmoid = nn.Sigmoid()
+    
+    def forward(self, x):
+        x = self.linear1(x)
+        x = self.bn1(x)
+        x = self.relu1(x)
+        x = self.linear2(x)
+        x = self.bn2(x)
+        x = self.relu2(x)
+        x = self.linear3(x)
+        x = self.bn3(x)
+        x = self.relu3(x)
+        x = self.linear4(x)
+        x = self.sigmoid(x)
+        return x
+
+class EarthquakePredictor:
+    def __init__(self, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self.model = None
+        self.scaler = None
+        self.max_batch_size = max_batch_size
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.load_model()
+    
+    def load_model(self):
+        """Load the trained PyTorch model and scaler"""
+        try:
+            # Get the directory containing this file
+            current_dir = Path(__file__).parent
+            model_path = current_dir / 'models' / 'earthquake_model.pt'
+            scaler_path = current_dir / 'models' / 'earthquake_scaler.pkl'
+            
+            # Create model instance
+            self.model = EarthquakeModel()
+            
+            # Load the state dictionary
+            state_dict = torch.load(model_path, map_location=self.device)
+            
+            # Create mapping for layer indices to names
+            layer_mapping = {
+                '0': 'linear1',
+                '2': 'bn1',
+                '4': 'linear2',
+                '6': 'bn2',
+                '8': 'linear3',
+                '10': 'bn3',
+                '12': 'linear4'
+            }
+            
+            # Rename the keys to match our model's structure
+            new_state_dict = {}
+            for k, v in state_dict.items():
+                # Get the layer index (before the first dot)
+                layer_idx = k.split('.')[0]
+                if layer_idx in layer_mapping:
+                    # Get the layer name
+                    layer_name = layer_mapping[layer_idx]
+                    # Get the parameter name (after the first dot)
+                    param_name = k[k.find('.')+1:]
+                    # Create the new key
+                    new_key = f"{layer_name}.{param_name}"
+                    new_state_dict[new_key] = v
+            
+            self.model.load_state_dict(new_state_dict)
+            
+            # Set to evaluation mode
+            self.model.eval()
+            
+            # Load the scaler
+            with open(scaler_path, 'rb') as f:
+                self.scaler = pickle.load(f)
+                
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            raise
+    
+    def preprocess_data(self, features):
+        """Preprocess input features using the loaded scaler"""
+        if self.scaler is None:
+            raise ValueError("Scaler not loaded")
+        
+        # Ensure we have all 22 features
+        if len(features) < 22:
+            # Pad with zeros if we don't have all features
+            features = np.pad(features, (0, 22 - len(features)), 'constant')
+        
+        # Convert features to numpy array and reshape if needed
+        features = np.array(features).reshape(1, -1)
+        
+        # Scale the features
+        scaled_features = self.scaler.transform(features)
+        
+        # Convert to PyTorch tensor
+        return torch.FloatTensor(scaled_features).to(self.device)
+    
+    def preprocess_batch(self, features):
+        """Pad an (N, k) feature array to 22 columns and scale it in one call"""
+        if self.scaler is None:
+            raise ValueError("Scaler not loaded")
+        
+        return self.scaler.transform(pad_feature_rows(features))
+    
+    def predict(self, features):
+        """Make predictions using the loaded model"""
+        if self.model is None:
+            raise ValueError("Model not loaded")
+        
+        try:
+            # Preprocess the input features
+            input_tensor = self.preprocess_data(features)
+            
+            # Make prediction
+            with torch.no_grad():
+                prediction = self.model(input_tensor)
+            
+            # Convert prediction to numpy array
+            prediction = prediction.cpu().numpy()
+            
+            return prediction[0]
+            
+        except Exception as e:
+            print(f"Error making prediction: {str(e)}")
+            raise
+    
+    def predict_batch(self, features):
+        """
+        Make predictions for many rows at once.
+        
+        Args:
+            features: (N, k) array-like with k <= 22 features per row
+            
+        Returns:
+            np.ndarray: (N,) predicted probabilities
+        """
+        if self.model is None:
+            raise ValueError("Model not loaded")
+        if len(features) == 0:
+            return np.empty(0, dtype=np.float32)
+        
+        try:
+            scaled_features = torch.from_numpy(self.preprocess_batch(features).astype(np.float32))
+            
+            predictions = []
+            with torch.inference_mode():
+                for batch in torch.split(scaled_features, self.max_batch_size):
+                    predictions.append(self.model(batch.to(self.device)).cpu().numpy())
+            
+            return np.concatenate(predictions)[:, 0]
+            
+        except Exception as e:
+            print(f"Error making batch prediction: {str(e)}")
+            raise
+
+def export_fused_model(output_path, predictor=None):
+    """
+    Fold the scaler and BatchNorm layers of the trained model into plain
+    Linear weights and save them for the NumPy-only FusedEarthquakePredictor.
+    """
+    predictor = predictor or EarthquakePredictor()
+    state_dict = {k: v.detach().cpu().numpy() for k, v in predictor.model.state_dict().items()}
+    
+    layers = [('linear1', 'bn1'), ('linear2', 'bn2'), ('linear3', 'bn3'), ('linear4', None)]
+    eps = [getattr(predictor.model, bn).eps if bn else None for _, bn in layers]
+    
+    weights = fold_earthquake_model(state_dict, predictor.scaler, layers, eps)
+    arrays = {}
+    for i, (weight, bias) in enumerate(weights):
+        arrays[f'weight{i}'] = weight
+        arrays[f'bias{i}'] = bias
+    np.savez(output_path, **arrays)
+    return output_path
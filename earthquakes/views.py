@@ -1,6 +1,5 @@
 from django.shortcuts import render
 from django.http import HttpResponse
-import pywhatkit
 import datetime
 import time
 
@@ -25,7 +24,8 @@ def send_whatsapp_alert(phone_number, message):
         if phone_number.startswith('+'):
             phone_number = phone_number[1:]
         
-        # Send the WhatsApp message
+        # Send the WhatsApp message; pywhatkit pulls in pyautogui and a display, so load it only here
+        import pywhatkit
         pywhatkit.sendwhatmsg(f"+{phone_number}", message, hour, minute, wait_time=15)
         return {'success': True}
     
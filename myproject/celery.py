@@ -1,5 +1,7 @@
 import os
 from celery import Celery
+from celery.signals import worker_init
+from django.conf import settings
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
@@ -20,6 +22,38 @@ app.conf.beat_schedule = {
             'retry': False,    # Don't auto-retry on failure
         }
     },
+    'watch-usgs-events': {
+        'task': 'users.tasks.watch_usgs_events',
+        'schedule': float(os.getenv('EARTHQUAKE_WATCH_INTERVAL', 45)),  # Low-latency path alongside the 15 minute check
+        'options': {
+            'expires': 40.0,
+            'retry': False,
+        }
+    },
+    'update-earthquake-catalog': {
+        'task': 'earthquakes.tasks.update_earthquake_catalog',
+        'schedule': 300.0,  # The hour feed is regenerated every minute
+        'options': {
+            'expires': 290.0,
+            'retry': False,
+        }
+    },
+    'deliver-outbound-messages': {
+        'task': 'users.tasks.deliver_outbound_messages',
+        'schedule': 60.0,  # Picks up retries and anything left by a stopped worker
+        'options': {
+            'expires': 55.0,
+            'retry': False,
+        }
+    },
+    'refresh-risk-grid': {
+        'task': 'users.tasks.refresh_risk_grid',
+        'schedule': float(settings.RISK_GRID_REFRESH_INTERVAL),  # Derived from the weather calls of one refresh
+        'options': {
+            'expires': settings.RISK_GRID_REFRESH_INTERVAL - 10.0,
+            'retry': False,
+        }
+    },
 }
 
 # Additional Celery configurations
@@ -34,7 +68,21 @@ app.conf.update(
     task_acks_late=True,  # Acknowledge tasks after they are executed, not before
     task_reject_on_worker_lost=True,  # Reject tasks if worker is disconnected
     task_remote_tracebacks=True,  # More detailed remote tracebacks
+    task_routes={
+        # Notifications get their own queue so slow SMTP/WhatsApp sends never hold up risk shards
+        'users.tasks.send_alert_emails_task': {'queue': 'alerts'},
+        # WhatsApp delivery runs on its own worker so browser automation never blocks email alerts
+        'users.tasks.deliver_outbound_messages': {'queue': 'messages'},
+    },
 )
 
 # Auto-discover tasks in all installed apps
-app.autodiscover_tasks() 
\ No newline at end of file
+app.autodiscover_tasks() 
+
+@worker_init.connect
+def preload_prediction_models(**kwargs):
+    """Load the prediction models before the pool forks, so child processes share them"""
+    from cyclones.model_utils import get_cyclone_model
+    from earthquakes.model_utils import get_predictor
+    get_cyclone_model()
+    get_predictor()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import math
 import os
 from dotenv import load_dotenv
 
@@ -82,12 +83,54 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Set DATABASE_ENGINE=postgresql in production: SQLite allows a single writer at a time,
+# which Celery workers and web requests then queue behind
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite')
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'False') == 'True'  # psycopg connection pool, needs psycopg[pool]
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DATABASE_NAME', 'disaster_prediction'),
+            'USER': os.getenv('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
+            'HOST': os.getenv('DATABASE_HOST', 'localhost'),
+            'PORT': os.getenv('DATABASE_PORT', '5432'),
+            # Connections are reused across requests and tasks; the pool manages its own instead
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,  # Replace connections the server closed before reusing them
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DATABASE_CONNECT_TIMEOUT', 10)),
+            },
+        }
+    }
+    if DATABASE_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 20)),  # Per process, keep workers * this below max_connections
+            'timeout': int(os.getenv('DATABASE_POOL_TIMEOUT', 10)),  # Seconds to wait for a free connection
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Seconds a writer waits for the lock instead of failing with "database is locked"
+                'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+                # Take the write lock when a transaction starts, so it never fails to upgrade midway
+                'transaction_mode': 'IMMEDIATE',
+                # WAL lets readers run alongside the writer; NORMAL sync is safe with WAL
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -156,9 +199,100 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 # Go to Google Account -> Security -> 2-Step Verification -> App Passwords
 # Create a new app password for 'Mail'
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 100))  # Alerts sent per SMTP connection
+EMAIL_RATE_LIMIT = int(os.getenv('EMAIL_RATE_LIMIT', 60))  # Emails per minute per worker process, 0 = unlimited
+EMAIL_RETRY_DELAY = int(os.getenv('EMAIL_RETRY_DELAY', 30))  # Seconds before failed alerts are retried, doubled each retry
+ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', 21600))  # Seconds before an unchanged risk is alerted again, 0 = every cycle
+ALERT_ESCALATION_STEP = int(os.getenv('ALERT_ESCALATION_STEP', 1))  # Level increase that is alerted even within the cooldown
+
+# WhatsApp Configuration
+# 'browser' automates WhatsApp Web on the worker's desktop, 'http' posts to a messaging API
+WHATSAPP_PROVIDER = os.getenv('WHATSAPP_PROVIDER', 'browser')
+WHATSAPP_API_URL = os.getenv('WHATSAPP_API_URL', '')  # e.g. https://graph.facebook.com/v19.0/<phone-number-id>/messages
+WHATSAPP_API_TOKEN = os.getenv('WHATSAPP_API_TOKEN', '')
+WHATSAPP_API_TIMEOUT = int(os.getenv('WHATSAPP_API_TIMEOUT', 10))  # Seconds per API request
+WHATSAPP_CONCURRENCY = int(os.getenv('WHATSAPP_CONCURRENCY', 8))  # Concurrent sends with the http provider, the browser sends one at a time
+WHATSAPP_BATCH_SIZE = int(os.getenv('WHATSAPP_BATCH_SIZE', 50))  # Outbox messages claimed at once
+WHATSAPP_MAX_ATTEMPTS = int(os.getenv('WHATSAPP_MAX_ATTEMPTS', 5))  # Sends before a message is marked failed
+WHATSAPP_RETRY_DELAY = int(os.getenv('WHATSAPP_RETRY_DELAY', 30))  # Seconds before a failed message is retried, doubled each retry
+WHATSAPP_SEND_TIMEOUT = int(os.getenv('WHATSAPP_SEND_TIMEOUT', 60))  # Seconds allowed per send
+WHATSAPP_CLAIM_TIMEOUT = int(os.getenv('WHATSAPP_CLAIM_TIMEOUT', 600))  # Seconds before a message stuck in 'sending' is claimed again
+WHATSAPP_DELIVERY_DEADLINE = int(os.getenv('WHATSAPP_DELIVERY_DEADLINE', 300))  # Seconds one delivery run keeps draining the outbox
 
 # OpenWeatherMap Configuration
 OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
+OPENWEATHERMAP_CACHE_TTL = int(os.getenv('OPENWEATHERMAP_CACHE_TTL', 600))  # Seconds a cached response is reused
+OPENWEATHERMAP_GRID_DEGREES = float(os.getenv('OPENWEATHERMAP_GRID_DEGREES', 0.1))  # Cache cell size (~11 km)
+OPENWEATHERMAP_RATE_LIMIT = int(os.getenv('OPENWEATHERMAP_RATE_LIMIT', 60))  # Calls per minute (free plan limit)
+OPENWEATHERMAP_TIMEOUT = int(os.getenv('OPENWEATHERMAP_TIMEOUT', 10))  # Seconds per request
+
+# USGS Earthquake Feed Configuration
+USGS_FEED_URL = os.getenv('USGS_FEED_URL', 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson')
+USGS_FEED_MAX_AGE = int(os.getenv('USGS_FEED_MAX_AGE', 300))  # Seconds before the shared feed snapshot is revalidated
+# 'catalog' builds snapshots from the local EarthquakeEvent catalog, kept current by update_earthquake_catalog,
+# instead of downloading the month feed
+USGS_FEED_SOURCE = os.getenv('USGS_FEED_SOURCE', 'feed')
+EARTHQUAKE_CATALOG_WINDOW_DAYS = int(os.getenv('EARTHQUAKE_CATALOG_WINDOW_DAYS', 30))  # Days of catalog events risk checks see
+EARTHQUAKE_CATALOG_RETENTION_DAYS = int(os.getenv('EARTHQUAKE_CATALOG_RETENTION_DAYS', 0))  # Days of history kept, 0 keeps everything
+EARTHQUAKE_INCREMENTAL = os.getenv('EARTHQUAKE_INCREMENTAL', 'True') == 'True'  # Reuse earthquake risk for locations away from changed USGS events
+EARTHQUAKE_RISK_CACHE_SIZE = int(os.getenv('EARTHQUAKE_RISK_CACHE_SIZE', 200000))  # Locations kept in the incremental earthquake risk cache
+EARTHQUAKE_WATCH_FEEDS = os.getenv('EARTHQUAKE_WATCH_FEEDS', 'all_hour').split(',')  # USGS summary feeds polled by watch_usgs_events, e.g. significant_hour
+EARTHQUAKE_WATCH_MIN_MAGNITUDE = float(os.getenv('EARTHQUAKE_WATCH_MIN_MAGNITUDE', 4.0))  # Smaller new events wait for the regular check
+
+# Risk Evaluation Configuration
+RISK_MAX_WORKERS = int(os.getenv('RISK_MAX_WORKERS', 16))  # Threads evaluating locations and sending alerts
+RISK_LOCATION_TIMEOUT = int(os.getenv('RISK_LOCATION_TIMEOUT', 60))  # Seconds allowed per location or alert
+RISK_CYCLE_DEADLINE = int(os.getenv('RISK_CYCLE_DEADLINE', 840))  # Seconds per cycle, below the 900s beat interval
+RISK_UPSTREAM_CONCURRENCY = {  # Concurrent calls allowed per upstream service
+    'openweathermap': int(os.getenv('RISK_OPENWEATHERMAP_CONCURRENCY', 8)),
+    'smtp': int(os.getenv('RISK_SMTP_CONCURRENCY', 4)),
+    'whatsapp': WHATSAPP_CONCURRENCY if WHATSAPP_PROVIDER == 'http' else 1,  # Browser automation sends one message at a time
+}
+RISK_DEDUP_CELL_DEGREES = float(os.getenv('RISK_DEDUP_CELL_DEGREES', 0.01))  # Subscribers in one cell share an evaluation, 0 = exact coordinates only
+RISK_SHARD_SIZE = int(os.getenv('RISK_SHARD_SIZE', 500))  # Subscribers per evaluate_subscriber_shard task
+RISK_CHUNK_SIZE = int(os.getenv('RISK_CHUNK_SIZE', 500))  # Subscribers loaded and evaluated at a time within a shard
+RISK_SHARD_RETRY_DELAY = int(os.getenv('RISK_SHARD_RETRY_DELAY', 10))  # Seconds before a failed shard's first retry, doubled each retry
+
+# Cache Configuration
+# Set CACHE_URL (e.g. redis://localhost:6379/1) to share cached risk tiles between web processes
+CACHE_URL = os.getenv('CACHE_URL', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Risk Grid Configuration
+RISK_GRID_DIR = Path(os.getenv('RISK_GRID_DIR', BASE_DIR / 'risk_grid'))  # Where refresh_risk_grid stores the .npz grids
+RISK_GRID_MAX_AGE = int(os.getenv('RISK_GRID_MAX_AGE', 1800))  # Seconds before a served grid is flagged as stale
+RISK_GRID_WEATHER_POINTS = int(os.getenv('RISK_GRID_WEATHER_POINTS', 6))  # Weather lattice points per axis, cyclone risk of the grids is interpolated from them
+RISK_GRID_WEATHER_RATE_LIMIT = int(os.getenv('RISK_GRID_WEATHER_RATE_LIMIT', 10))  # Calls per minute of OPENWEATHERMAP_RATE_LIMIT reserved for the grids, 0 = unlimited
+# A refresh makes two weather calls (current and forecast) per lattice point, and must
+# fit the grid budget with a 25% margin before the next one starts
+RISK_GRID_REFRESH_INTERVAL = max(
+    int(os.getenv('RISK_GRID_REFRESH_INTERVAL', 300)),  # Shortest interval between grid refreshes in seconds
+    math.ceil(2 * RISK_GRID_WEATHER_POINTS ** 2 * 60 / RISK_GRID_WEATHER_RATE_LIMIT * 1.25) if RISK_GRID_WEATHER_RATE_LIMIT else 0,
+)
+# 'adaptive' evaluates a coarse heatmap grid and refines it by quadtree only where risk is high or changing
+RISK_GRID_MODE = os.getenv('RISK_GRID_MODE', 'uniform')
+RISK_GRID_BASE_CELLS = int(os.getenv('RISK_GRID_BASE_CELLS', 7))  # Coarse cells per axis before refinement
+RISK_GRID_MAX_DEPTH = int(os.getenv('RISK_GRID_MAX_DEPTH', 3))  # Times a cell can be split, 7 * 2**3 = 56 intervals per axis
+RISK_GRID_BUDGET = int(os.getenv('RISK_GRID_BUDGET', 1200))  # Most point evaluations per adaptive grid
+RISK_GRID_REFINE_LEVEL = int(os.getenv('RISK_GRID_REFINE_LEVEL', 2))  # Split cells with a corner at or above this risk level
+RISK_GRID_REFINE_GRADIENT = int(os.getenv('RISK_GRID_REFINE_GRADIENT', 1))  # Split cells whose corner risk levels differ this much
+RISK_MAP_ARTIFACTS_KEPT = int(os.getenv('RISK_MAP_ARTIFACTS_KEPT', 3))  # Rendered heatmap versions kept on disk
+RISK_TILE_MAX_ZOOM = int(os.getenv('RISK_TILE_MAX_ZOOM', 12))  # Deepest tile zoom the tile endpoint serves
+RISK_TILE_DATA_ZOOM = int(os.getenv('RISK_TILE_DATA_ZOOM', 6))  # Tile zoom the map fetches at once zoomed in further; the grid is coarser than this
+RISK_TILE_CACHE_TTL = int(os.getenv('RISK_TILE_CACHE_TTL', 3600))  # Seconds a rendered tile stays in the cache
+
+# Earthquake Model Configuration
+# 'numpy' runs the fused weights exported by `manage.py export_earthquake_model` without torch;
+# 'torch' always loads the original PyTorch model
+EARTHQUAKE_INFERENCE_BACKEND = os.getenv('EARTHQUAKE_INFERENCE_BACKEND', 'numpy')
+EARTHQUAKE_MAX_BATCH_SIZE = int(os.getenv('EARTHQUAKE_MAX_BATCH_SIZE', 1024))  # Rows per forward pass
 
 # Logging Configuration
 LOGGING = {
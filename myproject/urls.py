@@ -27,5 +27,7 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path('earthquakes/', include('earthquakes.urls')),
     path('risk-map/', views.risk_heatmap_view, name='risk_heatmap'),
+    path('risk-map/frame/', views.risk_map_frame, name='risk_map_frame'),
+    path('risk-map/tiles/<int:z>/<int:x>/<int:y>.geojson', views.risk_tile, name='risk_tile'),
     path('api/risk-data/', views.risk_data_api, name='risk_data_api'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -25,18 +25,19 @@ def terminate_process():
     print("\nTerminating Celery worker and beat...")
     os.kill(os.getpid(), signal.SIGTERM)
 
-def run_celery_worker():
-    """Start Celery worker using the solo pool (better for Windows)."""
-    print("Starting Celery worker...")
+def run_celery_worker(name, queues, concurrency):
+    """Start a Celery worker using the threads pool (prefork is unsupported on Windows)."""
+    print(f"Starting Celery {name} worker...")
     cmd = [
         sys.executable, "-m", 
         "celery", "-A", "myproject", "worker",
-        "--pool=solo", "--loglevel=info",
+        "--pool=threads", f"--concurrency={concurrency}",
+        f"--queues={queues}", f"--hostname={name}@%h", "--loglevel=info",
         "--without-gossip", "--without-mingle", 
     ]
     
     worker_process = subprocess.Popen(cmd)
-    print(f"Celery worker started with PID: {worker_process.pid}")
+    print(f"Celery {name} worker started with PID: {worker_process.pid}")
     return worker_process
 
 def run_celery_beat():
@@ -65,9 +66,14 @@ if __name__ == "__main__":
     print("=== Starting Celery processes for Disaster Prediction System ===")
     print("Press Ctrl+C to stop all processes")
     
-    # Start worker and beat in separate processes
-    worker_process = run_celery_worker()
-    time.sleep(3)  # Wait for worker to initialize
+    # Start the workers and beat in separate processes. WhatsApp delivery gets its own
+    # worker, as routed in myproject/celery.py, so browser automation never blocks risk
+    # shards or email alerts.
+    worker_process = run_celery_worker(
+        "main", "celery,alerts", os.getenv('CELERY_WORKER_CONCURRENCY', 4)
+    )
+    messages_process = run_celery_worker("messages", "messages", 1)
+    time.sleep(3)  # Wait for the workers to initialize
     beat_process = run_celery_beat()
     
     # Register signal handlers for graceful shutdown
@@ -75,6 +81,7 @@ if __name__ == "__main__":
         print("\nShutting down Celery processes...")
         beat_process.terminate()
         worker_process.terminate()
+        messages_process.terminate()
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
@@ -22,52 +22,92 @@ logger = logging.getLogger(__name__)
 import django
 django.setup()
 
-from users.models import UserSubscription
-from users.tasks import check_cyclone_risk, check_earthquake_risk, send_disaster_alert
+from users.models import AlertLedger, UserSubscription
+from users.tasks import evaluate_subscriber_risks
+from users.outbox import deliver_due_messages, enqueue_whatsapp_alerts
+from users.alert_queue import chunk_alerts, send_alert_emails
+from users.alert_ledger import record_alerts, select_new_alerts
+from users.subscribers import backfill_grid_cells, iter_subscriber_chunks
 
 def run_disaster_check():
     """Run the disaster prediction check directly."""
     logger.info("Starting manual disaster prediction check...")
     
-    # Get all user subscriptions
-    users = UserSubscription.objects.all()
-    logger.info(f"Found {users.count()} user subscriptions")
+    # Count user subscriptions
+    users_count = UserSubscription.objects.count()
+    logger.info(f"Found {users_count} user subscriptions")
     
-    if users.count() == 0:
+    if users_count == 0:
         logger.warning("No user subscriptions found. Nothing to check.")
         return
     
-    # Process each user subscription
-    for user in users:
+    # Stream subscribers in chunks so memory stays flat however many there are
+    backfill_grid_cells()
+    for users in iter_subscriber_chunks():
+        check_subscribers(users)
+    
+    logger.info("Manual disaster check completed successfully!")
+
+def check_subscribers(users):
+    """Evaluate one chunk of subscribers and send their alerts."""
+    # Evaluate each distinct location once and share the result with its subscribers
+    cyclone_risks, earthquake_risks, dedup_stats = evaluate_subscriber_risks(users)
+    logger.info(
+        f"Evaluated {dedup_stats['locations']} unique locations for {dedup_stats['subscribers']} users "
+        f"(dedup ratio {dedup_stats['dedup_ratio']:.2f}x, ~{dedup_stats['time_saved']:.1f}s saved)"
+    )
+    
+    # Process each user subscription, collecting alerts to send in batches
+    candidates = []
+    for user, cyclone_risk, earthquake_risk in zip(users, cyclone_risks, earthquake_risks):
         logger.info(f"Checking user: {user.email} at location {user.primary_location_name}")
         
         # Check for cyclones
-        logger.info(f"Checking cyclone risk at {user.latitude}, {user.longitude}...")
-        cyclone_risk = check_cyclone_risk(user.latitude, user.longitude)
         logger.info(f"Cyclone risk level: {cyclone_risk['risk_level']}, details: {cyclone_risk['details']}")
         
         if cyclone_risk['risk_level'] > 0:
-            logger.info(f"ALERT: Cyclone risk detected for {user.email}! Sending alert...")
-            send_disaster_alert(
+            logger.info(f"ALERT: Cyclone risk detected for {user.email}!")
+            candidates.append((
                 user, 
+                AlertLedger.CYCLONE,
+                cyclone_risk['risk_level'],
                 'Cyclone Alert', 
                 f"Potential cyclone detected in your area!\nRisk Level: {cyclone_risk['risk_level']}\n{cyclone_risk['details']}"
-            )
+            ))
         
         # Check for earthquakes
-        logger.info(f"Checking earthquake risk at {user.latitude}, {user.longitude}...")
-        earthquake_risk = check_earthquake_risk(user.latitude, user.longitude)
         logger.info(f"Earthquake risk level: {earthquake_risk['risk_level']}, details: {earthquake_risk['details']}")
         
         if earthquake_risk['risk_level'] > 0:
-            logger.info(f"ALERT: Earthquake risk detected for {user.email}! Sending alert...")
-            send_disaster_alert(
+            logger.info(f"ALERT: Earthquake risk detected for {user.email}!")
+            candidates.append((
                 user, 
+                AlertLedger.EARTHQUAKE,
+                earthquake_risk['risk_level'],
                 'Earthquake Alert', 
                 f"Potential earthquake risk in your area!\nRisk Level: {earthquake_risk['risk_level']}\n{earthquake_risk['details']}"
-            )
+            ))
     
-    logger.info("Manual disaster check completed successfully!")
+    # Skip risks that were already alerted within the cooldown and have not escalated
+    selected, suppressed = select_new_alerts(candidates)
+    if suppressed:
+        logger.info(f"Suppressed {suppressed} repeat alerts")
+    alerts = [(user, subject, message) for user, _, _, subject, message in selected]
+    
+    # Send emails over one SMTP connection per batch, then WhatsApp messages
+    logger.info(f"Sending {len(alerts)} alerts...")
+    failed = []
+    for batch in chunk_alerts(alerts):
+        failed.extend(send_alert_emails(batch))
+    if failed:
+        logger.warning(f"{len(failed)} email alerts could not be sent")
+    if enqueue_whatsapp_alerts(alerts):
+        stats = deliver_due_messages()
+        logger.info(f"WhatsApp alerts: {stats['sent']} sent, {stats['failed']} failed, {stats['timed_out']} timed out")
+    
+    # Alerts whose email failed are left out of the ledger, so the next run sends them again
+    unsent = {(user.pk, subject) for (user, subject, _), _ in failed}
+    record_alerts([alert for alert in selected if (alert[0].pk, alert[3]) not in unsent])
 
 if __name__ == "__main__":
     print("=== Running Manual Disaster Prediction Check ===")
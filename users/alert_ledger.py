@@ -0,0 +1,135 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import AlertLedger
+
+logger = logging.getLogger(__name__)
+
+
+def alert_cell(lat, lon, cell_degrees=None):
+    """Ledger key of the location cell containing (lat, lon)"""
+    if cell_degrees is None:
+        cell_degrees = getattr(settings, 'RISK_DEDUP_CELL_DEGREES', 0.01)
+    if not cell_degrees:
+        return f'{round(lat, 6)}:{round(lon, 6)}'
+    return f'{int(lat // cell_degrees)}:{int(lon // cell_degrees)}'
+
+
+def should_send(entry, level, now, cooldown, escalation_step):
+    """
+    Whether a risk of `level` is worth an alert given the last one sent.
+
+    A risk is sent when nothing was sent for it within the cooldown, or when
+    its level rose at least `escalation_step` above the last alert.
+    """
+    if entry is None or entry.last_alerted_at <= now - cooldown:
+        return True
+    return level >= entry.level + escalation_step
+
+
+def _ledger_entries(keys):
+    """Ledger entries for (subscription_id, hazard, source) keys, by key"""
+    if not keys:
+        return {}
+    return {
+        (entry.subscription_id, entry.hazard, entry.source): entry
+        for entry in AlertLedger.objects.filter(
+            subscription_id__in={key[0] for key in keys},
+            hazard__in={key[1] for key in keys},
+        )
+    }
+
+
+def alert_key(user, hazard, source=None):
+    """
+    Ledger key of an alert about `hazard` for a subscriber.
+
+    Alerts about a specific hazard source, like a USGS event, are keyed by
+    it, so a new event is never suppressed by an alert about an earlier one.
+    Periodic risk checks have no source and are keyed by the subscriber's
+    location cell: a risk that persists is not repeated while the subscriber
+    stays in the same RISK_DEDUP_CELL_DEGREES cell, but moving to another
+    cell is alerted again.
+    """
+    return user.pk, hazard, source or alert_cell(user.latitude, user.longitude)
+
+
+def select_new_alerts(candidates, now=None, source=None):
+    """
+    Drop alerts that repeat one already sent, without changing the ledger.
+
+    The alerts returned are only recorded by record_alerts once they have been
+    handed off, so an alert that fails to queue is selected again on retry.
+
+    Args:
+        candidates: (user, hazard, level, subject, message) tuples
+        source: Hazard source the candidates are about, see alert_key
+
+    Returns:
+        tuple: (selected, suppressed) where selected holds the candidates to
+        send and suppressed is the number of candidates dropped
+    """
+    if not candidates:
+        return [], 0
+
+    now = now or timezone.now()
+    cooldown = timedelta(seconds=getattr(settings, 'ALERT_COOLDOWN', 21600))
+    escalation_step = getattr(settings, 'ALERT_ESCALATION_STEP', 1)
+
+    keys = [alert_key(user, hazard, source) for user, hazard, *_ in candidates]
+    entries = _ledger_entries(keys)
+    selected = [
+        candidate for key, candidate in zip(keys, candidates)
+        if should_send(entries.get(key), candidate[2], now, cooldown, escalation_step)
+    ]
+    suppressed = len(candidates) - len(selected)
+    if suppressed:
+        logger.info(f"Suppressed {suppressed} of {len(candidates)} alerts already sent within the cooldown")
+    return selected, suppressed
+
+
+def record_alerts(selected, now=None, source=None):
+    """Record alerts returned by select_new_alerts as sent, in one upsert"""
+    if not selected:
+        return
+    now = now or timezone.now()
+    updates = {}
+    for user, hazard, level, _, _ in selected:
+        updates[alert_key(user, hazard, source)] = level
+    entries = _ledger_entries(list(updates))
+
+    AlertLedger.objects.bulk_create(
+        [
+            AlertLedger(
+                subscription_id=key[0],
+                hazard=key[1],
+                source=key[2],
+                level=level,
+                alert_count=entries[key].alert_count + 1 if key in entries else 1,
+                first_alerted_at=entries[key].first_alerted_at if key in entries else now,
+                last_alerted_at=now,
+            )
+            for key, level in updates.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['subscription', 'hazard', 'source'],
+        update_fields=['level', 'alert_count', 'last_alerted_at'],
+    )
+
+
+def release_alerts(keys):
+    """Forget alerts that could not be delivered, so the next cycle sends them again"""
+    released = 0
+    for subscription_id, hazard, source in set(keys):
+        deleted, _ = AlertLedger.objects.filter(subscription_id=subscription_id, hazard=hazard, source=source).delete()
+        released += deleted
+    return released
+
+
+def prune_alert_ledger(now=None):
+    """Delete entries whose cooldown has passed, since they no longer suppress anything"""
+    now = now or timezone.now()
+    cooldown = timedelta(seconds=getattr(settings, 'ALERT_COOLDOWN', 21600))
+    deleted, _ = AlertLedger.objects.filter(last_alerted_at__lt=now - cooldown).delete()
+    return deleted
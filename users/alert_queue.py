@@ -0,0 +1,84 @@
+import threading
+import logging
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from .risk_engine import upstream_slot
+from .rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def build_alert_email(user, subject, message):
+    return EmailMessage(
+        subject=subject,
+        body=message,
+        from_email=settings.EMAIL_HOST_USER,
+        to=[user.email],
+    )
+
+
+_email_limiter = None
+_email_limiter_lock = threading.Lock()
+
+
+def get_email_rate_limiter():
+    """Process-wide limiter for EMAIL_RATE_LIMIT messages per minute, None when unlimited"""
+    global _email_limiter
+    rate = getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+    if not rate:
+        return None
+    if _email_limiter is None:
+        with _email_limiter_lock:
+            if _email_limiter is None:
+                _email_limiter = RateLimiter(rate, 60.0)
+    return _email_limiter
+
+
+def send_alert_emails(alerts, connection=None):
+    """
+    Send (user, subject, message) alerts over one SMTP connection.
+
+    Messages go out one at a time on the open connection, so a failure is
+    attributed to the exact alert instead of the whole batch. The connection
+    is reopened once if the server drops it mid-batch.
+
+    Returns:
+        list: (alert, exception) pairs for the alerts that were not sent
+    """
+    failed = []
+    if not alerts:
+        return failed
+
+    limiter = get_email_rate_limiter()
+    connection = connection or get_connection(fail_silently=False)
+    with upstream_slot('smtp'):
+        attempted = 0
+        try:
+            connection.open()
+            for alert in alerts:
+                attempted += 1
+                user, subject, message = alert
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    connection.send_messages([build_alert_email(user, subject, message)])
+                    logger.info(f"Email alert sent to {user.email}")
+                except Exception as e:
+                    logger.error(f"Error sending email alert to {user.email}: {str(e)}")
+                    failed.append((alert, e))
+                    # The connection may be unusable after an error, start a fresh one
+                    connection.close()
+                    connection.open()
+        except Exception as e:
+            # Could not (re)connect, so nothing after this point was attempted
+            logger.error(f"SMTP connection error: {str(e)}")
+            failed.extend((alert, e) for alert in alerts[attempted:])
+        finally:
+            connection.close()
+    return failed
+
+
+def chunk_alerts(alerts, size=None):
+    """Split alerts into the batches sent per connection"""
+    size = size or getattr(settings, 'EMAIL_BATCH_SIZE', 100)
+    return [alerts[start:start + size] for start in range(0, len(alerts), size)]
@@ -0,0 +1,86 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _haversine(lat1, lon1, lat2, lon2, dtype):
+    """Haversine distance on radian inputs that broadcast against each other"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    # Rounding can push a slightly above 1 for antipodal points
+    a = np.clip(a, 0, 1)
+    return (2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).astype(dtype, copy=False)
+
+
+def _to_radians(values, dtype):
+    return np.radians(np.asarray(values, dtype=dtype))
+
+
+def haversine_distances(lat, lon, lats, lons, dtype=np.float64):
+    """
+    Distances in kilometers from one point to many points.
+
+    Args:
+        lat, lon: Coordinates of the origin in degrees
+        lats, lons: Array-likes of target coordinates in degrees
+        dtype: np.float64, or np.float32 to halve memory and time at the cost
+            of precision (errors of a few km over continental distances)
+
+    Returns:
+        np.ndarray: Distances with the same shape as lats
+    """
+    return _haversine(
+        _to_radians(lat, dtype), _to_radians(lon, dtype),
+        _to_radians(lats, dtype), _to_radians(lons, dtype),
+        dtype,
+    )
+
+
+def iter_haversine_chunks(lats1, lons1, lats2, lons2, chunk_size=1024, dtype=np.float64):
+    """
+    Yield the many-to-many distance matrix in row blocks.
+
+    Lets callers reduce each block (e.g. min or count within a radius)
+    without ever holding the full len(lats1) x len(lats2) matrix.
+
+    Yields:
+        tuple: (start_row, block) where block has shape (rows, len(lats2))
+    """
+    rlat1, rlon1 = _to_radians(lats1, dtype), _to_radians(lons1, dtype)
+    rlat2, rlon2 = _to_radians(lats2, dtype)[np.newaxis, :], _to_radians(lons2, dtype)[np.newaxis, :]
+    for start in range(0, len(rlat1), chunk_size):
+        stop = start + chunk_size
+        yield start, _haversine(
+            rlat1[start:stop, np.newaxis], rlon1[start:stop, np.newaxis],
+            rlat2, rlon2, dtype,
+        )
+
+
+def haversine_matrix(lats1, lons1, lats2, lons2, dtype=np.float64, chunk_size=None):
+    """
+    Distance matrix in kilometers between two sets of points.
+
+    Args:
+        lats1, lons1: Row points in degrees
+        lats2, lons2: Column points in degrees
+        dtype: np.float64 or np.float32
+        chunk_size: Rows computed at a time, bounding temporary arrays to
+            chunk_size x len(lats2) instead of the full matrix size
+
+    Returns:
+        np.ndarray: Matrix of shape (len(lats1), len(lats2))
+    """
+    if chunk_size is None:
+        return _haversine(
+            _to_radians(lats1, dtype)[:, np.newaxis], _to_radians(lons1, dtype)[:, np.newaxis],
+            _to_radians(lats2, dtype)[np.newaxis, :], _to_radians(lons2, dtype)[np.newaxis, :],
+            dtype,
+        )
+
+    result = np.empty((len(lats1), len(lats2)), dtype=dtype)
+    for start, block in iter_haversine_chunks(lats1, lons1, lats2, lons2, chunk_size, dtype):
+        result[start:start + len(block)] = block
+    return result
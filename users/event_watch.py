@@ -0,0 +1,155 @@
+import threading
+import time
+import logging
+from collections import deque
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .models import HandledEvent
+from .usgs_feed import fetch_feed_snapshot
+
+logger = logging.getLogger(__name__)
+
+USGS_SUMMARY_URL = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary'
+
+# Events are remembered as handled for longer than the hour feeds keep them
+HANDLED_TTL = 3 * 3600
+
+# Pending events that still could not be evaluated after this long are dropped
+PENDING_TTL = 2 * 3600
+
+# Time-to-alert samples kept for the reported percentiles
+STATS_WINDOW = 500
+
+
+class EventWatcher:
+    """
+    Detects new USGS events by polling small summary feeds with conditional GETs.
+
+    An event is returned by poll() until it is marked handled, so one that
+    could not be evaluated yet is picked up again on the next poll even when
+    the feed itself has not changed. Handled events are stored in the
+    database, so every worker process polling the feeds skips them, and an
+    event is claimed before its subscribers are alerted, so only one of them
+    alerts it.
+    """
+
+    def __init__(self):
+        self._previous = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=STATS_WINDOW)
+        self.events = 0
+        self.alerts = 0
+
+    def poll(self, feeds=None, min_magnitude=None):
+        """
+        New events with at least min_magnitude from the watched feeds.
+
+        Returns:
+            tuple: (events, snapshots) where events is a list of dicts with
+            event_id, latitude, longitude, magnitude, depth and time (epoch ms),
+            and snapshots holds the FeedSnapshot of each feed that changed
+        """
+        if feeds is None:
+            feeds = getattr(settings, 'EARTHQUAKE_WATCH_FEEDS', ['all_hour'])
+        if min_magnitude is None:
+            min_magnitude = getattr(settings, 'EARTHQUAKE_WATCH_MIN_MAGNITUDE', 4.0)
+
+        snapshots = []
+        with self._lock:
+            for feed in feeds:
+                previous = self._previous.get(feed)
+                try:
+                    snapshot = fetch_feed_snapshot(previous=previous, url=f'{USGS_SUMMARY_URL}/{feed}.geojson', timeout=10)
+                except Exception as e:
+                    logger.error(f"Error polling USGS {feed} feed: {str(e)}")
+                    continue
+                self._previous[feed] = snapshot
+                if snapshot is previous:
+                    continue
+                snapshots.append(snapshot)
+
+                selected = np.flatnonzero(snapshot.magnitudes >= min_magnitude).tolist()
+                handled = set(HandledEvent.objects.filter(
+                    event_id__in=[str(snapshot.ids[i]) for i in selected]
+                ).values_list('event_id', flat=True))
+                for i in selected:
+                    event_id = str(snapshot.ids[i])
+                    if event_id in self._pending or event_id in handled:
+                        continue
+                    depth = float(snapshot.depths[i])
+                    self._pending[event_id] = {
+                        'event_id': event_id,
+                        'latitude': float(snapshot.latitudes[i]),
+                        'longitude': float(snapshot.longitudes[i]),
+                        'magnitude': float(snapshot.magnitudes[i]),
+                        'depth': None if np.isnan(depth) else depth,
+                        'time': int(snapshot.times[i]),
+                    }
+
+            expired = time.time() - PENDING_TTL
+            for event_id, event in list(self._pending.items()):
+                if event['time'] / 1000 < expired:
+                    logger.warning(f"Dropping USGS event {event_id}, it never appeared in the risk feed")
+                    del self._pending[event_id]
+            pending = list(self._pending.values())
+
+        HandledEvent.objects.filter(handled_at__lt=timezone.now() - timedelta(seconds=HANDLED_TTL)).delete()
+        return pending, snapshots
+
+    def claim(self, event):
+        """
+        Take an event for alerting, returning False when another worker already has.
+
+        The claim is a unique row per event id, so it holds across processes.
+        """
+        _, created = HandledEvent.objects.get_or_create(event_id=event['event_id'])
+        if not created:
+            with self._lock:
+                self._pending.pop(event['event_id'], None)
+        return created
+
+    def release(self, event):
+        """Give up a claimed event that could not be alerted, so the next poll retries it"""
+        HandledEvent.objects.filter(event_id=event['event_id']).delete()
+
+    def mark_handled(self, event, alerts):
+        """Stop watching a claimed event and record how long after its origin time alerts were dispatched"""
+        latency = time.time() - event['time'] / 1000
+        HandledEvent.objects.filter(event_id=event['event_id']).update(alert_count=alerts)
+        with self._lock:
+            self._pending.pop(event['event_id'], None)
+            self.events += 1
+            self.alerts += alerts
+            if alerts:
+                self._latencies.append(latency)
+        return latency
+
+    def stats(self):
+        """Event and alert counts, with time-to-alert percentiles in seconds over recent events"""
+        with self._lock:
+            latencies = np.array(self._latencies)
+            stats = {'events': self.events, 'alerts': self.alerts, 'pending': len(self._pending)}
+        if len(latencies):
+            stats.update({
+                'time_to_alert_p50': round(float(np.percentile(latencies, 50)), 1),
+                'time_to_alert_p95': round(float(np.percentile(latencies, 95)), 1),
+                'time_to_alert_max': round(float(latencies.max()), 1),
+            })
+        return stats
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_event_watcher():
+    """Process-wide watcher, keeping feed validators and pending events between polls"""
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = EventWatcher()
+    return _watcher
@@ -0,0 +1,114 @@
+import math
+from django.db.models import F, FloatField, IntegerField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Floor, Greatest, Least, Power, Radians, Sin, Sqrt
+from .distance import EARTH_RADIUS_KM, KM_PER_DEGREE
+
+# Size of the cells stored in indexed grid_cell columns. Changing it requires
+# recomputing every stored cell, so it is not a setting.
+GRID_CELL_DEGREES = 0.5
+GRID_COLUMNS = int(360 / GRID_CELL_DEGREES)
+GRID_ROWS = int(180 / GRID_CELL_DEGREES)
+
+
+def bounding_box(lat, lon, km):
+    """
+    Lat/lon box containing every point within km of (lat, lon).
+
+    Returns:
+        tuple: (min_lat, max_lat, lon_ranges) where lon_ranges is a list of
+        (min_lon, max_lon) pairs, two when the box crosses the antimeridian
+        and empty when it covers every longitude (near the poles)
+    """
+    dlat = km / KM_PER_DEGREE
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), []
+
+    dlon = km / (KM_PER_DEGREE * math.cos(math.radians(max(abs(min_lat), abs(max_lat)))))
+    if dlon >= 180:
+        return min_lat, max_lat, []
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180), (-180, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180), (-180, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def _grid_row(lat):
+    return min(max(int((lat + 90) // GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+
+
+def _grid_col(lon):
+    return min(max(int((lon + 180) // GRID_CELL_DEGREES), 0), GRID_COLUMNS - 1)
+
+
+def grid_cell(lat, lon):
+    """
+    Id of the GRID_CELL_DEGREES cell containing (lat, lon).
+
+    Cells are numbered row by row from the south-west corner, so the cells of
+    one latitude row form a contiguous range of ids.
+    """
+    return _grid_row(lat) * GRID_COLUMNS + _grid_col(lon)
+
+
+def grid_cell_expression(lat_field='latitude', lon_field='longitude'):
+    """Database expression computing grid_cell() from each row's coordinates"""
+    def index(field, offset, count):
+        cell = Floor((F(field) + Value(offset)) / Value(GRID_CELL_DEGREES))
+        return Least(Greatest(cell, Value(0.0)), Value(float(count - 1)), output_field=FloatField())
+
+    return Cast(
+        index(lat_field, 90.0, GRID_ROWS) * Value(float(GRID_COLUMNS)) + index(lon_field, 180.0, GRID_COLUMNS),
+        output_field=IntegerField(),
+    )
+
+
+def grid_cell_filter(lat, lon, km, field='grid_cell'):
+    """
+    Filter on an indexed grid cell column matching every cell within km of (lat, lon).
+
+    Each latitude row of the bounding box becomes one range condition, which
+    the database answers with an index range scan.
+    """
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, km)
+    first_row, last_row = _grid_row(min_lat), _grid_row(max_lat)
+    if not lon_ranges:
+        return Q(**{f'{field}__range': (first_row * GRID_COLUMNS, last_row * GRID_COLUMNS + GRID_COLUMNS - 1)})
+
+    cols = [(_grid_col(min_lon), _grid_col(max_lon)) for min_lon, max_lon in lon_ranges]
+    condition = Q()
+    for row in range(first_row, last_row + 1):
+        for first_col, last_col in cols:
+            condition |= Q(**{f'{field}__range': (row * GRID_COLUMNS + first_col, row * GRID_COLUMNS + last_col)})
+    return condition
+
+
+def haversine_expression(lat, lon, lat_field='latitude', lon_field='longitude'):
+    """Database expression for the distance in km from (lat, lon) to each row"""
+    rlat = math.radians(lat)
+    half_dlat = (Radians(F(lat_field)) - Value(rlat)) / Value(2.0)
+    half_dlon = (Radians(F(lon_field)) - Value(math.radians(lon))) / Value(2.0)
+    a = Power(Sin(half_dlat), 2) + Value(math.cos(rlat)) * Cos(Radians(F(lat_field))) * Power(Sin(half_dlon), 2)
+    # Rounding can push a slightly above 1, outside the domain of asin
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0), output_field=FloatField())))
+
+
+def within_radius(queryset, lat, lon, km, lat_field='latitude', lon_field='longitude'):
+    """
+    Rows of queryset strictly closer than km to (lat, lon), annotated with `distance`.
+
+    A bounding box filter runs first so indexes on the coordinate columns
+    narrow the rows before the exact distance is computed.
+    """
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, km)
+    queryset = queryset.filter(**{f'{lat_field}__range': (min_lat, max_lat)})
+    if lon_ranges:
+        lon_filter = Q()
+        for min_lon, max_lon in lon_ranges:
+            lon_filter |= Q(**{f'{lon_field}__range': (min_lon, max_lon)})
+        queryset = queryset.filter(lon_filter)
+    return queryset.annotate(
+        distance=haversine_expression(lat, lon, lat_field, lon_field)
+    ).filter(distance__lt=km)
@@ -0,0 +1,86 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+
+class MockWhatsAppHandler(BaseHTTPRequestHandler):
+    """Accepts Cloud API style message requests and records them on the server"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.failure_rate and random.random() < server.failure_rate:
+            self._respond(503, {'error': {'message': 'Simulated failure'}})
+            return
+        try:
+            payload = json.loads(body)
+            message = {'to': payload['to'], 'body': payload['text']['body']}
+        except (ValueError, KeyError, TypeError):
+            self._respond(400, {'error': {'message': 'Invalid message payload'}})
+            return
+
+        with server.lock:
+            server.messages.append(message)
+            message_id = f'wamid.mock{len(server.messages)}'
+        self._respond(200, {'messaging_product': 'whatsapp', 'messages': [{'id': message_id}]})
+
+    def _respond(self, status, payload):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockWhatsAppServer(ThreadingHTTPServer):
+    """Local stand-in for a WhatsApp messaging API, used for tests and development"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, failure_rate=0.0, verbose=False):
+        super().__init__(address, MockWhatsAppHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.messages = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/messages'
+
+
+class Command(BaseCommand):
+    help = 'Run a mock WhatsApp messaging API for the http provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025, help='Port to listen on')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering each request')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with a 503')
+
+    def handle(self, *args, **kwargs):
+        server = MockWhatsAppServer(
+            ('127.0.0.1', kwargs['port']),
+            latency=kwargs['latency'],
+            failure_rate=kwargs['failure_rate'],
+            verbose=True,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Mock WhatsApp API listening on {server.url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Received {len(server.messages)} messages')
@@ -0,0 +1,140 @@
+import os
+import gzip
+import logging
+import threading
+from pathlib import Path
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content-Encoding name to file suffix, in order of preference
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+class MapArtifact:
+    """
+    Rendered heatmap document for one risk grid version, stored as plain
+    HTML plus precompressed copies.
+    """
+
+    def __init__(self, version, directory):
+        self.version = version
+        self.path = Path(directory) / f'heatmap-{version}.html'
+
+    def encoded_path(self, encoding=None):
+        if encoding is None:
+            return self.path
+        return self.path.with_name(self.path.name + ENCODINGS[encoding])
+
+    def exists(self):
+        return self.path.exists()
+
+    @property
+    def last_modified(self):
+        """When this version was rendered, as a timestamp"""
+        return self.path.stat().st_mtime
+
+    def available_encodings(self):
+        return [encoding for encoding in ENCODINGS if self.encoded_path(encoding).exists()]
+
+    def negotiate(self, accept_encoding):
+        """
+        Pick the stored encoding the client prefers, None for identity.
+
+        Encodings the client refuses with q=0 are never picked; ties go to
+        the order of ENCODINGS.
+        """
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_q = None, 0.0
+        for encoding in self.available_encodings():
+            q = accepted.get(encoding, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def read(self, encoding=None):
+        return self.encoded_path(encoding).read_bytes()
+
+    def write(self, html):
+        """Write the document and its compressed copies atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        content = html.encode('utf-8')
+        copies = {None: content, 'gzip': gzip.compress(content, compresslevel=9)}
+        if brotli is not None:
+            copies['br'] = brotli.compress(content, quality=11, mode=brotli.MODE_TEXT)
+        # Compressed copies first, so the plain file only appears once the set is complete
+        for encoding in sorted(copies, key=lambda e: e is None):
+            path = self.encoded_path(encoding)
+            tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+            tmp_path.write_bytes(copies[encoding])
+            os.replace(tmp_path, path)
+        logger.info(f"Stored heatmap artifact {self.version}: {len(content)} bytes, "
+                    f"{', '.join(f'{e} {len(c)}' for e, c in copies.items() if e)}")
+
+
+def parse_accept_encoding(header):
+    """Map each content coding of an Accept-Encoding header to its q-value"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def artifact_dir():
+    return Path(getattr(settings, 'RISK_GRID_DIR', Path(settings.BASE_DIR) / 'risk_grid')) / 'artifacts'
+
+
+def prune_artifacts(keep):
+    """Delete all but the `keep` most recently written artifact versions"""
+    documents = sorted(artifact_dir().glob('heatmap-*.html'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for document in documents[keep:]:
+        for path in [document] + [document.with_name(document.name + suffix) for suffix in ENCODINGS.values()]:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                # Windows refuses to delete a file another request is still reading
+                logger.debug(f"Could not remove old artifact {path}: {str(e)}")
+
+
+_build_lock = threading.Lock()
+
+
+def get_map_artifact(grid, render, version=None):
+    """
+    Get the rendered heatmap for a grid, rendering it only if this grid
+    version has not been rendered yet.
+
+    Args:
+        grid: RiskGrid the map is drawn from
+        render: Callable returning the full HTML document for the grid
+        version: Key of the rendered document, defaults to the grid version
+    """
+    artifact = MapArtifact(version or grid.version, artifact_dir())
+    if artifact.exists():
+        return artifact
+
+    with _build_lock:
+        if not artifact.exists():
+            artifact.write(render(grid))
+            prune_artifacts(getattr(settings, 'RISK_MAP_ARTIFACTS_KEPT', 3))
+    return artifact
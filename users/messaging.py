@@ -0,0 +1,107 @@
+import threading
+import logging
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MessagingError(Exception):
+    """A message could not be delivered by the provider"""
+
+
+class MessagingProvider:
+    """
+    Interface for services that deliver WhatsApp messages.
+
+    Providers raise MessagingError when a message is not accepted, so the
+    delivery worker can retry it later. `max_concurrency` is the number of
+    messages the provider may send at the same time.
+    """
+
+    name = None
+    max_concurrency = 1
+
+    def send(self, phone_number, message):
+        raise NotImplementedError
+
+
+class BrowserWhatsAppProvider(MessagingProvider):
+    """Sends through WhatsApp Web by automating the local browser, one message at a time"""
+
+    name = 'browser'
+    max_concurrency = 1
+
+    def send(self, phone_number, message):
+        # Imported here so workers using an API provider do not need pywhatkit or a display
+        from .whatsapp_utils import send_whatsapp_alert
+
+        if not send_whatsapp_alert(phone_number, message):
+            raise MessagingError(f"Browser could not send the WhatsApp message to {phone_number}")
+
+
+class HttpWhatsAppProvider(MessagingProvider):
+    """
+    Sends through an HTTP messaging API such as the WhatsApp Business Cloud API.
+
+    Messages are POSTed as JSON to WHATSAPP_API_URL with WHATSAPP_API_TOKEN
+    as a bearer token, over a pooled keep-alive session.
+    """
+
+    name = 'http'
+
+    def __init__(self, url=None, token=None, timeout=None, max_concurrency=None):
+        self.url = url or getattr(settings, 'WHATSAPP_API_URL', '')
+        self.token = token if token is not None else getattr(settings, 'WHATSAPP_API_TOKEN', '')
+        self.timeout = timeout or getattr(settings, 'WHATSAPP_API_TIMEOUT', 10)
+        self.max_concurrency = max_concurrency or getattr(settings, 'WHATSAPP_CONCURRENCY', 8)
+        if not self.url:
+            raise ValueError("WHATSAPP_API_URL must be set to use the http WhatsApp provider")
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session is not thread-safe, so each delivery thread keeps its own
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            if self.token:
+                session.headers['Authorization'] = f'Bearer {self.token}'
+            self._local.session = session
+        return session
+
+    def send(self, phone_number, message):
+        payload = {
+            'messaging_product': 'whatsapp',
+            'to': phone_number.lstrip('+'),
+            'type': 'text',
+            'text': {'body': message},
+        }
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise MessagingError(f"WhatsApp API request failed: {str(e)}") from e
+        if response.status_code >= 400:
+            raise MessagingError(f"WhatsApp API returned {response.status_code}: {response.text[:200]}")
+
+
+PROVIDERS = {
+    BrowserWhatsAppProvider.name: BrowserWhatsAppProvider,
+    HttpWhatsAppProvider.name: HttpWhatsAppProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_messaging_provider():
+    """Process-wide provider selected by WHATSAPP_PROVIDER"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                name = getattr(settings, 'WHATSAPP_PROVIDER', 'browser')
+                if name not in PROVIDERS:
+                    raise ValueError(f"Unknown WHATSAPP_PROVIDER '{name}', expected one of {', '.join(PROVIDERS)}")
+                _provider = PROVIDERS[name]()
+    return _provider
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hazard', models.CharField(choices=[('cyclone', 'Cyclone'), ('earthquake', 'Earthquake')], max_length=20)),
+                ('cell', models.CharField(help_text='Location cell the alert was raised for', max_length=40)),
+                ('level', models.PositiveSmallIntegerField(help_text='Risk level of the last alert sent')),
+                ('alert_count', models.PositiveIntegerField(default=1)),
+                ('first_alerted_at', models.DateTimeField()),
+                ('last_alerted_at', models.DateTimeField(db_index=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_ledger', to='users.usersubscription')),
+            ],
+            options={
+                'verbose_name': 'Alert Ledger Entry',
+                'verbose_name_plural': 'Alert Ledger',
+                'constraints': [models.UniqueConstraint(fields=('subscription', 'hazard', 'cell'), name='alert_ledger_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+# Frozen copy of users.geo_queries.grid_cell as of this migration
+GRID_CELL_DEGREES = 0.5
+GRID_COLUMNS = 720
+GRID_ROWS = 360
+
+
+def grid_cell(lat, lon):
+    row = min(max(int((lat + 90) // GRID_CELL_DEGREES), 0), GRID_ROWS - 1)
+    col = min(max(int((lon + 180) // GRID_CELL_DEGREES), 0), GRID_COLUMNS - 1)
+    return row * GRID_COLUMNS + col
+
+
+def populate_grid_cells(apps, schema_editor):
+    UserSubscription = apps.get_model('users', 'UserSubscription')
+    subscriptions = []
+    for subscription in UserSubscription.objects.only('pk', 'latitude', 'longitude').iterator(chunk_size=2000):
+        subscription.grid_cell = grid_cell(subscription.latitude, subscription.longitude)
+        subscriptions.append(subscription)
+    UserSubscription.objects.bulk_update(subscriptions, ['grid_cell'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_alertledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='grid_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_grid_cells, migrations.RunPython.noop),
+    ]
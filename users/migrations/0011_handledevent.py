@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_usersubscription_cell_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HandledEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('alert_count', models.PositiveIntegerField(default=0)),
+                ('handled_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Handled Event',
+                'verbose_name_plural': 'Handled Events',
+            },
+        ),
+    ]
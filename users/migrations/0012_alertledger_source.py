@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_handledevent'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='alertledger',
+            name='alert_ledger_key',
+        ),
+        migrations.RenameField(
+            model_name='alertledger',
+            old_name='cell',
+            new_name='source',
+        ),
+        migrations.AlterField(
+            model_name='alertledger',
+            name='source',
+            field=models.CharField(help_text='USGS event or location cell the alert was raised for', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='alertledger',
+            constraint=models.UniqueConstraint(fields=('subscription', 'hazard', 'source'), name='alert_ledger_key'),
+        ),
+    ]
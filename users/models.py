@@ -1,8 +1,19 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .geo_queries import grid_cell, grid_cell_filter, within_radius
 
 # Create your models here.
 
+class UserSubscriptionQuerySet(models.QuerySet):
+    def within_radius(self, lat, lon, km):
+        """
+        Subscriptions strictly closer than km to (lat, lon), annotated with `distance` in km.
+
+        The indexed grid_cell column narrows the rows to the cells around the
+        point before the bounding box and exact distance filters run.
+        """
+        return within_radius(self.filter(grid_cell_filter(lat, lon, km)), lat, lon, km)
+
 class UserSubscription(models.Model):
     # Make user field optional with null=True, blank=True
     user = models.OneToOneField(
@@ -19,6 +30,8 @@ class UserSubscription(models.Model):
     # Simplified coordinate fields with reasonable precision
     latitude = models.FloatField(help_text="Latitude coordinate")
     longitude = models.FloatField(help_text="Longitude coordinate")
+    # Derived from latitude/longitude on save, see users.geo_queries.grid_cell
+    grid_cell = models.IntegerField(null=True, blank=True, editable=False)
     
     is_location_verified = models.BooleanField(default=False)
     # WhatsApp fields
@@ -28,6 +41,15 @@ class UserSubscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = UserSubscriptionQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.grid_cell = grid_cell(float(self.latitude), float(self.longitude))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'grid_cell'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         if self.user:
             return f"{self.user.username}'s subscription"
@@ -36,3 +58,97 @@ class UserSubscription(models.Model):
     class Meta:
         verbose_name = 'User Subscription'
         verbose_name_plural = 'User Subscriptions'
+        indexes = [
+            # Serves grid cell radius lookups and the keyset order of the risk cycle
+            models.Index(fields=['grid_cell', 'id'], name='user_subscription_cell'),
+        ]
+
+
+class OutboundMessage(models.Model):
+    """A WhatsApp alert waiting in the persistent delivery queue"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subscription = models.ForeignKey(
+        UserSubscription,
+        on_delete=models.SET_NULL,
+        related_name='outbound_messages',
+        null=True,
+        blank=True
+    )
+    phone_number = models.CharField(max_length=15)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    next_attempt_at = models.DateTimeField(help_text="Earliest time the message may be (re)sent")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"WhatsApp message to {self.phone_number} ({self.status})"
+
+    class Meta:
+        verbose_name = 'Outbound Message'
+        verbose_name_plural = 'Outbound Messages'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_message_due'),
+        ]
+
+
+class AlertLedger(models.Model):
+    """
+    The last alert sent to a subscriber about one hazard source: a USGS event
+    for event-driven alerts, otherwise the location cell of a periodic check.
+    """
+    CYCLONE = 'cyclone'
+    EARTHQUAKE = 'earthquake'
+    HAZARD_CHOICES = [
+        (CYCLONE, 'Cyclone'),
+        (EARTHQUAKE, 'Earthquake'),
+    ]
+
+    subscription = models.ForeignKey(
+        UserSubscription,
+        on_delete=models.CASCADE,
+        related_name='alert_ledger'
+    )
+    hazard = models.CharField(max_length=20, choices=HAZARD_CHOICES)
+    source = models.CharField(max_length=64, help_text="USGS event or location cell the alert was raised for")
+    level = models.PositiveSmallIntegerField(help_text="Risk level of the last alert sent")
+    alert_count = models.PositiveIntegerField(default=1)
+    first_alerted_at = models.DateTimeField()
+    last_alerted_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.get_hazard_display()} level {self.level} alert for subscription {self.subscription_id}"
+
+    class Meta:
+        verbose_name = 'Alert Ledger Entry'
+        verbose_name_plural = 'Alert Ledger'
+        constraints = [
+            models.UniqueConstraint(fields=['subscription', 'hazard', 'source'], name='alert_ledger_key'),
+        ]
+
+
+class HandledEvent(models.Model):
+    """A USGS event whose nearby subscribers were evaluated by the event watcher"""
+    event_id = models.CharField(max_length=64, unique=True)
+    alert_count = models.PositiveIntegerField(default=0)
+    handled_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"USGS event {self.event_id} ({self.alert_count} alerts)"
+
+    class Meta:
+        verbose_name = 'Handled Event'
+        verbose_name_plural = 'Handled Events'
@@ -0,0 +1,139 @@
+import logging
+from datetime import timedelta
+import time
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import OutboundMessage
+from .messaging import get_messaging_provider
+from .risk_engine import ConcurrentRunner, LocationCancelled, LocationTimeout
+
+logger = logging.getLogger(__name__)
+
+
+def format_whatsapp_message(subject, message):
+    return f"{subject}\n\n{message}"
+
+
+def enqueue_whatsapp_alerts(alerts):
+    """
+    Store WhatsApp alerts for (user, subject, message) tuples in the outbox.
+
+    Subscribers without WhatsApp enabled are skipped.
+
+    Returns:
+        int: Number of messages queued
+    """
+    now = timezone.now()
+    messages = [
+        OutboundMessage(
+            subscription=user,
+            phone_number=user.whatsapp_phone_number,
+            body=format_whatsapp_message(subject, message),
+            next_attempt_at=now,
+        )
+        for user, subject, message in alerts
+        if user.enable_whatsapp_alerts and user.whatsapp_phone_number
+    ]
+    OutboundMessage.objects.bulk_create(messages)
+    return len(messages)
+
+
+def claim_due_messages(limit):
+    """
+    Mark up to `limit` due messages as sending and return them.
+
+    Each message is claimed with a conditional update, so workers draining
+    the outbox at the same time never send the same message twice. Messages
+    left in 'sending' by a worker that died are claimed again once
+    WHATSAPP_CLAIM_TIMEOUT has passed.
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=getattr(settings, 'WHATSAPP_CLAIM_TIMEOUT', 600))
+    due = Q(status=OutboundMessage.PENDING, next_attempt_at__lte=now) | Q(
+        status=OutboundMessage.SENDING, claimed_at__lt=abandoned
+    )
+    candidates = list(
+        OutboundMessage.objects.filter(due).order_by('next_attempt_at').values_list('pk', 'status', 'claimed_at')[:limit]
+    )
+
+    claimed = []
+    for pk, status, claimed_at in candidates:
+        if OutboundMessage.objects.filter(pk=pk, status=status, claimed_at=claimed_at).update(
+            status=OutboundMessage.SENDING, claimed_at=now
+        ):
+            claimed.append(pk)
+    return list(OutboundMessage.objects.filter(pk__in=claimed).order_by('next_attempt_at'))
+
+
+def record_delivery(outbound, error=None):
+    """Mark a claimed message sent, or schedule its retry with exponential backoff"""
+    outbound.attempts += 1
+    if error is None:
+        outbound.status = OutboundMessage.SENT
+        outbound.sent_at = timezone.now()
+        outbound.last_error = ''
+        outbound.save(update_fields=['status', 'attempts', 'last_error', 'sent_at'])
+        logger.info(f"WhatsApp alert sent to {outbound.phone_number}")
+        return
+
+    outbound.last_error = str(error)
+    if outbound.attempts >= getattr(settings, 'WHATSAPP_MAX_ATTEMPTS', 5):
+        outbound.status = OutboundMessage.FAILED
+        logger.error(f"Giving up on WhatsApp alert to {outbound.phone_number} after {outbound.attempts} attempts: {str(error)}")
+    else:
+        outbound.status = OutboundMessage.PENDING
+        delay = getattr(settings, 'WHATSAPP_RETRY_DELAY', 30) * 2 ** (outbound.attempts - 1)
+        outbound.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning(f"WhatsApp alert to {outbound.phone_number} failed, retrying in {delay}s: {str(error)}")
+    outbound.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def deliver_due_messages(provider=None, batch_size=None):
+    """
+    Drain the outbox, sending up to the provider's concurrency at a time.
+
+    Sends run on a ConcurrentRunner under the 'whatsapp' upstream limit;
+    outcomes are written back from the calling thread.
+
+    Returns:
+        dict: Number of messages sent, failed (including ones scheduled for
+        retry), timed out, and deferred because the delivery deadline passed
+        before they were sent
+    """
+    provider = provider or get_messaging_provider()
+    batch_size = batch_size or getattr(settings, 'WHATSAPP_BATCH_SIZE', 50)
+    runner = ConcurrentRunner(
+        max_workers=provider.max_concurrency,
+        location_timeout=getattr(settings, 'WHATSAPP_SEND_TIMEOUT', 60),
+        cycle_deadline=getattr(settings, 'WHATSAPP_DELIVERY_DEADLINE', 300),
+    )
+    stats = {'sent': 0, 'failed': 0, 'timed_out': 0, 'deferred': 0}
+
+    while True:
+        messages = claim_due_messages(batch_size)
+        if not messages:
+            break
+        results = runner.map(
+            lambda outbound: provider.send(outbound.phone_number, outbound.body),
+            messages, upstream='whatsapp',
+        )
+        for outbound, result in zip(messages, results):
+            if isinstance(result, LocationCancelled):
+                # Never sent, so release the claim for the next run instead of waiting for WHATSAPP_CLAIM_TIMEOUT
+                OutboundMessage.objects.filter(
+                    pk=outbound.pk, status=OutboundMessage.SENDING, claimed_at=outbound.claimed_at
+                ).update(status=OutboundMessage.PENDING, claimed_at=None)
+                stats['deferred'] += 1
+                continue
+            if isinstance(result, LocationTimeout):
+                # The send may still complete, so the message stays claimed until WHATSAPP_CLAIM_TIMEOUT
+                stats['timed_out'] += 1
+                continue
+            error = result if isinstance(result, Exception) else None
+            record_delivery(outbound, error)
+            stats['failed' if error else 'sent'] += 1
+        if time.monotonic() >= runner.deadline:
+            # Anything still due is picked up by the next run
+            break
+    return stats
@@ -0,0 +1,33 @@
+import threading
+import time
+
+
+class RateLimitError(Exception):
+    """Raised when a call budget stays exhausted for longer than the caller allows"""
+
+
+class RateLimiter:
+    """Token bucket allowing `calls` requests per `period` seconds"""
+
+    def __init__(self, calls, period=60.0):
+        self.capacity = calls
+        self.period = period
+        self.tokens = float(calls)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait=None):
+        """Take one token, waiting up to max_wait seconds for the bucket to refill"""
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.period / self.capacity
+            if deadline is not None and now + wait > deadline:
+                raise RateLimitError(f"Rate limit of {self.capacity} calls per {self.period:g}s exhausted")
+            time.sleep(wait)
@@ -0,0 +1,118 @@
+import math
+import threading
+import logging
+from django.conf import settings
+from .distance import KM_PER_DEGREE
+from .spatial_index import GridIndex
+from .usgs_feed import diff_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Earthquake risk only looks at USGS events closer than this to a location
+EARTHQUAKE_INFLUENCE_KM = 100
+
+# Extra distance invalidated around changed events, covering rounding in the distance math
+INFLUENCE_MARGIN_KM = 1
+
+
+class EarthquakeRiskCache:
+    """
+    Earthquake risk per location, carried over from one USGS snapshot to the next.
+
+    Risks are cached per RISK_DEDUP_CELL_DEGREES cell, the same cells
+    group_locations dedups subscribers by, so a cell keeps its entry however
+    its group's representative location moves. When a new snapshot arrives,
+    only cells that reach within the influence radius of added, updated or
+    removed events are dropped; every other cell keeps its cached risk,
+    since nothing it depends on has changed.
+    """
+
+    def __init__(self, radius_km=EARTHQUAKE_INFLUENCE_KM, max_entries=200000, cell_degrees=None):
+        if cell_degrees is None:
+            cell_degrees = getattr(settings, 'RISK_DEDUP_CELL_DEGREES', 0.01)
+        self.cell_degrees = cell_degrees
+        # Any point of a cell reuses its risk, so reach the cell corners from its center
+        self.radius_km = radius_km + INFLUENCE_MARGIN_KM + cell_degrees * KM_PER_DEGREE * math.sqrt(2) / 2
+        self.max_entries = max_entries
+        self.snapshot = None
+        self._risks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, lat, lon):
+        """Cache key of the cell containing (lat, lon)"""
+        if not self.cell_degrees:
+            return round(float(lat), 6), round(float(lon), 6)
+        return int(float(lat) // self.cell_degrees), int(float(lon) // self.cell_degrees)
+
+    def center(self, key):
+        """Center of the cell a cache key stands for"""
+        if not self.cell_degrees:
+            return key
+        return (key[0] + 0.5) * self.cell_degrees, (key[1] + 0.5) * self.cell_degrees
+
+    def sync(self, snapshot):
+        """Bring the cache up to date with a snapshot, invalidating locations near changed events"""
+        with self._lock:
+            if snapshot is self.snapshot:
+                return
+            if self.snapshot is None or not self._risks:
+                self._risks.clear()
+                self.snapshot = snapshot
+                return
+
+            latitudes, longitudes = diff_snapshots(self.snapshot, snapshot)
+            self.snapshot = snapshot
+            if not len(latitudes):
+                return
+
+            keys = list(self._risks)
+            centers = [self.center(key) for key in keys]
+            index = GridIndex([c[0] for c in centers], [c[1] for c in centers])
+            stale = set()
+            for lat, lon in zip(latitudes.tolist(), longitudes.tolist()):
+                indices, _ = index.query_radius(lat, lon, self.radius_km)
+                stale.update(indices.tolist())
+            for i in stale:
+                del self._risks[keys[i]]
+            logger.info(f"USGS feed changed by {len(latitudes)} events, "
+                        f"recomputing {len(stale)} of {len(keys)} cached locations")
+
+    def get_many(self, locations):
+        """Cached risk per location, None where it must be computed"""
+        with self._lock:
+            results = [self._risks.get(self.key(lat, lon)) for lat, lon in locations]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+            return results
+
+    def set_many(self, snapshot, items):
+        """Store (lat, lon, risk) items computed from the given snapshot"""
+        with self._lock:
+            # Results from a snapshot that has since been replaced could already be stale
+            if snapshot is not self.snapshot:
+                return
+            if len(self._risks) + len(items) > self.max_entries:
+                self._risks.clear()
+            for lat, lon, risk in items:
+                self._risks[self.key(lat, lon)] = risk
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'cached_locations': len(self._risks)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_earthquake_risk_cache():
+    """Process-wide earthquake risk cache shared by subscriber checks and risk grids"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EarthquakeRiskCache(max_entries=getattr(settings, 'EARTHQUAKE_RISK_CACHE_SIZE', 200000))
+    return _cache
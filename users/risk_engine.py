@@ -0,0 +1,204 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM_CONCURRENCY = {
+    'openweathermap': 8,
+    'smtp': 4,
+    'whatsapp': 1,  # Browser automation can only drive one message at a time
+}
+
+
+class LocationTimeout(Exception):
+    """Raised in place of a result when an item exceeds its deadline"""
+
+
+class LocationCancelled(LocationTimeout):
+    """Raised in place of a result when the cycle deadline passes before an item starts"""
+
+
+class UpstreamLimits:
+    """Caps the number of concurrent calls to each upstream service"""
+
+    def __init__(self, limits=None):
+        self._limits = dict(DEFAULT_UPSTREAM_CONCURRENCY, **(limits or {}))
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def semaphore(self, upstream):
+        with self._lock:
+            if upstream not in self._semaphores:
+                self._semaphores[upstream] = threading.BoundedSemaphore(self._limits.get(upstream, 1))
+            return self._semaphores[upstream]
+
+    @contextmanager
+    def slot(self, upstream):
+        """Hold one concurrency slot of an upstream for the duration of the block"""
+        semaphore = self.semaphore(upstream)
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+_upstream_limits = None
+_upstream_lock = threading.Lock()
+
+
+def get_upstream_limits():
+    """Process-wide upstream limits, shared by every runner and alert sender"""
+    global _upstream_limits
+    if _upstream_limits is None:
+        with _upstream_lock:
+            if _upstream_limits is None:
+                _upstream_limits = UpstreamLimits(getattr(settings, 'RISK_UPSTREAM_CONCURRENCY', None))
+    return _upstream_limits
+
+
+def upstream_slot(upstream):
+    """Hold one concurrency slot of an upstream, e.g. around a WhatsApp send"""
+    return get_upstream_limits().slot(upstream)
+
+
+class ConcurrentRunner:
+    """
+    Runs blocking per-location work on a bounded thread pool.
+
+    Each item gets its own deadline measured from when it starts running,
+    and the whole run stops waiting once the cycle deadline passes. Items
+    that have not started by then are never called. Failures are returned
+    in place of results instead of aborting the run.
+    """
+
+    def __init__(self, max_workers=None, location_timeout=None, cycle_deadline=None, limits=None):
+        self.max_workers = max_workers or getattr(settings, 'RISK_MAX_WORKERS', 16)
+        self.location_timeout = location_timeout or getattr(settings, 'RISK_LOCATION_TIMEOUT', 60)
+        deadline = cycle_deadline or getattr(settings, 'RISK_CYCLE_DEADLINE', 840)
+        self.deadline = time.monotonic() + deadline
+        self.limits = limits or get_upstream_limits()
+        self.stats = {}
+
+    def _record(self, label, outcome):
+        counts = self.stats.setdefault(label, {'completed': 0, 'failed': 0, 'timed_out': 0, 'cancelled': 0})
+        counts[outcome] += 1
+
+    def map(self, func, items, upstream=None, label=None):
+        """
+        Call func(item) for every item concurrently.
+
+        Args:
+            upstream: Name of the upstream whose concurrency limit each call holds
+            label: Key for this work in self.stats, defaults to the upstream name
+
+        Returns:
+            list: Results in item order; failed items hold their exception,
+            items past their deadline hold a LocationTimeout and items the
+            cycle deadline stopped before they started hold a LocationCancelled
+        """
+        items = list(items)
+        results = [None] * len(items)
+        if not items:
+            return results
+
+        label = label or upstream or 'local'
+        started = {}
+        # Guards `started` and `stopped` so an item either starts before the cycle deadline or never does
+        state_lock = threading.Lock()
+        stopped = threading.Event()
+
+        def call(index, item):
+            with state_lock:
+                if stopped.is_set():
+                    raise LocationCancelled("Cycle deadline reached before the item started")
+                started[index] = time.monotonic()
+            return func(item)
+
+        def run(index, item):
+            if upstream:
+                with self.limits.slot(upstream):
+                    return call(index, item)
+            return call(index, item)
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)))
+        try:
+            futures = {executor.submit(run, i, item): i for i, item in enumerate(items)}
+            pending = set(futures)
+            while pending:
+                now = time.monotonic()
+                if now >= self.deadline:
+                    break
+                done, pending = wait(pending, timeout=min(1.0, self.deadline - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                        self._record(label, 'completed')
+                    except Exception as e:
+                        results[index] = e
+                        self._record(label, 'failed')
+
+                # Stop waiting on items that have been running longer than their deadline
+                now = time.monotonic()
+                for future in list(pending):
+                    index = futures[future]
+                    if index in started and now - started[index] > self.location_timeout:
+                        pending.discard(future)
+                        results[index] = LocationTimeout(f"Exceeded {self.location_timeout}s deadline")
+                        self._record(label, 'timed_out')
+
+            with state_lock:
+                stopped.set()
+                running = set(started)
+            for future in pending:
+                future.cancel()
+                index = futures[future]
+                if index in running:
+                    results[index] = LocationTimeout("Cycle deadline reached")
+                    self._record(label, 'timed_out')
+                else:
+                    results[index] = LocationCancelled("Cycle deadline reached before the item started")
+                    self._record(label, 'cancelled')
+        finally:
+            # Don't block on stragglers, their results are no longer used
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return results
+
+
+def group_locations(locations, cell_degrees=None):
+    """
+    Group (lat, lon) locations that fall in the same grid cell.
+
+    With cell_degrees of 0 only identical coordinates are grouped.
+
+    Returns:
+        tuple: (representatives, membership) where representatives holds one
+        (lat, lon) per group, the mean of its members, and membership[i] is
+        the group index of locations[i]
+    """
+    if cell_degrees is None:
+        cell_degrees = getattr(settings, 'RISK_DEDUP_CELL_DEGREES', 0.01)
+
+    groups = {}
+    membership = []
+    sums = []
+    for lat, lon in locations:
+        lat, lon = float(lat), float(lon)
+        key = (lat // cell_degrees, lon // cell_degrees) if cell_degrees else (lat, lon)
+        index = groups.get(key)
+        if index is None:
+            index = groups[key] = len(sums)
+            sums.append([0.0, 0.0, 0])
+        sums[index][0] += lat
+        sums[index][1] += lon
+        sums[index][2] += 1
+        membership.append(index)
+
+    representatives = [(lat_sum / count, lon_sum / count) for lat_sum, lon_sum, count in sums]
+    return representatives, membership
@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Region covered by the heatmap and the risk data API
+LAT_BOUNDS = (8, 35)
+LON_BOUNDS = (68, 97)
+
+# Grid points per axis for each materialized grid
+GRID_SIZES = {
+    'heatmap': 50,
+    'api': 15,
+}
+
+
+class RiskGrid:
+    """
+    Materialized earthquake and cyclone risk levels for a grid of points.
+
+    Grids are computed in the background and saved as a NumPy .npz file,
+    so views only load arrays instead of running risk checks per request.
+    The recent earthquakes and active alerts shown next to the grid are
+    stored with it.
+    """
+
+    def __init__(self, latitudes, longitudes, earthquake_levels, cyclone_levels,
+                 earthquake_details, cyclone_details, quakes=None, active_alerts=None,
+                 generated_at=None, feed_version=''):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.earthquake_levels = np.asarray(earthquake_levels, dtype=np.int8)
+        self.cyclone_levels = np.asarray(cyclone_levels, dtype=np.int8)
+        self.earthquake_details = np.asarray(earthquake_details, dtype=str)
+        self.cyclone_details = np.asarray(cyclone_details, dtype=str)
+        # Recent earthquakes as (lat, lon, magnitude, time_ms, depth) rows
+        self.quakes = np.asarray(quakes if quakes is not None else np.empty((0, 5)), dtype=np.float64).reshape(-1, 5)
+        self.active_alerts = active_alerts or []
+        self.generated_at = generated_at if generated_at is not None else time.time()
+        self.feed_version = feed_version or ''
+        self.version = self._digest()
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _digest(self):
+        """Content hash, unchanged when a recompute produces the same grid"""
+        digest = hashlib.sha1()
+        for array in (self.latitudes, self.longitudes, self.earthquake_levels, self.cyclone_levels, self.quakes):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        for details in (self.earthquake_details, self.cyclone_details):
+            digest.update('\0'.join(details.tolist()).encode())
+        digest.update(json.dumps(self.active_alerts, sort_keys=True, default=str).encode())
+        return digest.hexdigest()[:16]
+
+    @property
+    def age(self):
+        """Seconds since the grid was computed"""
+        return max(0.0, time.time() - self.generated_at)
+
+    def is_stale(self, max_age=None):
+        if max_age is None:
+            max_age = getattr(settings, 'RISK_GRID_MAX_AGE', 1800)
+        return self.age > max_age
+
+    def save(self, path):
+        """Write the grid atomically, so readers never see a partial file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                latitudes=self.latitudes,
+                longitudes=self.longitudes,
+                earthquake_levels=self.earthquake_levels,
+                cyclone_levels=self.cyclone_levels,
+                earthquake_details=self.earthquake_details,
+                cyclone_details=self.cyclone_details,
+                quakes=self.quakes,
+                active_alerts=np.array(json.dumps(self.active_alerts, default=str)),
+                generated_at=np.array(self.generated_at),
+                feed_version=np.array(self.feed_version),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data['latitudes'], data['longitudes'],
+                data['earthquake_levels'], data['cyclone_levels'],
+                data['earthquake_details'], data['cyclone_details'],
+                quakes=data['quakes'],
+                active_alerts=json.loads(str(data['active_alerts'])),
+                generated_at=float(data['generated_at']),
+                feed_version=str(data['feed_version']),
+            )
+
+
+def grid_points(points_per_axis):
+    """Row-major (lat, lon) points spanning the covered region"""
+    lat_range = np.linspace(*LAT_BOUNDS, points_per_axis)
+    lon_range = np.linspace(*LON_BOUNDS, points_per_axis)
+    return [(lat, lon) for lat in lat_range for lon in lon_range]
+
+
+class CycloneField:
+    """
+    Cyclone risk evaluated on a coarse weather lattice over the covered region.
+
+    Weather varies over hundreds of kilometers, so the grids take the cyclone
+    risk of each point from its nearest lattice point instead of calling
+    OpenWeatherMap per grid point. A refresh then costs two weather calls per
+    lattice point, however fine the grids are.
+    """
+
+    def __init__(self, points_per_axis, risks):
+        self.points_per_axis = points_per_axis
+        # One risk dict per lattice point, in grid_points order
+        self.risks = risks
+
+    @classmethod
+    def compute(cls, points_per_axis=None):
+        """Evaluate the lattice through the grid's own weather budget"""
+        from .risk_engine import ConcurrentRunner, UpstreamLimits
+        from .tasks import check_cyclone_risk_batch
+        from .weather_client import get_weather_client
+
+        if points_per_axis is None:
+            points_per_axis = getattr(settings, 'RISK_GRID_WEATHER_POINTS', 6)
+        # Calls wait on the grid budget for most of the refresh, so every deadline is the refresh interval
+        deadline = getattr(settings, 'RISK_GRID_REFRESH_INTERVAL', 600)
+        runner = ConcurrentRunner(
+            location_timeout=deadline,
+            cycle_deadline=deadline,
+            # Own slots, so waiting grid calls never hold the ones subscriber shards need
+            limits=UpstreamLimits(getattr(settings, 'RISK_UPSTREAM_CONCURRENCY', None)),
+        )
+        risks = check_cyclone_risk_batch(
+            grid_points(points_per_axis), runner=runner, weather_client=get_weather_client('grid')
+        )
+        logger.info(f"Cyclone risk evaluated on a {points_per_axis}x{points_per_axis} weather lattice: {runner.stats}")
+        return cls(points_per_axis, risks)
+
+    def _index(self, value, bounds):
+        if self.points_per_axis == 1:
+            return 0
+        step = (bounds[1] - bounds[0]) / (self.points_per_axis - 1)
+        return min(max(int(round((value - bounds[0]) / step)), 0), self.points_per_axis - 1)
+
+    def covers(self, lat, lon):
+        return LAT_BOUNDS[0] <= lat <= LAT_BOUNDS[1] and LON_BOUNDS[0] <= lon <= LON_BOUNDS[1]
+
+    def risks_at(self, points):
+        """Cyclone risk of each (lat, lon) point inside the covered region, from its nearest lattice point"""
+        return [
+            self.risks[self._index(lat, LAT_BOUNDS) * self.points_per_axis + self._index(lon, LON_BOUNDS)]
+            for lat, lon in points
+        ]
+
+
+def _build_risk_grid(points, earthquake_risks, cyclone_risks, snapshot=None, active_alerts=None):
+    quakes = None
+    if snapshot is not None:
+        quakes = np.column_stack([
+            snapshot.latitudes, snapshot.longitudes, snapshot.magnitudes,
+            snapshot.times, snapshot.depths,
+        ])
+
+    return RiskGrid(
+        [lat for lat, _ in points], [lon for _, lon in points],
+        [risk['risk_level'] for risk in earthquake_risks],
+        [risk['risk_level'] for risk in cyclone_risks],
+        [risk['details'] for risk in earthquake_risks],
+        [risk['details'] for risk in cyclone_risks],
+        quakes=quakes,
+        active_alerts=active_alerts,
+        feed_version=snapshot.version if snapshot is not None else '',
+    )
+
+
+def compute_risk_grid(points_per_axis, snapshot=None, active_alerts=None, cyclone_field=None):
+    """Run the batched earthquake check over a uniform grid, with cyclone risk from the weather lattice"""
+    from .tasks import check_earthquake_risk_batch
+
+    cyclone_field = cyclone_field or CycloneField.compute()
+    points = grid_points(points_per_axis)
+    earthquake_risks = check_earthquake_risk_batch(points, snapshot=snapshot)
+    cyclone_risks = cyclone_field.risks_at(points)
+    return _build_risk_grid(points, earthquake_risks, cyclone_risks, snapshot, active_alerts)
+
+
+def compute_adaptive_risk_grid(snapshot=None, active_alerts=None, base_cells=None, max_depth=None,
+                               budget=None, refine_level=None, refine_gradient=None, cyclone_field=None):
+    """
+    Quadtree-refined risk grid.
+
+    Starts from a base_cells x base_cells grid of cells and evaluates their
+    corners. A cell is split in four when any corner reaches refine_level
+    or the levels of either hazard differ by refine_gradient across it,
+    until max_depth or the evaluation budget is reached. Cells with the
+    most risk are split first when the budget runs short.
+
+    Cells left unsplit are filled in at the finest spacing from their
+    nearest evaluated corner, so calm and uniformly low-risk regions still
+    draw as a continuous heatmap without being evaluated point by point.
+
+    All points lie on a lattice of base_cells * 2**max_depth intervals per
+    axis, which the defaults make slightly finer than the uniform 50x50 grid.
+    The budget counts earthquake evaluations; cyclone risk comes from the
+    weather lattice of cyclone_field.
+    """
+    from .tasks import check_earthquake_risk_batch
+
+    if base_cells is None:
+        base_cells = getattr(settings, 'RISK_GRID_BASE_CELLS', 7)
+    if max_depth is None:
+        max_depth = getattr(settings, 'RISK_GRID_MAX_DEPTH', 3)
+    if budget is None:
+        budget = getattr(settings, 'RISK_GRID_BUDGET', 1200)
+    if refine_level is None:
+        refine_level = getattr(settings, 'RISK_GRID_REFINE_LEVEL', 2)
+    if refine_gradient is None:
+        refine_gradient = getattr(settings, 'RISK_GRID_REFINE_GRADIENT', 1)
+
+    cyclone_field = cyclone_field or CycloneField.compute()
+    intervals = base_cells * 2 ** max_depth
+    lat_step = (LAT_BOUNDS[1] - LAT_BOUNDS[0]) / intervals
+    lon_step = (LON_BOUNDS[1] - LON_BOUNDS[0]) / intervals
+
+    def coordinates(node):
+        return LAT_BOUNDS[0] + node[0] * lat_step, LON_BOUNDS[0] + node[1] * lon_step
+
+    # Lattice node (i, j) -> (earthquake risk, cyclone risk)
+    results = {}
+
+    def evaluate(nodes):
+        nodes = [node for node in dict.fromkeys(nodes) if node not in results]
+        if not nodes:
+            return
+        points = [coordinates(node) for node in nodes]
+        earthquake_risks = check_earthquake_risk_batch(points, snapshot=snapshot)
+        cyclone_risks = cyclone_field.risks_at(points)
+        results.update(zip(nodes, zip(earthquake_risks, cyclone_risks)))
+
+    def corners(cell):
+        i, j, size = cell
+        return [(i, j), (i + size, j), (i, j + size), (i + size, j + size)]
+
+    def corner_levels(cell):
+        return [[results[node][hazard]['risk_level'] for node in corners(cell)] for hazard in (0, 1)]
+
+    def needs_split(cell):
+        return any(
+            max(levels) >= refine_level or max(levels) - min(levels) >= refine_gradient
+            for levels in corner_levels(cell)
+        )
+
+    def children(cell):
+        i, j, size = cell
+        half = size // 2
+        return [(i, j, half), (i + half, j, half), (i, j + half, half), (i + half, j + half, half)]
+
+    size = 2 ** max_depth
+    cells = [(i * size, j * size, size) for i in range(base_cells) for j in range(base_cells)]
+    evaluate([node for cell in cells for node in corners(cell)])
+
+    leaves = []
+    while cells:
+        splittable = []
+        for cell in cells:
+            if cell[2] > 1 and needs_split(cell):
+                splittable.append(cell)
+            else:
+                leaves.append(cell)
+        splittable.sort(key=lambda cell: max(max(levels) for levels in corner_levels(cell)), reverse=True)
+
+        pending = set()
+        next_cells = []
+        for cell in splittable:
+            new_nodes = {node for child in children(cell) for node in corners(child)} - results.keys() - pending
+            if len(results) + len(pending) + len(new_nodes) > budget:
+                leaves.append(cell)
+                continue
+            pending |= new_nodes
+            next_cells.extend(children(cell))
+        evaluate(sorted(pending))
+        cells = next_cells
+
+    # Fill unsplit cells that carry any risk from their nearest evaluated corner
+    filled = {}
+    for cell in leaves:
+        i, j, size = cell
+        if size == 1 or not any(max(levels) > 0 for levels in corner_levels(cell)):
+            continue
+        for di in range(size + 1):
+            for dj in range(size + 1):
+                node = (i + di, j + dj)
+                if node in results or node in filled:
+                    continue
+                nearest = (i + (size if 2 * di > size else 0), j + (size if 2 * dj > size else 0))
+                filled[node] = results[nearest]
+
+    nodes = sorted(results) + sorted(filled)
+    risks = [results.get(node) or filled[node] for node in nodes]
+    logger.info(
+        f"Adaptive risk grid: {len(results)} evaluations, {len(filled)} filled points, "
+        f"{(intervals + 1) ** 2} points at full resolution"
+    )
+    return _build_risk_grid(
+        [coordinates(node) for node in nodes],
+        [risk[0] for risk in risks], [risk[1] for risk in risks],
+        snapshot, active_alerts,
+    )
+
+
+def compute_named_risk_grid(name, snapshot=None, active_alerts=None, cyclone_field=None):
+    """
+    Compute one of the GRID_SIZES grids. The heatmap grid is quadtree-refined
+    when RISK_GRID_MODE is 'adaptive'; the API grid is always uniform.
+    """
+    if name == 'heatmap' and getattr(settings, 'RISK_GRID_MODE', 'uniform') == 'adaptive':
+        return compute_adaptive_risk_grid(snapshot=snapshot, active_alerts=active_alerts, cyclone_field=cyclone_field)
+    return compute_risk_grid(GRID_SIZES[name], snapshot=snapshot, active_alerts=active_alerts, cyclone_field=cyclone_field)
+
+
+def risk_grid_path(name):
+    return Path(getattr(settings, 'RISK_GRID_DIR', Path(settings.BASE_DIR) / 'risk_grid')) / f'{name}.npz'
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def load_risk_grid(name):
+    """
+    Get the latest saved grid, or None if none has been computed yet.
+
+    The parsed grid is kept in memory until the file on disk changes.
+    """
+    path = risk_grid_path(name)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    with _grids_lock:
+        cached = _grids.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        grid = RiskGrid.load(path)
+    except Exception as e:
+        logger.error(f"Error loading risk grid {path}: {str(e)}")
+        return None
+    with _grids_lock:
+        _grids[name] = (mtime, grid)
+    return grid
+
+
+def store_risk_grid(name, grid):
+    grid.save(risk_grid_path(name))
+    with _grids_lock:
+        _grids.pop(name, None)
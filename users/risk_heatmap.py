@@ -1,17 +1,25 @@
-import folium
-from folium import plugins
 import numpy as np
-from .tasks import check_earthquake_risk, check_cyclone_risk
+from django.conf import settings
+from django.core.cache import cache
 from .models import UserSubscription
+from .usgs_feed import get_feed_snapshot
+from .risk_grid import GRID_SIZES, CycloneField, compute_named_risk_grid, load_risk_grid, store_risk_grid
+from .map_artifact import get_map_artifact
 from datetime import datetime, timedelta
-import requests
-import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_active_alerts():
+REFRESH_REQUESTED_KEY = 'risk_grid_refresh_requested'
+
+class RiskGridNotReady(Exception):
+    """No risk grid has been stored yet; a refresh has been queued"""
+
+def get_active_alerts(cyclone_field=None):
     """Get active alerts from the database"""
+    # Imported here so web workers only load the prediction models when alerts are requested
+    from .tasks import check_earthquake_risk_batch, check_cyclone_risk_batch
+    from .weather_client import get_weather_client
     try:
         # Get subscriptions with recent alerts (using updated_at instead of last_alert_time)
         one_hour_ago = datetime.now() - timedelta(hours=1)
@@ -21,10 +29,23 @@ def get_active_alerts():
         
         # Format the alerts
         alerts = []
-        for sub in active_subscriptions:
-            # Get the latest risk assessments for this location
-            eq_risk = check_earthquake_risk(sub['latitude'], sub['longitude'])
-            cyc_risk = check_cyclone_risk(sub['latitude'], sub['longitude'])
+        active_subscriptions = list(active_subscriptions)
+        locations = [(sub['latitude'], sub['longitude']) for sub in active_subscriptions]
+        
+        # Get the latest risk assessments for these locations
+        earthquake_risks = check_earthquake_risk_batch(locations)
+        # Locations inside the weather lattice reuse it; only the others call OpenWeatherMap
+        cyclone_risks = [None] * len(locations)
+        if cyclone_field is not None:
+            inside = [i for i, (lat, lon) in enumerate(locations) if cyclone_field.covers(lat, lon)]
+            for i, risk in zip(inside, cyclone_field.risks_at([locations[i] for i in inside])):
+                cyclone_risks[i] = risk
+        outside = [i for i, risk in enumerate(cyclone_risks) if risk is None]
+        if outside:
+            risks = check_cyclone_risk_batch([locations[i] for i in outside], weather_client=get_weather_client('grid'))
+            for i, risk in zip(outside, risks):
+                cyclone_risks[i] = risk
+        for sub, eq_risk, cyc_risk in zip(active_subscriptions, earthquake_risks, cyclone_risks):
             
             # Only include if there's an active risk
             if eq_risk['risk_level'] > 0 or cyc_risk['risk_level'] > 0:
@@ -45,62 +66,88 @@ def get_active_alerts():
         logger.error(f"Error fetching active alerts: {str(e)}")
         return []
 
-def generate_risk_heatmap():
-    """
-    Generate a heatmap showing earthquake and cyclone risks across regions.
-    Returns the HTML content of the map.
+def refresh_risk_grids():
     """
-    # Create base map centered on India
-    m = folium.Map(location=[20.5937, 78.9629], zoom_start=4)
+    Recompute every materialized risk grid, sharing one USGS snapshot, one
+    cyclone weather lattice and one active alerts lookup between them.
     
-    # Generate grid points across the region
-    lat_range = np.linspace(8, 35, 50)  # Increased from 30 to 50 points
-    lon_range = np.linspace(68, 97, 50)  # Increased from 30 to 50 points
+    Returns:
+        dict: Grid name to the RiskGrid that was stored
+    """
+    try:
+        snapshot = get_feed_snapshot()
+    except Exception as e:
+        logger.error(f"Error fetching USGS data: {str(e)}")
+        snapshot = None
+    cyclone_field = CycloneField.compute()
+    active_alerts = get_active_alerts(cyclone_field)
     
-    # Lists to store heatmap data
-    earthquake_data = []
-    cyclone_data = []
+    grids = {}
+    for name in GRID_SIZES:
+        grids[name] = compute_named_risk_grid(name, snapshot=snapshot, active_alerts=active_alerts,
+                                              cyclone_field=cyclone_field)
+        store_risk_grid(name, grids[name])
+        logger.info(f"Stored {name} risk grid {grids[name].version} ({len(grids[name])} points)")
     
-    # Get USGS earthquake data for the last month
-    usgs_url = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson'
+    # Render the map now so the first page view after a refresh is served from disk
     try:
-        response = requests.get(usgs_url, timeout=15)  # Increased timeout
-        if response.status_code == 200:
-            usgs_data = response.json()
-            
-            # Add USGS earthquake markers
-            earthquake_layer = folium.FeatureGroup(name='Recent Earthquakes')
-            for feature in usgs_data.get('features', []):
-                try:
-                    coords = feature['geometry']['coordinates']
-                    properties = feature['properties']
-                    magnitude = properties.get('mag')
-                    
-                    # Only proceed if we have valid magnitude and coordinates
-                    if magnitude is not None and coords and len(coords) >= 2:
-                        if float(magnitude) > 2.5:  # Only show significant earthquakes
-                            # Format time
-                            event_time = datetime.fromtimestamp(properties.get('time', 0)/1000)
-                            time_str = event_time.strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            folium.CircleMarker(
-                                location=[coords[1], coords[0]],
-                                radius=float(magnitude) * 2,
-                                color='red',
-                                fill=True,
-                                popup=f"Magnitude: {magnitude}<br>Time: {time_str}<br>Depth: {coords[2]} km",
-                                tooltip=f"M{magnitude} Earthquake"
-                            ).add_to(earthquake_layer)
-                except (KeyError, TypeError, ValueError) as e:
-                    logger.warning(f"Error processing earthquake feature: {str(e)}")
-                    continue
-                
-            earthquake_layer.add_to(m)
+        get_heatmap_artifact(grids['heatmap'])
     except Exception as e:
-        logger.error(f"Error fetching USGS data: {str(e)}")
+        logger.error(f"Error rendering heatmap artifact: {str(e)}")
+    return grids
+
+def get_risk_grid(name):
+    """
+    Get the latest materialized grid.
+
+    Grids are only computed by refresh_risk_grid; before its first run this
+    queues one refresh and raises RiskGridNotReady instead of computing the
+    grid inside the request.
+    """
+    grid = load_risk_grid(name)
+    if grid is not None:
+        return grid
+    
+    # Only the first request queues a refresh until the interval has passed
+    if cache.add(REFRESH_REQUESTED_KEY, True, getattr(settings, 'RISK_GRID_REFRESH_INTERVAL', 600)):
+        from .tasks import refresh_risk_grid
+        try:
+            refresh_risk_grid.delay()
+            logger.warning(f"No {name} risk grid stored yet, queued a refresh")
+        except Exception as e:
+            cache.delete(REFRESH_REQUESTED_KEY)
+            logger.error(f"Error queuing risk grid refresh: {str(e)}")
+    raise RiskGridNotReady(f"No {name} risk grid stored yet")
+
+def build_risk_map(grid):
+    """Build the folium map showing earthquake and cyclone risks for a grid"""
+    import folium
+    from folium import plugins
+    # Create base map centered on India
+    m = folium.Map(location=[20.5937, 78.9629], zoom_start=4)
+    
+    # Add USGS earthquake markers from the data the grid was computed with
+    if len(grid.quakes):
+        earthquake_layer = folium.FeatureGroup(name='Recent Earthquakes')
+        for eq_lat, eq_lon, magnitude, event_ms, depth in grid.quakes.tolist():
+            if magnitude > 2.5:  # Only show significant earthquakes
+                # Format time
+                event_time = datetime.fromtimestamp(event_ms/1000)
+                time_str = event_time.strftime('%Y-%m-%d %H:%M:%S')
+                
+                folium.CircleMarker(
+                    location=[eq_lat, eq_lon],
+                    radius=magnitude * 2,
+                    color='red',
+                    fill=True,
+                    popup=f"Magnitude: {magnitude}<br>Time: {time_str}<br>Depth: {depth} km",
+                    tooltip=f"M{magnitude} Earthquake"
+                ).add_to(earthquake_layer)
+            
+        earthquake_layer.add_to(m)
     
     # Add active alerts
-    active_alerts = get_active_alerts()
+    active_alerts = grid.active_alerts
     if active_alerts:
         alert_layer = folium.FeatureGroup(name='Active Alerts')
         for alert in active_alerts:
@@ -115,24 +162,12 @@ def generate_risk_heatmap():
             ).add_to(alert_layer)
         alert_layer.add_to(m)
     
-    # Calculate risk levels for grid points
-    for lat in lat_range:
-        for lon in lon_range:
-            try:
-                # Check earthquake risk
-                eq_risk = check_earthquake_risk(lat, lon)
-                if eq_risk['risk_level'] > 0:
-                    weight = eq_risk['risk_level']  # Removed 0.33 multiplier
-                    earthquake_data.append([lat, lon, weight])
-                
-                # Check cyclone risk
-                cyc_risk = check_cyclone_risk(lat, lon)
-                if cyc_risk['risk_level'] > 0:
-                    weight = cyc_risk['risk_level']  # Removed 0.33 multiplier
-                    cyclone_data.append([lat, lon, weight])
-            except Exception as e:
-                logger.error(f"Error calculating risk for {lat}, {lon}: {str(e)}")
-                continue
+    # Heatmap weights are the precomputed risk levels of the grid points
+    points = np.column_stack([grid.latitudes, grid.longitudes])
+    earthquake_mask = grid.earthquake_levels > 0
+    cyclone_mask = grid.cyclone_levels > 0
+    earthquake_data = np.column_stack([points[earthquake_mask], grid.earthquake_levels[earthquake_mask]]).tolist()
+    cyclone_data = np.column_stack([points[cyclone_mask], grid.cyclone_levels[cyclone_mask]]).tolist()
     
     # Add earthquake heatmap layer
     if earthquake_data:
@@ -172,51 +207,75 @@ def generate_risk_heatmap():
         <p><span style="color: yellow;">●</span> Active Alerts</p>
         <small class="text-muted">Last updated: {}</small>
     </div>
-    '''.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    '''.format(datetime.fromtimestamp(grid.generated_at).strftime('%Y-%m-%d %H:%M:%S'))
     
     m.get_root().html.add_child(folium.Element(legend_html))
     
-    return m._repr_html_()
+    return m
+
+def generate_risk_heatmap(grid=None):
+    """
+    Generate a heatmap showing earthquake and cyclone risks across regions.
+    Returns the HTML content of the map.
+    """
+    if grid is None:
+        grid = get_risk_grid('heatmap')
+    return build_risk_map(grid)._repr_html_()
 
-def get_risk_data():
+def render_risk_map_document(grid):
+    """Render the map for a grid as a standalone HTML document"""
+    return build_risk_map(grid).get_root().render()
+
+def heatmap_version(grid):
+    """
+    Version of the rendered map document.
+
+    The legend shows when the grid was generated, so a recompute with
+    unchanged contents still needs a new document.
+    """
+    return f'{grid.version}-{int(grid.generated_at)}'
+
+def get_heatmap_artifact(grid=None):
+    """Get the rendered, precompressed heatmap document for the latest grid"""
+    if grid is None:
+        grid = get_risk_grid('heatmap')
+    return get_map_artifact(grid, render_risk_map_document, version=heatmap_version(grid))
+
+def get_risk_data(grid=None):
     """
     Get JSON data of current risk levels for API endpoint
     """
+    if grid is None:
+        grid = get_risk_grid('api')
+    
     risk_data = {
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': datetime.fromtimestamp(grid.generated_at).isoformat(),
+        'version': grid.version,
+        'age_seconds': round(grid.age, 1),
+        'stale': grid.is_stale(),
         'earthquake_risks': [],
         'cyclone_risks': [],
-        'active_alerts': get_active_alerts()
+        'active_alerts': grid.active_alerts
     }
     
-    # Generate grid points across the region
-    lat_range = np.linspace(8, 35, 15)  # Reduced points for API response
-    lon_range = np.linspace(68, 97, 15)
+    for lat, lon, level, details in zip(grid.latitudes.tolist(), grid.longitudes.tolist(),
+                                        grid.earthquake_levels.tolist(), grid.earthquake_details.tolist()):
+        if level > 0:
+            risk_data['earthquake_risks'].append({
+                'lat': lat,
+                'lon': lon,
+                'risk_level': level,
+                'details': details
+            })
     
-    for lat in lat_range:
-        for lon in lon_range:
-            try:
-                # Check earthquake risk
-                eq_risk = check_earthquake_risk(lat, lon)
-                if eq_risk['risk_level'] > 0:
-                    risk_data['earthquake_risks'].append({
-                        'lat': lat,
-                        'lon': lon,
-                        'risk_level': eq_risk['risk_level'],
-                        'details': eq_risk['details']
-                    })
-                
-                # Check cyclone risk
-                cyc_risk = check_cyclone_risk(lat, lon)
-                if cyc_risk['risk_level'] > 0:
-                    risk_data['cyclone_risks'].append({
-                        'lat': lat,
-                        'lon': lon,
-                        'risk_level': cyc_risk['risk_level'],
-                        'details': cyc_risk['details']
-                    })
-            except Exception as e:
-                logger.error(f"Error calculating risk for {lat}, {lon}: {str(e)}")
-                continue
-    
-    return risk_data 
\ No newline at end of file
+    for lat, lon, level, details in zip(grid.latitudes.tolist(), grid.longitudes.tolist(),
+                                        grid.cyclone_levels.tolist(), grid.cyclone_details.tolist()):
+        if level > 0:
+            risk_data['cyclone_risks'].append({
+                'lat': lat,
+                'lon': lon,
+                'risk_level': level,
+                'details': details
+            })
+    
+    return risk_data
@@ -0,0 +1,95 @@
+import json
+import math
+import logging
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Smallest magnitude drawn as an earthquake marker, same as the folium map
+MIN_MARKER_MAGNITUDE = 2.5
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of an XYZ web mercator tile in degrees"""
+    n = 2 ** z
+    west = x / n * 360 - 180
+    east = (x + 1) / n * 360 - 180
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def is_valid_tile(z, x, y):
+    max_zoom = getattr(settings, 'RISK_TILE_MAX_ZOOM', 12)
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _in_bounds(latitudes, longitudes, bounds):
+    south, west, north, east = bounds
+    # Tiles are half-open so a point on a shared edge belongs to exactly one tile
+    return (latitudes > south) & (latitudes <= north) & (longitudes >= west) & (longitudes < east)
+
+
+def _point(lon, lat, properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': properties,
+    }
+
+
+def build_tile(grid, z, x, y):
+    """
+    GeoJSON FeatureCollection of everything the risk map draws inside one tile.
+
+    Features carry a 'kind' property: 'earthquake_risk' and 'cyclone_risk'
+    grid points with their risk level, 'quake' USGS events and 'alert'
+    active subscriber alerts.
+    """
+    bounds = tile_bounds(z, x, y)
+    features = []
+
+    mask = _in_bounds(grid.latitudes, grid.longitudes, bounds)
+    for kind, levels in (('earthquake_risk', grid.earthquake_levels), ('cyclone_risk', grid.cyclone_levels)):
+        selected = mask & (levels > 0)
+        for lat, lon, level in zip(grid.latitudes[selected].tolist(), grid.longitudes[selected].tolist(),
+                                   levels[selected].tolist()):
+            features.append(_point(lon, lat, {'kind': kind, 'risk_level': level}))
+
+    quakes = grid.quakes
+    if len(quakes):
+        selected = _in_bounds(quakes[:, 0], quakes[:, 1], bounds) & (quakes[:, 2] > MIN_MARKER_MAGNITUDE)
+        for lat, lon, magnitude, event_ms, depth in quakes[selected].tolist():
+            features.append(_point(lon, lat, {
+                'kind': 'quake',
+                'magnitude': magnitude,
+                'time': int(event_ms),
+                'depth': None if math.isnan(depth) else depth,
+            }))
+
+    for alert in grid.active_alerts:
+        lat, lon = alert['latitude'], alert['longitude']
+        if _in_bounds(np.array([lat]), np.array([lon]), bounds)[0]:
+            features.append(_point(lon, lat, {
+                'kind': 'alert',
+                'name': alert['primary_location_name'],
+                'details': alert['last_alert_details'],
+            }))
+
+    return {'type': 'FeatureCollection', 'version': grid.version, 'features': features}
+
+
+def get_risk_tile(grid, z, x, y):
+    """
+    Serialized GeoJSON for a tile, cached per (z, x, y, grid version).
+
+    A new grid version changes the cache key, so stale tiles simply expire.
+    """
+    key = f'risk_tile:{grid.version}:{z}:{x}:{y}'
+    content = cache.get(key)
+    if content is None:
+        content = json.dumps(build_tile(grid, z, x, y), separators=(',', ':')).encode('utf-8')
+        cache.set(key, content, getattr(settings, 'RISK_TILE_CACHE_TTL', 3600))
+    return content
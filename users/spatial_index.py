@@ -0,0 +1,85 @@
+import math
+import numpy as np
+from .distance import haversine_distances, KM_PER_DEGREE
+
+
+class GridIndex:
+    """
+    Spatial index that buckets points into fixed lat/lon grid cells.
+
+    Radius queries only compute distances for points in the cells overlapping
+    the query's bounding box, instead of scanning every point.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_degrees=1.0):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(math.ceil(180 / cell_degrees))
+        self.n_cols = int(math.ceil(360 / cell_degrees))
+
+        cells = self._cell_ids(self._rows(self.latitudes), self._cols(self.longitudes))
+        # Points sorted by cell so each cell maps to one contiguous slice
+        self._order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[self._order]
+        unique_cells, starts, counts = np.unique(sorted_cells, return_index=True, return_counts=True)
+        self._slices = {
+            int(cell): (int(start), int(start + count))
+            for cell, start, count in zip(unique_cells, starts, counts)
+        }
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _rows(self, lats):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_degrees).astype(np.int64)
+        return np.clip(rows, 0, self.n_rows - 1)
+
+    def _cols(self, lons):
+        return np.floor((np.asarray(lons) + 180) / self.cell_degrees).astype(np.int64) % self.n_cols
+
+    def _cell_ids(self, rows, cols):
+        return rows * self.n_cols + cols
+
+    def candidates(self, lat, lon, km):
+        """Indices of points in the grid cells covering the query's bounding box"""
+        lat_span = km / KM_PER_DEGREE
+        min_row = int(self._rows(max(lat - lat_span, -90)))
+        max_row = int(self._rows(min(lat + lat_span, 90)))
+
+        # Longitude degrees shrink towards the poles; fall back to every column there
+        max_abs_lat = min(abs(lat) + lat_span, 90)
+        cos_lat = math.cos(math.radians(max_abs_lat))
+        if cos_lat < 1e-6 or km / (KM_PER_DEGREE * cos_lat) >= 180:
+            cols = range(self.n_cols)
+        else:
+            lon_span = km / (KM_PER_DEGREE * cos_lat)
+            first = int(math.floor((lon - lon_span + 180) / self.cell_degrees))
+            last = int(math.floor((lon + lon_span + 180) / self.cell_degrees))
+            cols = sorted({col % self.n_cols for col in range(first, last + 1)})
+
+        chunks = []
+        for row in range(min_row, max_row + 1):
+            for col in cols:
+                bounds = self._slices.get(row * self.n_cols + col)
+                if bounds is not None:
+                    chunks.append(self._order[bounds[0]:bounds[1]])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def query_radius(self, lat, lon, km):
+        """
+        Find points strictly closer than km kilometers to (lat, lon).
+
+        Returns:
+            tuple: (indices, distances) arrays in input order
+        """
+        candidates = self.candidates(lat, lon, km)
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float64)
+        distances = haversine_distances(lat, lon, self.latitudes[candidates], self.longitudes[candidates])
+        mask = distances < km
+        indices, distances = candidates[mask], distances[mask]
+        order = np.argsort(indices, kind='stable')
+        return indices[order], distances[order]
@@ -0,0 +1,89 @@
+import logging
+from django.conf import settings
+from django.db.models import Q
+from .geo_queries import grid_cell_expression
+from .models import UserSubscription
+
+logger = logging.getLogger(__name__)
+
+# Fields read by risk evaluation, the alert ledger and the alert senders
+SUBSCRIBER_FIELDS = (
+    'grid_cell', 'email', 'latitude', 'longitude', 'primary_location_name',
+    'enable_whatsapp_alerts', 'whatsapp_phone_number',
+)
+
+
+def after_key(key):
+    """Rows strictly after a (grid_cell, pk) key in subscriber order"""
+    cell, pk = key
+    return Q(grid_cell__gt=cell) | Q(grid_cell=cell, pk__gt=pk)
+
+
+def up_to_key(key):
+    """Rows up to and including a (grid_cell, pk) key in subscriber order"""
+    cell, pk = key
+    return Q(grid_cell__lt=cell) | Q(grid_cell=cell, pk__lte=pk)
+
+
+def subscriber_queryset():
+    """Subscribers in (grid_cell, pk) order, so neighbours are read together"""
+    return UserSubscription.objects.order_by('grid_cell', 'pk')
+
+
+def backfill_grid_cells():
+    """Fill grid_cell for rows written without save(), e.g. by bulk_create or update()"""
+    filled = UserSubscription.objects.filter(grid_cell__isnull=True).update(grid_cell=grid_cell_expression())
+    if filled:
+        logger.info(f"Filled missing grid cells for {filled} subscriptions")
+    return filled
+
+
+def plan_subscriber_ranges(range_size):
+    """
+    Split subscribers into consecutive key ranges of at most range_size rows.
+
+    Only the last key of each range is read, by skipping range_size rows
+    along the (grid_cell, id) index, so planning never loads the subscribers.
+
+    Returns:
+        list: dicts with 'after' (exclusive start key, None for the first range),
+        'last' (inclusive end key, None for the last range) and 'size'
+    """
+    ranges = []
+    after = None
+    while True:
+        queryset = subscriber_queryset()
+        if after is not None:
+            queryset = queryset.filter(after_key(after))
+        boundary = list(queryset.values_list('grid_cell', 'pk')[range_size - 1:range_size])
+        if not boundary:
+            size = queryset.count()
+            if size:
+                ranges.append({'after': after, 'last': None, 'size': size})
+            return ranges
+        last = list(boundary[0])
+        ranges.append({'after': after, 'last': last, 'size': range_size})
+        after = last
+
+
+def iter_subscriber_chunks(chunk_size=None, after=None, last=None):
+    """
+    Stream subscribers in keyset-paginated chunks, optionally within a key range.
+
+    Each chunk is one indexed query for the fields in SUBSCRIBER_FIELDS, so
+    memory stays bounded by the chunk size however many subscribers there are.
+
+    Yields:
+        list: Up to chunk_size UserSubscription instances
+    """
+    chunk_size = chunk_size or getattr(settings, 'RISK_CHUNK_SIZE', 500)
+    queryset = subscriber_queryset().only(*SUBSCRIBER_FIELDS)
+    if last is not None:
+        queryset = queryset.filter(up_to_key(last))
+    while True:
+        page = queryset.filter(after_key(after)) if after is not None else queryset
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = (chunk[-1].grid_cell, chunk[-1].pk)
@@ -1,13 +1,21 @@
-from celery import shared_task
+from celery import chord, shared_task
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import UserSubscription
-from .whatsapp_utils import send_whatsapp_alert
-from earthquakes.model_utils import predict_earthquake_risk
-from cyclones.model_utils import predict_cyclone_risk
-import requests
-import json
-from math import radians, sin, cos, sqrt, atan2
+from earthquakes.model_utils import predict_earthquake_risk_batch
+from cyclones.model_utils import predict_cyclone_risk_batch
+from .usgs_feed import get_feed_snapshot, refresh_feed_snapshot
+from .weather_client import get_weather_client
+from .risk_engine import ConcurrentRunner, group_locations
+from .risk_cache import EARTHQUAKE_INFLUENCE_KM, get_earthquake_risk_cache
+from .alert_queue import chunk_alerts, send_alert_emails
+from .alert_ledger import alert_key, prune_alert_ledger, record_alerts, release_alerts, select_new_alerts
+from .event_watch import get_event_watcher
+from .subscribers import SUBSCRIBER_FIELDS, backfill_grid_cells, iter_subscriber_chunks, plan_subscriber_ranges
+from .models import AlertLedger, UserSubscription
+from .messaging import get_messaging_provider
+from .outbox import deliver_due_messages, enqueue_whatsapp_alerts
+import time
+from .distance import haversine_distances
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,7 +39,13 @@ def test_email():
 
 @shared_task
 def check_disaster_predictions():
-    """Check for potential disasters and send alerts to users in affected areas."""
+    """
+    Plan a disaster check cycle: shard subscribers and fan the shards out as a chord.
+    
+    Each shard is evaluated by evaluate_subscriber_shard, alerts are queued on the
+    'alerts' queue, and summarize_disaster_check aggregates the shard stats.
+    """
+    started_at = time.time()
     try:
         logger.info("Starting disaster prediction check")
         
@@ -48,303 +62,710 @@ def check_disaster_predictions():
             logger.error(f"Database access error: {str(db_error)}")
             return f"Database access error: {str(db_error)}"
         
-        # Process each user subscription
-        process_count = 0
-        error_count = 0
-        users = UserSubscription.objects.all()
-        
-        for user in users:
-            try:
-                process_count += 1
-                logger.debug(f"Processing user {user.email} ({process_count}/{users_count})")
-                
-                # Check for cyclones
-                cyclone_risk = check_cyclone_risk(user.latitude, user.longitude)
-                if cyclone_risk['risk_level'] > 0:
-                    logger.info(f"Cyclone risk detected for {user.email}: Level {cyclone_risk['risk_level']}")
-                    send_disaster_alert(
-                        user,
-                        'Cyclone Alert',
-                        f"Potential cyclone detected in your area!\nRisk Level: {cyclone_risk['risk_level']}\n{cyclone_risk['details']}"
-                    )
-                
-                # Check for earthquakes
-                earthquake_risk = check_earthquake_risk(user.latitude, user.longitude)
-                if earthquake_risk['risk_level'] > 0:
-                    logger.info(f"Earthquake risk detected for {user.email}: Level {earthquake_risk['risk_level']}")
-                    send_disaster_alert(
-                        user,
-                        'Earthquake Alert',
-                        f"Potential earthquake risk in your area!\nRisk Level: {earthquake_risk['risk_level']}\n{earthquake_risk['details']}"
-                    )
-                
-            except Exception as user_error:
-                error_count += 1
-                logger.error(f"Error processing user {user.email}: {str(user_error)}")
-                continue
+        # Only warms this process's snapshot, which shards share when they run in the
+        # same worker (e.g. the threads pool). Shards in other worker processes keep
+        # their own snapshot and revalidate it with a conditional GET once it is older
+        # than USGS_FEED_MAX_AGE.
+        try:
+            refresh_feed_snapshot()
+        except Exception as feed_error:
+            logger.error(f"Error fetching USGS feed: {str(feed_error)}")
         
-        logger.info(f"Disaster prediction check completed. Processed {process_count} users with {error_count} errors.")
-        return f"Disaster prediction check completed. Processed {process_count} users with {error_count} errors."
+        try:
+            pruned = prune_alert_ledger()
+            if pruned:
+                logger.info(f"Pruned {pruned} expired alert ledger entries")
+        except Exception as ledger_error:
+            logger.error(f"Error pruning alert ledger: {str(ledger_error)}")
+        
+        shards = plan_subscriber_shards()
+        if not shards:
+            # Subscriptions deleted since the count; an empty chord would never run its callback
+            logger.warning("No subscriber shards planned - nothing to check")
+            return summarize_disaster_check([], started_at)
+        logger.info(f"Dispatching {len(shards)} shards for {users_count} users")
+        
+        chord(evaluate_subscriber_shard.s(shard) for shard in shards)(
+            summarize_disaster_check.s(started_at)
+        )
+        # The cycle totals are logged and returned by summarize_disaster_check once every shard is done
+        return f"Disaster prediction check scheduled. {users_count} users in {len(shards)} shards."
         
     except Exception as e:
         logger.error(f"Critical error in disaster prediction check: {str(e)}")
         return f"Critical error in disaster check: {str(e)}"
 
-def check_cyclone_risk(lat, lon):
-    """Check cyclone risk using weather API and XGBoost model predictions."""
-    try:
-        api_key = settings.OPENWEATHERMAP_API_KEY
-        url = f'http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric'
-        
-        response = requests.get(url)
-        data = response.json()
-        
-        # Extract weather features
-        wind_speed = data.get('wind', {}).get('speed', 0)
-        wind_deg = data.get('wind', {}).get('deg', 0)
-        pressure = data.get('main', {}).get('pressure', 1013)
-        humidity = data.get('main', {}).get('humidity', 50)
-        temperature = data.get('main', {}).get('temp', 25)
-        feels_like = data.get('main', {}).get('feels_like', temperature)
-        temp_min = data.get('main', {}).get('temp_min', temperature - 2)
-        temp_max = data.get('main', {}).get('temp_max', temperature + 2)
-        visibility = data.get('visibility', 10000)
-        clouds = data.get('clouds', {}).get('all', 0)
-        
-        # Get 5-day forecast for trend analysis
-        forecast_url = f'http://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={api_key}&units=metric'
-        forecast_response = requests.get(forecast_url)
-        forecast_data = forecast_response.json()
-        
-        # Process forecast data
-        forecast_entries = forecast_data.get('list', [])
-        
-        # Initialize forecast features
-        forecast_temps = []
-        forecast_pressures = []
-        forecast_humidities = []
-        forecast_wind_speeds = []
-        forecast_wind_dirs = []
-        
-        # Get next 5 forecasts (roughly 15 hours)
-        for entry in forecast_entries[:5]:
-            forecast_temps.append(entry.get('main', {}).get('temp', temperature))
-            forecast_pressures.append(entry.get('main', {}).get('pressure', pressure))
-            forecast_humidities.append(entry.get('main', {}).get('humidity', humidity))
-            forecast_wind_speeds.append(entry.get('wind', {}).get('speed', wind_speed))
-            forecast_wind_dirs.append(entry.get('wind', {}).get('deg', wind_deg))
-        
-        # Calculate trends and averages
-        temp_trend = sum(forecast_temps) / len(forecast_temps) if forecast_temps else temperature
-        pressure_trend = sum(forecast_pressures) / len(forecast_pressures) if forecast_pressures else pressure
-        humidity_trend = sum(forecast_humidities) / len(forecast_humidities) if forecast_humidities else humidity
-        wind_speed_trend = sum(forecast_wind_speeds) / len(forecast_wind_speeds) if forecast_wind_speeds else wind_speed
-        wind_dir_trend = sum(forecast_wind_dirs) / len(forecast_wind_dirs) if forecast_wind_dirs else wind_deg
-        
-        # Check immediate risk based on wind speed
-        api_risk_level = 0
-        api_details = []
-        
-        if wind_speed > 32.7:  # Hurricane force winds
-            api_risk_level = 3
-            api_details.append("Hurricane force winds detected!")
-        elif wind_speed > 24.5:  # Storm force winds
-            api_risk_level = 2
-            api_details.append("Storm force winds detected!")
-        elif wind_speed > 13.9:  # Near gale to gale force
-            api_risk_level = 1
-            api_details.append("Strong winds detected!")
-            
-        # Prepare features for ML model (30 features)
-        features = [
-            # Current conditions (10 features)
-            wind_speed,
-            wind_deg,
-            pressure,
-            humidity,
-            temperature,
-            feels_like,
-            temp_min,
-            temp_max,
-            visibility,
-            clouds,
+def plan_subscriber_shards(shard_size=None):
+    """
+    Split subscribers into key ranges of at most RISK_SHARD_SIZE users.
+    
+    Subscribers are ordered by grid cell, so users sharing a location land in
+    the same shard and are still evaluated once. Shards carry key ranges rather
+    than ids, so neither the planner nor the broker holds every subscriber id.
+    
+    Returns:
+        list: Shard dicts as returned by plan_subscriber_ranges
+    """
+    shard_size = shard_size or getattr(settings, 'RISK_SHARD_SIZE', 500)
+    backfill_grid_cells()
+    return plan_subscriber_ranges(shard_size)
+
+def process_subscribers(users, runner=None):
+    """
+    Evaluate cyclone and earthquake risk for a list of subscribers.
+    
+    Risks already alerted within ALERT_COOLDOWN are dropped unless they escalated.
+    The alerts are not recorded in the ledger yet; queue_alerts does that.
+    
+    Returns:
+        tuple: (alerts, stats) where alerts holds (user, hazard, level, subject, message) tuples
+    """
+    process_count = 0
+    error_count = 0
+    
+    # Check for cyclones and earthquakes once per location, with batched model calls
+    cyclone_risks, earthquake_risks, dedup_stats = evaluate_subscriber_risks(users, runner=runner)
+    
+    candidates = []
+    for user, cyclone_risk, earthquake_risk in zip(users, cyclone_risks, earthquake_risks):
+        try:
+            process_count += 1
+            logger.debug(f"Processing user {user.email} ({process_count}/{len(users)})")
             
-            # Location features (2 features)
-            lat,
-            lon,
+            if cyclone_risk['risk_level'] > 0:
+                logger.info(f"Cyclone risk detected for {user.email}: Level {cyclone_risk['risk_level']}")
+                candidates.append((
+                    user,
+                    AlertLedger.CYCLONE,
+                    cyclone_risk['risk_level'],
+                    'Cyclone Alert',
+                    f"Potential cyclone detected in your area!\nRisk Level: {cyclone_risk['risk_level']}\n{cyclone_risk['details']}"
+                ))
             
-            # Forecast trends (5 features)
-            temp_trend,
-            pressure_trend,
-            humidity_trend,
-            wind_speed_trend,
-            wind_dir_trend,
+            if earthquake_risk['risk_level'] > 0:
+                logger.info(f"Earthquake risk detected for {user.email}: Level {earthquake_risk['risk_level']}")
+                candidates.append((
+                    user,
+                    AlertLedger.EARTHQUAKE,
+                    earthquake_risk['risk_level'],
+                    'Earthquake Alert',
+                    f"Potential earthquake risk in your area!\nRisk Level: {earthquake_risk['risk_level']}\n{earthquake_risk['details']}"
+                ))
             
-            # Individual forecast points (13 features to complete 30)
-            *forecast_temps[:3],
-            *forecast_pressures[:3],
-            *forecast_humidities[:3],
-            *forecast_wind_speeds[:2],
-            *forecast_wind_dirs[:2]
-        ]
-        
-        # Get ML model prediction
-        ml_prediction = predict_cyclone_risk(features)
-        ml_risk_level = ml_prediction['risk_level']
-        
-        if ml_risk_level > 0:
-            api_details.append(ml_prediction['details'])
-        
-        # Combine risk assessments - take the higher risk level
-        final_risk_level = max(api_risk_level, ml_risk_level)
-        
-        logger.info(f"Wind speed: {wind_speed}, Risk level: {final_risk_level}")
-        
-        return {
-            'risk_level': final_risk_level,
-            'details': "\n".join(api_details) if api_details else "No immediate cyclone risk",
-            'weather_data': {
-                'wind_speed': wind_speed,
-                'pressure': pressure,
-                'humidity': humidity,
-                'temperature': temperature,
-                'forecast_trend': {
-                    'temp': temp_trend,
-                    'pressure': pressure_trend,
-                    'wind_speed': wind_speed_trend
-                }
-            },
-            'ml_prediction': ml_prediction['raw_prediction']
-        }
+        except Exception as user_error:
+            error_count += 1
+            logger.error(f"Error processing user {user.email}: {str(user_error)}")
+            continue
+    
+    alerts, suppressed = select_new_alerts(candidates)
+    
+    stats = {
+        'users': process_count,
+        'errors': error_count,
+        'suppressed': suppressed,
+        'locations': dedup_stats['locations'],
+        'elapsed': dedup_stats['elapsed'],
+        'time_saved': dedup_stats['time_saved'],
+    }
+    return alerts, stats
+
+@shared_task(bind=True, max_retries=3)
+def evaluate_subscriber_shard(self, shard):
+    """
+    Evaluate one shard of subscribers and queue their alerts.
+    
+    The shard's key range is streamed in RISK_CHUNK_SIZE chunks, and each
+    chunk's alerts are queued and recorded in the alert ledger as soon as it
+    is evaluated. A failing shard is retried with backoff on its own; chunks
+    whose alerts were queued are then suppressed by the ledger, while alerts
+    that never made it to the queue are selected again. Once retries run out
+    the users the last attempt did not get through are reported as errors,
+    so the cycle summary still runs.
+    
+    Returns:
+        dict: Shard stats consumed by summarize_disaster_check
+    """
+    stats = {'users': 0, 'errors': 0, 'suppressed': 0, 'locations': 0,
+             'elapsed': 0.0, 'time_saved': 0.0, 'alerts': 0}
+    try:
+        # Weather lookups run on a bounded thread pool with per-upstream limits
+        runner = ConcurrentRunner()
+        for users in iter_subscriber_chunks(after=shard['after'], last=shard['last']):
+            alerts, chunk_stats = process_subscribers(users, runner=runner)
+            queue_alerts(alerts)
+            chunk_stats['alerts'] = len(alerts)
+            for key in stats:
+                stats[key] += chunk_stats[key]
+        logger.info(f"Shard risk evaluation stats: {runner.stats}")
+        logger.info(f"Weather client stats: {get_weather_client().stats()}")
         
     except Exception as e:
-        logger.error(f"Error checking cyclone risk: {str(e)}")
-        return {'risk_level': 0, 'details': "Unable to check cyclone risk"}
+        if self.request.retries < self.max_retries:
+            delay = getattr(settings, 'RISK_SHARD_RETRY_DELAY', 10) * 2 ** self.request.retries
+            logger.warning(f"Shard of {shard['size']} users failed, retrying in {delay}s: {str(e)}")
+            raise self.retry(exc=e, countdown=delay)
+        logger.error(f"Shard of {shard['size']} users failed after {self.max_retries} retries: {str(e)}")
+        # Alerts queued by earlier attempts are counted as suppressed by the last one
+        unprocessed = max(shard['size'] - stats['users'], 0)
+        stats['errors'] += unprocessed
+        stats['users'] += unprocessed
+        stats['failed'] = True
+    
+    return stats
 
-def check_earthquake_risk(lat, lon):
-    """Check earthquake risk using both USGS real-time data and ML model predictions."""
+def queue_alerts(alerts, source=None):
+    """
+    Hand (user, hazard, level, subject, message) alerts to the 'alerts' queue
+    and record them in the alert ledger under `source` (see alert_key).
+    
+    Emails go out in batches, each over one SMTP connection; WhatsApp
+    messages are stored in the outbox and sent by the delivery worker.
+    The ledger is only written once both are handed off, so alerts that
+    fail to queue are not suppressed on the next attempt.
+    """
+    email_alerts = [[user.pk, hazard, subject, message, source] for user, hazard, _, subject, message in alerts]
+    for batch in chunk_alerts(email_alerts):
+        send_alert_emails_task.delay(batch)
+    if enqueue_whatsapp_alerts([(user, subject, message) for user, _, _, subject, message in alerts]):
+        deliver_outbound_messages.delay()
+    record_alerts(alerts, source=source)
+
+@shared_task(bind=True, max_retries=5)
+def send_alert_emails_task(self, alerts):
+    """
+    Send a batch of [user_id, hazard, subject, message, source] email alerts over one connection.
+    
+    Alerts that fail are retried together with exponential backoff; alerts
+    that were sent are not repeated. Alerts still failing after the last
+    retry are released from the alert ledger, so the next cycle tries again.
+    """
+    users = UserSubscription.objects.only(*SUBSCRIBER_FIELDS).in_bulk([alert[0] for alert in alerts])
+    batch = []
+    hazards = {}
+    for user_id, hazard, subject, message, source in alerts:
+        if user_id in users:
+            alert = (users[user_id], subject, message)
+            batch.append(alert)
+            hazards[alert] = (hazard, source)
+        else:
+            logger.warning(f"Subscriber {user_id} no longer exists, dropping {subject}")
+    
+    failed = send_alert_emails(batch)
+    if not failed:
+        return f"Sent {len(batch)} email alerts"
+    
+    retry = [[alert[0].pk, hazards[alert][0], alert[1], alert[2], hazards[alert][1]] for alert, _ in failed]
+    if self.request.retries < self.max_retries:
+        delay = getattr(settings, 'EMAIL_RETRY_DELAY', 30) * 2 ** self.request.retries
+        logger.warning(f"{len(retry)} of {len(batch)} email alerts failed, retrying in {delay}s")
+        raise self.retry(args=[retry], countdown=delay, exc=failed[0][1])
+    logger.error(f"Giving up on {len(retry)} email alerts after {self.max_retries} retries")
+    release_alerts([alert_key(alert[0], *hazards[alert]) for alert, _ in failed])
+    return f"Sent {len(batch) - len(retry)} email alerts, {len(retry)} failed"
+
+@shared_task
+def deliver_outbound_messages():
+    """
+    Send the WhatsApp messages due in the outbox, routed to the 'messages' queue.
+    
+    Runs after every batch of queued alerts and on a schedule, which picks up
+    retries; concurrent runs are safe because each message is claimed first.
+    """
+    stats = deliver_due_messages()
+    if any(stats.values()):
+        logger.info(f"WhatsApp delivery: {stats['sent']} sent, {stats['failed']} failed, "
+                    f"{stats['timed_out']} timed out")
+    return stats
+
+@shared_task
+def summarize_disaster_check(shard_stats, started_at=None):
+    """Aggregate the stats returned by every shard of a cycle"""
+    users = sum(stats['users'] for stats in shard_stats)
+    errors = sum(stats['errors'] for stats in shard_stats)
+    locations = sum(stats['locations'] for stats in shard_stats)
+    alerts = sum(stats['alerts'] for stats in shard_stats)
+    suppressed = sum(stats['suppressed'] for stats in shard_stats)
+    time_saved = sum(stats['time_saved'] for stats in shard_stats)
+    failed = sum(1 for stats in shard_stats if stats.get('failed'))
+    dedup_ratio = users / locations if locations else 1.0
+    
+    summary = (
+        f"Disaster prediction check completed. Processed {users} users in {len(shard_stats)} shards "
+        f"with {errors} errors ({failed} failed shards). "
+        f"Evaluated {locations} unique locations (dedup ratio {dedup_ratio:.2f}x, ~{time_saved:.1f}s saved). "
+        f"Queued {alerts} alerts, suppressed {suppressed} repeats."
+    )
+    if started_at is not None:
+        summary += f" Cycle took {time.time() - started_at:.1f}s."
+    logger.info(summary)
+    return summary
+
+@shared_task
+def watch_usgs_events():
+    """
+    Alert subscribers near new USGS events without waiting for the next check cycle.
+    
+    Polls the small EARTHQUAKE_WATCH_FEEDS with conditional GETs. Each new
+    event is evaluated with the regular earthquake risk model, but only for
+    the subscribers within its influence radius. The time from the event's
+    origin to dispatching its alerts is logged and kept in the watcher stats.
+    """
+    watcher = get_event_watcher()
     try:
-        # Get USGS real-time data (last month)
-        url = f'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson'
-        response = requests.get(url)
-        data = response.json()
-        
-        # Process USGS data
-        recent_quakes = []
-        for feature in data.get('features', []):
-            coords = feature.get('geometry', {}).get('coordinates', [])
-            if len(coords) >= 2:
-                eq_lon, eq_lat = coords[0], coords[1]
-                magnitude = feature.get('properties', {}).get('mag', 0)
-                distance = calculate_distance(lat, lon, eq_lat, eq_lon)
-                
-                if distance < 100:  # Focus on closer earthquakes for immediate risk
-                    recent_quakes.append({
-                        'distance': distance,
-                        'magnitude': magnitude,
-                        'time': feature.get('properties', {}).get('time', 0)
-                    })
-        
-        # Calculate USGS-based risk metrics
-        usgs_risk_level = 0
-        usgs_details = []
-        
-        if recent_quakes:
-            # Sort by magnitude and distance
-            recent_quakes.sort(key=lambda x: (-x['magnitude'], x['distance']))
-            strongest_quake = recent_quakes[0]
-            
-            # Check for immediate high-risk conditions
-            if strongest_quake['magnitude'] >= 6.0 and strongest_quake['distance'] < 50:
-                usgs_risk_level = 3
-                usgs_details.append(f"USGS: Major earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away!")
-            elif strongest_quake['magnitude'] >= 5.0 and strongest_quake['distance'] < 75:
-                usgs_risk_level = 2
-                usgs_details.append(f"USGS: Significant earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away")
-            elif strongest_quake['magnitude'] >= 4.0 and strongest_quake['distance'] < 100:
-                usgs_risk_level = 1
-                usgs_details.append(f"USGS: Moderate earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away")
-        
-        # Prepare features for ML model
-        features = [
-            lat,  # location
-            lon,
-            len(recent_quakes),  # number of recent earthquakes
-            max((q['magnitude'] for q in recent_quakes), default=0),  # max magnitude
-            min((q['distance'] for q in recent_quakes), default=1000),  # closest distance
-            sum(q['magnitude'] for q in recent_quakes)  # total seismic energy
-        ]
-        
-        # Get ML model prediction
-        ml_prediction = predict_earthquake_risk(features)
-        ml_risk_level = ml_prediction['risk_level']
-        
-        if ml_risk_level > 0:
-            usgs_details.append(f"ML Model: {ml_prediction['details']}")
-        
-        # Combine risk assessments - take the higher risk level
-        final_risk_level = max(usgs_risk_level, ml_risk_level)
+        events, snapshots = watcher.poll()
+        if not events:
+            return "No new earthquake events"
+        
+        # The risk model reads the shared snapshot, so it has to include the new events
+        if getattr(settings, 'USGS_FEED_SOURCE', 'feed') == 'catalog':
+            from earthquakes.catalog import ingest_snapshot
+            for snapshot in snapshots:
+                ingest_snapshot(snapshot)
+        snapshot = refresh_feed_snapshot()
+        known = set(snapshot.ids.tolist())
+        
+        handled = 0
+        # Largest first, so a subscriber near several new events is alerted about the strongest
+        for event in sorted(events, key=lambda event: event['magnitude'], reverse=True):
+            if event['event_id'] not in known:
+                logger.info(f"USGS event {event['event_id']} is not in the risk feed yet, retrying on the next poll")
+                continue
+            if not watcher.claim(event):
+                logger.info(f"USGS event {event['event_id']} was already handled by another worker")
+                continue
+            try:
+                alerts = alert_event_subscribers(event, snapshot)
+            except Exception as event_error:
+                watcher.release(event)
+                logger.error(f"Error alerting subscribers near USGS event {event['event_id']}: {str(event_error)}")
+                continue
+            latency = watcher.mark_handled(event, len(alerts))
+            handled += 1
+            logger.info(f"USGS event {event['event_id']} (M{event['magnitude']:.1f}): "
+                        f"{len(alerts)} alerts dispatched {latency:.1f}s after origin")
         
-        # Prepare detailed response
-        return {
-            'risk_level': final_risk_level,
-            'details': "\n".join(usgs_details) if usgs_details else "No immediate earthquake risk detected",
-            'usgs_data': {
-                'recent_earthquakes': len(recent_quakes),
-                'strongest_magnitude': max((q['magnitude'] for q in recent_quakes), default=0),
-                'closest_distance': min((q['distance'] for q in recent_quakes), default=None)
-            },
-            'ml_prediction': ml_prediction['raw_prediction']
+        return f"Handled {handled} of {len(events)} new earthquake events. Watcher stats: {watcher.stats()}"
+    except Exception as e:
+        logger.error(f"Error watching USGS events: {str(e)}")
+        return f"Error watching USGS events: {str(e)}"
+
+def alert_event_subscribers(event, snapshot):
+    """
+    Evaluate and alert the subscribers within the influence radius of one event.
+    
+    Returns:
+        list: The (user, hazard, level, subject, message) alerts queued, after the alert ledger
+    """
+    users = list(UserSubscription.objects.only(*SUBSCRIBER_FIELDS).within_radius(
+        event['latitude'], event['longitude'], EARTHQUAKE_INFLUENCE_KM
+    ))
+    if not users:
+        return []
+    
+    locations, membership = group_locations([(user.latitude, user.longitude) for user in users])
+    risks = check_earthquake_risk_batch(locations, snapshot=snapshot)
+    
+    candidates = []
+    for user, group in zip(users, membership):
+        risk = risks[group]
+        if risk['risk_level'] > 0:
+            candidates.append((
+                user,
+                AlertLedger.EARTHQUAKE,
+                risk['risk_level'],
+                'Earthquake Alert',
+                f"M{event['magnitude']:.1f} earthquake reported {user.distance:.0f} km from {user.primary_location_name}!\n"
+                f"Risk Level: {risk['risk_level']}\n{risk['details']}"
+            ))
+    
+    # Keyed by the event, so a second quake within the cooldown is still alerted
+    source = f"event:{event['event_id']}"
+    alerts, _ = select_new_alerts(candidates, source=source)
+    queue_alerts(alerts, source=source)
+    return alerts
+
+@shared_task
+def refresh_risk_grid():
+    """Recompute the materialized risk grids served by the heatmap and risk data API"""
+    # Imported here because risk_heatmap imports this module
+    from .risk_heatmap import refresh_risk_grids
+    try:
+        grids = refresh_risk_grids()
+        return f"Risk grids refreshed: {', '.join(f'{name} {grid.version}' for name, grid in grids.items())}"
+    except Exception as e:
+        logger.error(f"Error refreshing risk grids: {str(e)}")
+        return f"Error refreshing risk grids: {str(e)}"
+
+def evaluate_subscriber_risks(users, runner=None):
+    """
+    Compute cyclone and earthquake risk once per location group and fan the
+    results out to every subscriber in it.
+    
+    Subscribers are grouped by RISK_DEDUP_CELL_DEGREES grid cell, so users
+    sharing (nearly) the same coordinates cost a single evaluation.
+    
+    Returns:
+        tuple: (cyclone_risks, earthquake_risks, stats) with one risk dict per user
+    """
+    start = time.monotonic()
+    locations, membership = group_locations([(user.latitude, user.longitude) for user in users])
+    
+    cyclone_risks = check_cyclone_risk_batch(locations, runner=runner)
+    earthquake_risks = check_earthquake_risk_batch(locations)
+    
+    elapsed = time.monotonic() - start
+    per_location = elapsed / len(locations) if locations else 0.0
+    stats = {
+        'subscribers': len(users),
+        'locations': len(locations),
+        'dedup_ratio': len(users) / len(locations) if locations else 1.0,
+        'elapsed': elapsed,
+        'time_saved': per_location * (len(users) - len(locations)),
+    }
+    logger.info(f"Location deduplication: {stats}")
+    
+    return (
+        [cyclone_risks[group] for group in membership],
+        [earthquake_risks[group] for group in membership],
+        stats,
+    )
+
+def get_cyclone_weather(lat, lon, weather_client=None):
+    """
+    Fetch current weather and forecast for a location and build the 30 raw
+    features used by the cyclone model, plus the wind-speed based risk.
+    """
+    # Cached, pooled client shared by all locations in the same grid cell
+    weather_client = weather_client or get_weather_client()
+    data = weather_client.current_weather(lat, lon)
+    
+    # Extract weather features
+    wind_speed = data.get('wind', {}).get('speed', 0)
+    wind_deg = data.get('wind', {}).get('deg', 0)
+    pressure = data.get('main', {}).get('pressure', 1013)
+    humidity = data.get('main', {}).get('humidity', 50)
+    temperature = data.get('main', {}).get('temp', 25)
+    feels_like = data.get('main', {}).get('feels_like', temperature)
+    temp_min = data.get('main', {}).get('temp_min', temperature - 2)
+    temp_max = data.get('main', {}).get('temp_max', temperature + 2)
+    visibility = data.get('visibility', 10000)
+    clouds = data.get('clouds', {}).get('all', 0)
+    
+    # Get 5-day forecast for trend analysis
+    forecast_data = weather_client.forecast(lat, lon)
+    
+    # Process forecast data
+    forecast_entries = forecast_data.get('list', [])
+    
+    # Initialize forecast features
+    forecast_temps = []
+    forecast_pressures = []
+    forecast_humidities = []
+    forecast_wind_speeds = []
+    forecast_wind_dirs = []
+    
+    # Get next 5 forecasts (roughly 15 hours)
+    for entry in forecast_entries[:5]:
+        forecast_temps.append(entry.get('main', {}).get('temp', temperature))
+        forecast_pressures.append(entry.get('main', {}).get('pressure', pressure))
+        forecast_humidities.append(entry.get('main', {}).get('humidity', humidity))
+        forecast_wind_speeds.append(entry.get('wind', {}).get('speed', wind_speed))
+        forecast_wind_dirs.append(entry.get('wind', {}).get('deg', wind_deg))
+    
+    # Calculate trends and averages
+    temp_trend = sum(forecast_temps) / len(forecast_temps) if forecast_temps else temperature
+    pressure_trend = sum(forecast_pressures) / len(forecast_pressures) if forecast_pressures else pressure
+    humidity_trend = sum(forecast_humidities) / len(forecast_humidities) if forecast_humidities else humidity
+    wind_speed_trend = sum(forecast_wind_speeds) / len(forecast_wind_speeds) if forecast_wind_speeds else wind_speed
+    wind_dir_trend = sum(forecast_wind_dirs) / len(forecast_wind_dirs) if forecast_wind_dirs else wind_deg
+    
+    # Check immediate risk based on wind speed
+    api_risk_level = 0
+    api_details = []
+    
+    if wind_speed > 32.7:  # Hurricane force winds
+        api_risk_level = 3
+        api_details.append("Hurricane force winds detected!")
+    elif wind_speed > 24.5:  # Storm force winds
+        api_risk_level = 2
+        api_details.append("Storm force winds detected!")
+    elif wind_speed > 13.9:  # Near gale to gale force
+        api_risk_level = 1
+        api_details.append("Strong winds detected!")
+        
+    # Prepare features for ML model (30 features)
+    features = [
+        # Current conditions (10 features)
+        wind_speed,
+        wind_deg,
+        pressure,
+        humidity,
+        temperature,
+        feels_like,
+        temp_min,
+        temp_max,
+        visibility,
+        clouds,
+        
+        # Location features (2 features)
+        lat,
+        lon,
+        
+        # Forecast trends (5 features)
+        temp_trend,
+        pressure_trend,
+        humidity_trend,
+        wind_speed_trend,
+        wind_dir_trend,
+        
+        # Individual forecast points (13 features to complete 30)
+        *forecast_temps[:3],
+        *forecast_pressures[:3],
+        *forecast_humidities[:3],
+        *forecast_wind_speeds[:2],
+        *forecast_wind_dirs[:2]
+    ]
+    
+    return {
+        'features': features,
+        'api_risk_level': api_risk_level,
+        'api_details': api_details,
+        'weather_data': {
+            'wind_speed': wind_speed,
+            'pressure': pressure,
+            'humidity': humidity,
+            'temperature': temperature,
+            'forecast_trend': {
+                'temp': temp_trend,
+                'pressure': pressure_trend,
+                'wind_speed': wind_speed_trend
+            }
         }
-        
+    }
+
+def combine_cyclone_risk(weather, ml_prediction):
+    """Combine the wind-speed risk with the ML model prediction for one location."""
+    api_details = list(weather['api_details'])
+    ml_risk_level = ml_prediction['risk_level']
+    
+    if ml_risk_level > 0:
+        api_details.append(ml_prediction['details'])
+    
+    # Combine risk assessments - take the higher risk level
+    final_risk_level = max(weather['api_risk_level'], ml_risk_level)
+    
+    logger.info(f"Wind speed: {weather['weather_data']['wind_speed']}, Risk level: {final_risk_level}")
+    
+    return {
+        'risk_level': final_risk_level,
+        'details': "\n".join(api_details) if api_details else "No immediate cyclone risk",
+        'weather_data': weather['weather_data'],
+        'ml_prediction': ml_prediction['raw_prediction']
+    }
+
+def check_cyclone_risk_batch(locations, runner=None, weather_client=None):
+    """
+    Check cyclone risk for many (lat, lon) locations.
+    
+    Weather is fetched per location (concurrently when a ConcurrentRunner is
+    given) through weather_client, the subscriber alerts client by default,
+    then all locations are scored with a single XGBoost call.
+    Returns one result dict per location, in order.
+    """
+    if runner is not None:
+        fetched = runner.map(
+            lambda location: get_cyclone_weather(*location, weather_client=weather_client),
+            locations, upstream='openweathermap',
+        )
+    else:
+        fetched = []
+        for lat, lon in locations:
+            try:
+                fetched.append(get_cyclone_weather(lat, lon, weather_client=weather_client))
+            except Exception as e:
+                fetched.append(e)
+    
+    results = [None] * len(locations)
+    weather = []
+    for i, location_weather in enumerate(fetched):
+        if isinstance(location_weather, Exception):
+            logger.error(f"Error checking cyclone risk: {str(location_weather)}")
+            results[i] = {'risk_level': 0, 'details': "Unable to check cyclone risk"}
+        else:
+            weather.append((i, location_weather))
+    
+    # Get ML model predictions for every location in one call
+    ml_predictions = predict_cyclone_risk_batch([w['features'] for _, w in weather])
+    
+    for (i, w), ml_prediction in zip(weather, ml_predictions):
+        try:
+            results[i] = combine_cyclone_risk(w, ml_prediction)
+        except Exception as e:
+            logger.error(f"Error checking cyclone risk: {str(e)}")
+            results[i] = {'risk_level': 0, 'details': "Unable to check cyclone risk"}
+    
+    return results
+
+def check_cyclone_risk(lat, lon):
+    """Check cyclone risk using weather API and XGBoost model predictions."""
+    return check_cyclone_risk_batch([(lat, lon)])[0]
+
+def get_earthquake_activity(lat, lon, snapshot):
+    """
+    Summarize recent USGS earthquakes near a location into the USGS-based
+    risk and the features used by the earthquake model.
+    """
+    # Process USGS data, using the spatial index to find nearby events
+    # Focus on closer earthquakes for immediate risk
+    indices, distances = snapshot.query_radius(lat, lon, EARTHQUAKE_INFLUENCE_KM)
+    recent_quakes = [
+        {'distance': distance, 'magnitude': magnitude, 'time': event_time}
+        for distance, magnitude, event_time in zip(
+            distances.tolist(),
+            snapshot.magnitudes[indices].tolist(),
+            snapshot.times[indices].tolist()
+        )
+    ]
+    
+    # Calculate USGS-based risk metrics
+    usgs_risk_level = 0
+    usgs_details = []
+    
+    if recent_quakes:
+        # Sort by magnitude and distance
+        recent_quakes.sort(key=lambda x: (-x['magnitude'], x['distance']))
+        strongest_quake = recent_quakes[0]
+        
+        # Check for immediate high-risk conditions
+        if strongest_quake['magnitude'] >= 6.0 and strongest_quake['distance'] < 50:
+            usgs_risk_level = 3
+            usgs_details.append(f"USGS: Major earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away!")
+        elif strongest_quake['magnitude'] >= 5.0 and strongest_quake['distance'] < 75:
+            usgs_risk_level = 2
+            usgs_details.append(f"USGS: Significant earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away")
+        elif strongest_quake['magnitude'] >= 4.0 and strongest_quake['distance'] < 100:
+            usgs_risk_level = 1
+            usgs_details.append(f"USGS: Moderate earthquake M{strongest_quake['magnitude']:.1f} detected {strongest_quake['distance']:.1f}km away")
+    
+    # Prepare features for ML model
+    features = [
+        lat,  # location
+        lon,
+        len(recent_quakes),  # number of recent earthquakes
+        max((q['magnitude'] for q in recent_quakes), default=0),  # max magnitude
+        min((q['distance'] for q in recent_quakes), default=1000),  # closest distance
+        sum(q['magnitude'] for q in recent_quakes)  # total seismic energy
+    ]
+    
+    return {
+        'features': features,
+        'usgs_risk_level': usgs_risk_level,
+        'usgs_details': usgs_details,
+        'usgs_data': {
+            'recent_earthquakes': len(recent_quakes),
+            'strongest_magnitude': max((q['magnitude'] for q in recent_quakes), default=0),
+            'closest_distance': min((q['distance'] for q in recent_quakes), default=None)
+        }
+    }
+
+def combine_earthquake_risk(activity, ml_prediction):
+    """Combine the USGS-based risk with the ML model prediction for one location."""
+    usgs_details = list(activity['usgs_details'])
+    ml_risk_level = ml_prediction['risk_level']
+    
+    if ml_risk_level > 0:
+        usgs_details.append(f"ML Model: {ml_prediction['details']}")
+    
+    # Combine risk assessments - take the higher risk level
+    final_risk_level = max(activity['usgs_risk_level'], ml_risk_level)
+    
+    # Prepare detailed response
+    return {
+        'risk_level': final_risk_level,
+        'details': "\n".join(usgs_details) if usgs_details else "No immediate earthquake risk detected",
+        'usgs_data': activity['usgs_data'],
+        'ml_prediction': ml_prediction['raw_prediction']
+    }
+
+def check_earthquake_risk_batch(locations, snapshot=None, incremental=None):
+    """
+    Check earthquake risk for many (lat, lon) locations.
+    
+    Nearby USGS events are looked up per location, then all locations are
+    scored by the earthquake model in batched forward passes. Returns one
+    result dict per location, in order.
+    
+    In incremental mode (EARTHQUAKE_INCREMENTAL) a location's risk is reused
+    until an event within its influence radius is added, updated or removed.
+    """
+    failed = {'risk_level': 0, 'details': "Unable to check earthquake risk"}
+    try:
+        # Use the shared USGS snapshot (last month) instead of downloading it per location
+        if snapshot is None:
+            snapshot = get_feed_snapshot()
     except Exception as e:
         logger.error(f"Error checking earthquake risk: {str(e)}")
-        return {'risk_level': 0, 'details': "Unable to check earthquake risk"}
+        return [dict(failed) for _ in locations]
+    
+    if incremental is None:
+        incremental = getattr(settings, 'EARTHQUAKE_INCREMENTAL', True)
+    cache = get_earthquake_risk_cache() if incremental else None
+    if cache is not None:
+        cache.sync(snapshot)
+        results = cache.get_many(locations)
+    else:
+        results = [None] * len(locations)
+    
+    activities = []
+    for i, (lat, lon) in enumerate(locations):
+        if results[i] is not None:
+            continue
+        try:
+            activities.append((i, get_earthquake_activity(lat, lon, snapshot)))
+        except Exception as e:
+            logger.error(f"Error checking earthquake risk: {str(e)}")
+            results[i] = dict(failed)
+    
+    # Get ML model predictions for every location in a few forward passes
+    ml_predictions = predict_earthquake_risk_batch([a['features'] for _, a in activities])
+    
+    computed = []
+    for (i, activity), ml_prediction in zip(activities, ml_predictions):
+        try:
+            results[i] = combine_earthquake_risk(activity, ml_prediction)
+            computed.append((*locations[i], results[i]))
+        except Exception as e:
+            logger.error(f"Error checking earthquake risk: {str(e)}")
+            results[i] = dict(failed)
+    
+    if cache is not None:
+        cache.set_many(snapshot, computed)
+    
+    return results
+
+def check_earthquake_risk(lat, lon, snapshot=None):
+    """Check earthquake risk using both USGS real-time data and ML model predictions."""
+    return check_earthquake_risk_batch([(lat, lon)], snapshot=snapshot)[0]
 
 def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points in kilometers using the Haversine formula."""
+    """Calculate distance between two points in kilometers using the Haversine formula.
+    
+    Kept for single pairs; use users.distance directly for arrays of points.
+    """
     try:
-        R = 6371  # Earth's radius in kilometers
-        
-        lat1, lon1, lat2, lon2 = map(radians, [float(lat1), float(lon1), float(lat2), float(lon2)])
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        distance = R * c
-        
-        return distance
+        return float(haversine_distances(float(lat1), float(lon1), float(lat2), float(lon2)))
     except Exception as e:
         logger.error(f"Error calculating distance: {str(e)}")
         return float('inf')
 
 def send_disaster_alert(user, subject, message):
-    """Send disaster alert via email and WhatsApp if enabled."""
+    """Send disaster alert via email and queue it for WhatsApp if enabled."""
     # Send email alert
-    try:
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[user.email],
-            fail_silently=False,
-        )
-        logger.info(f"Email alert sent to {user.email}")
-    except Exception as e:
-        logger.error(f"Error sending email alert: {str(e)}")
+    send_alert_emails([(user, subject, message)])
     
-    # Send WhatsApp alert if enabled
-    if user.enable_whatsapp_alerts and user.whatsapp_phone_number:
-        try:
-            whatsapp_message = f"{subject}\n\n{message}"
-            success = send_whatsapp_alert(user.whatsapp_phone_number, whatsapp_message)
-            if success:
-                logger.info(f"WhatsApp alert scheduled for {user.whatsapp_phone_number}")
-            else:
-                logger.warning(f"WhatsApp alert failed for {user.whatsapp_phone_number}")
-        except Exception as e:
-            logger.error(f"Error scheduling WhatsApp alert: {str(e)}")
+    # WhatsApp messages go through the outbox so slow sends never block the caller
+    if enqueue_whatsapp_alerts([(user, subject, message)]):
+        deliver_outbound_messages.delay()
 
 @shared_task
 def test_whatsapp():
@@ -359,13 +780,10 @@ def test_whatsapp():
             
         message = "This is a test alert from your Disaster Prediction System. Please ignore."
         
-        success = send_whatsapp_alert(test_user.whatsapp_phone_number, message)
-        if success:
-            logger.info(f"Test WhatsApp message scheduled for {test_user.whatsapp_phone_number}")
-            return "Test WhatsApp message scheduled successfully"
-        else:
-            logger.error("Failed to schedule test WhatsApp message")
-            return "Failed to schedule test WhatsApp message"
+        # Sent directly rather than through the outbox so configuration errors show up here
+        get_messaging_provider().send(test_user.whatsapp_phone_number, message)
+        logger.info(f"Test WhatsApp message sent to {test_user.whatsapp_phone_number}")
+        return "Test WhatsApp message sent successfully"
     except Exception as e:
         logger.error(f"Error in WhatsApp test: {str(e)}")
         return f"Error: {str(e)}" 
\ No newline at end of file
@@ -1,3 +1,1283 @@
-from django.test import TestCase
+import json
+import math
+import random
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+from celery.exceptions import Retry
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from django.utils import timezone
+from .management.commands.mock_whatsapp_server import MockWhatsAppServer
+from .messaging import HttpWhatsAppProvider, MessagingError
+from .alert_queue import send_alert_emails
+from .alert_ledger import alert_key, record_alerts, release_alerts, select_new_alerts
+from .distance import EARTH_RADIUS_KM, haversine_distances, haversine_matrix, iter_haversine_chunks
+from .event_watch import EventWatcher
+from .models import AlertLedger, HandledEvent, OutboundMessage, UserSubscription
+from .outbox import deliver_due_messages, enqueue_whatsapp_alerts
+from .subscribers import backfill_grid_cells, iter_subscriber_chunks, plan_subscriber_ranges
+from . import usgs_feed
+from .usgs_feed import FeedSnapshot, get_feed_snapshot, ijson, parse_feed_stream, refresh_feed_snapshot
+from .weather_client import RateLimiter, WeatherClient, budget_rate_limit, get_weather_client
+from .rate_limit import RateLimitError
+from .spatial_index import GridIndex
+from .risk_engine import ConcurrentRunner, LocationCancelled, LocationTimeout, UpstreamLimits, group_locations
+from .risk_cache import EARTHQUAKE_INFLUENCE_KM, EarthquakeRiskCache
+from .map_artifact import MapArtifact, artifact_dir
+from .risk_heatmap import REFRESH_REQUESTED_KEY, heatmap_version
+from .risk_tiles import build_tile, tile_bounds
+from .risk_grid import LAT_BOUNDS, LON_BOUNDS, CycloneField, RiskGrid, compute_adaptive_risk_grid, store_risk_grid
+from .tasks import alert_event_subscribers, check_disaster_predictions, check_earthquake_risk_batch, evaluate_subscriber_risks, evaluate_subscriber_shard, queue_alerts, send_alert_emails_task
 
 # Create your tests here.
+
+class MockWhatsAppServerMixin:
+    """Runs a MockWhatsAppServer on a free local port for the test class"""
+
+    failure_rate = 0.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = MockWhatsAppServer(failure_rate=cls.failure_rate)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.messages.clear()
+
+
+class HttpWhatsAppProviderTests(MockWhatsAppServerMixin, TestCase):
+
+    def test_send_posts_message(self):
+        provider = HttpWhatsAppProvider(url=self.server.url, token='secret')
+        provider.send('+911234567890', 'Earthquake Alert')
+        self.assertEqual(self.server.messages, [{'to': '911234567890', 'body': 'Earthquake Alert'}])
+
+    def test_error_status_raises(self):
+        self.server.failure_rate = 1.0
+        try:
+            provider = HttpWhatsAppProvider(url=self.server.url)
+            with self.assertRaises(MessagingError):
+                provider.send('+911234567890', 'Earthquake Alert')
+        finally:
+            self.server.failure_rate = 0.0
+
+
+@override_settings(WHATSAPP_RETRY_DELAY=60, WHATSAPP_MAX_ATTEMPTS=2)
+class OutboxDeliveryTests(MockWhatsAppServerMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider = HttpWhatsAppProvider(url=self.server.url, max_concurrency=4)
+        self.subscribers = [
+            UserSubscription.objects.create(
+                phone_number='1234567890',
+                email=f'user{i}@example.com',
+                primary_location_name='Test',
+                latitude=20.0,
+                longitude=78.0,
+                enable_whatsapp_alerts=i % 2 == 0,
+                whatsapp_phone_number=f'+9100000000{i}',
+            )
+            for i in range(6)
+        ]
+
+    def test_only_whatsapp_subscribers_are_queued(self):
+        queued = enqueue_whatsapp_alerts([(user, 'Cyclone Alert', 'Risk Level: 2') for user in self.subscribers])
+        self.assertEqual(queued, 3)
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.PENDING).count(), 3)
+
+    def test_deliver_sends_each_message_once(self):
+        enqueue_whatsapp_alerts([(user, 'Cyclone Alert', 'Risk Level: 2') for user in self.subscribers])
+        stats = deliver_due_messages(provider=self.provider)
+
+        self.assertEqual(stats, {'sent': 3, 'failed': 0, 'timed_out': 0, 'deferred': 0})
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.messages[0]['body'], 'Cyclone Alert\n\nRisk Level: 2')
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.SENT).count(), 3)
+        # Nothing is due any more, so a second run sends nothing
+        self.assertEqual(deliver_due_messages(provider=self.provider)['sent'], 0)
+
+    def test_failed_message_is_retried_then_given_up(self):
+        enqueue_whatsapp_alerts([(self.subscribers[0], 'Cyclone Alert', 'Risk Level: 2')])
+        # Nothing listens on port 1, so every send fails
+        provider = HttpWhatsAppProvider(url='http://127.0.0.1:1/messages', timeout=1)
+
+        self.assertEqual(deliver_due_messages(provider=provider)['failed'], 1)
+        outbound = OutboundMessage.objects.get()
+        self.assertEqual(outbound.status, OutboundMessage.PENDING)
+        self.assertGreater(outbound.next_attempt_at, timezone.now())
+
+        OutboundMessage.objects.update(next_attempt_at=timezone.now())
+        deliver_due_messages(provider=provider)
+        outbound.refresh_from_db()
+        self.assertEqual(outbound.status, OutboundMessage.FAILED)
+        self.assertEqual(outbound.attempts, 2)
+
+    def test_abandoned_claim_is_delivered(self):
+        enqueue_whatsapp_alerts([(self.subscribers[0], 'Cyclone Alert', 'Risk Level: 2')])
+        OutboundMessage.objects.update(status=OutboundMessage.SENDING, claimed_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(deliver_due_messages(provider=self.provider)['sent'], 1)
+        self.assertEqual(len(self.server.messages), 1)
+
+    @override_settings(WHATSAPP_DELIVERY_DEADLINE=0.3)
+    def test_messages_not_started_by_deadline_are_released(self):
+        enqueue_whatsapp_alerts([(user, 'Cyclone Alert', 'Risk Level: 2') for user in self.subscribers])
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class BlockingProvider:
+            max_concurrency = 1
+
+            def send(self, phone_number, body):
+                # The first send is still running when the delivery deadline passes
+                release.wait(5)
+
+        stats = deliver_due_messages(provider=BlockingProvider())
+
+        self.assertEqual(stats, {'sent': 0, 'failed': 0, 'timed_out': 1, 'deferred': 2})
+        # The running send keeps its claim, the two that never started can be claimed again right away
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.SENDING).count(), 1)
+        deferred = OutboundMessage.objects.filter(status=OutboundMessage.PENDING)
+        self.assertEqual(deferred.count(), 2)
+        self.assertFalse(deferred.filter(claimed_at__isnull=False).exists())
+        self.assertFalse(deferred.filter(attempts__gt=0).exists())
+
+
+@override_settings(ALERT_COOLDOWN=3600, ALERT_ESCALATION_STEP=1)
+class AlertLedgerTests(TestCase):
+
+    def setUp(self):
+        self.user = UserSubscription.objects.create(
+            phone_number='1234567890',
+            email='user@example.com',
+            primary_location_name='Test',
+            latitude=20.0,
+            longitude=78.0,
+        )
+        self.now = timezone.now()
+
+    def alert(self, level, hazard=AlertLedger.EARTHQUAKE):
+        return (self.user, hazard, level, 'Earthquake Alert', f'Risk Level: {level}')
+
+    def send(self, candidates, now, source=None):
+        """Select and record alerts, as queue_alerts does once they are handed off"""
+        selected, suppressed = select_new_alerts(candidates, now=now, source=source)
+        record_alerts(selected, now=now, source=source)
+        return selected, suppressed
+
+    def test_repeat_within_cooldown_is_suppressed(self):
+        alerts, suppressed = self.send([self.alert(1)], self.now)
+        self.assertEqual((len(alerts), suppressed), (1, 0))
+
+        alerts, suppressed = self.send([self.alert(1)], self.now + timedelta(minutes=15))
+        self.assertEqual((len(alerts), suppressed), (0, 1))
+
+    def test_escalation_is_sent_within_cooldown(self):
+        self.send([self.alert(1)], self.now)
+        alerts, _ = self.send([self.alert(2)], self.now + timedelta(minutes=15))
+        self.assertEqual(len(alerts), 1)
+
+        entry = AlertLedger.objects.get()
+        self.assertEqual((entry.level, entry.alert_count), (2, 2))
+        self.assertEqual(entry.first_alerted_at, self.now)
+
+    def test_repeat_after_cooldown_is_sent(self):
+        self.send([self.alert(2)], self.now)
+        alerts, _ = self.send([self.alert(1)], self.now + timedelta(hours=2))
+        self.assertEqual(len(alerts), 1)
+
+    def test_hazards_are_tracked_separately(self):
+        self.send([self.alert(1)], self.now)
+        alerts, _ = self.send([self.alert(1, AlertLedger.CYCLONE)], self.now)
+        self.assertEqual(len(alerts), 1)
+
+    def test_periodic_alerts_are_keyed_by_location_cell(self):
+        self.send([self.alert(1)], self.now)
+        # Moving within the same RISK_DEDUP_CELL_DEGREES cell is the same location risk
+        self.user.latitude, self.user.longitude = 19.996, 77.996
+        alerts, suppressed = self.send([self.alert(1)], self.now + timedelta(minutes=15))
+        self.assertEqual((len(alerts), suppressed), (0, 1))
+
+        # Moving to another cell is a new location, so its risk is sent
+        self.user.latitude, self.user.longitude = 20.5, 78.0
+        alerts, _ = self.send([self.alert(1)], self.now + timedelta(minutes=30))
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(AlertLedger.objects.count(), 2)
+
+    def test_sources_are_tracked_separately(self):
+        self.send([self.alert(1)], self.now, source='event:us1')
+        # A new event of the same level is not suppressed by the earlier one
+        alerts, _ = self.send([self.alert(1)], self.now + timedelta(minutes=15), source='event:us2')
+        self.assertEqual(len(alerts), 1)
+        # Nor by a periodic alert for the subscriber's cell
+        alerts, _ = self.send([self.alert(1)], self.now + timedelta(minutes=15))
+        self.assertEqual(len(alerts), 1)
+        # The same event again is
+        alerts, suppressed = self.send([self.alert(1)], self.now + timedelta(minutes=20), source='event:us1')
+        self.assertEqual((len(alerts), suppressed), (0, 1))
+        self.assertEqual(
+            set(AlertLedger.objects.values_list('source', flat=True)),
+            {'event:us1', 'event:us2', alert_key(self.user, AlertLedger.EARTHQUAKE)[2]},
+        )
+
+    def test_selecting_does_not_record(self):
+        select_new_alerts([self.alert(1)], now=self.now)
+        self.assertFalse(AlertLedger.objects.exists())
+
+    def test_queue_failure_is_sent_on_retry(self):
+        selected, _ = select_new_alerts([self.alert(1)])
+        with mock.patch('users.tasks.send_alert_emails_task.delay', side_effect=ConnectionError('broker down')):
+            with self.assertRaises(ConnectionError):
+                queue_alerts(selected)
+        self.assertFalse(AlertLedger.objects.exists())
+
+        selected, suppressed = select_new_alerts([self.alert(1)])
+        self.assertEqual((len(selected), suppressed), (1, 0))
+        with mock.patch('users.tasks.send_alert_emails_task.delay') as delay:
+            queue_alerts(selected)
+        delay.assert_called_once_with([[self.user.pk, AlertLedger.EARTHQUAKE, 'Earthquake Alert', 'Risk Level: 1', None]])
+        self.assertEqual(select_new_alerts([self.alert(1)])[1], 1)
+
+    def test_released_alert_is_sent_again(self):
+        self.send([self.alert(1)], self.now)
+        self.assertEqual(release_alerts([alert_key(self.user, AlertLedger.EARTHQUAKE)]), 1)
+        alerts, _ = self.send([self.alert(1)], self.now + timedelta(minutes=15))
+        self.assertEqual(len(alerts), 1)
+
+
+class SubscriptionWithinRadiusTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        points = [(rng.uniform(8, 35), rng.uniform(68, 97)) for _ in range(200)]
+        # Around the antimeridian and near the pole
+        points += [(rng.uniform(-20, -10), rng.choice([-1, 1]) * rng.uniform(178, 180)) for _ in range(30)]
+        points += [(rng.uniform(88, 90), rng.uniform(-180, 180)) for _ in range(20)]
+        for i, (lat, lon) in enumerate(points):
+            UserSubscription.objects.create(
+                phone_number='1234567890',
+                email=f'user{i}@example.com',
+                primary_location_name='Test',
+                latitude=lat,
+                longitude=lon,
+            )
+
+    def assertMatchesBruteForce(self, lat, lon, km):
+        rows = list(UserSubscription.objects.values_list('pk', 'latitude', 'longitude'))
+        distances = haversine_distances(lat, lon, [row[1] for row in rows], [row[2] for row in rows])
+        expected = {row[0] for row, distance in zip(rows, distances) if distance < km}
+        found = set(UserSubscription.objects.within_radius(lat, lon, km).values_list('pk', flat=True))
+        self.assertEqual(found, expected)
+        return found
+
+    def test_matches_brute_force(self):
+        self.assertTrue(self.assertMatchesBruteForce(20.0, 80.0, 300))
+        self.assertMatchesBruteForce(17.385, 78.4867, 100)
+
+    def test_antimeridian_and_pole(self):
+        self.assertTrue(self.assertMatchesBruteForce(-15.0, 179.9, 400))
+        self.assertTrue(self.assertMatchesBruteForce(89.5, 0.0, 200))
+
+    def test_grid_cell_follows_location(self):
+        subscription = UserSubscription.objects.first()
+        subscription.latitude, subscription.longitude = -33.9, 18.4
+        subscription.save(update_fields=['latitude', 'longitude'])
+        self.assertIn(subscription.pk, UserSubscription.objects.within_radius(-33.9, 18.4, 1).values_list('pk', flat=True))
+
+
+class ConcurrentRunnerTests(TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self, item):
+        if item == 'slow':
+            self.release.wait(5)
+        return item
+
+    def test_failures_are_returned_in_place(self):
+        def func(item):
+            if item == 2:
+                raise ValueError('bad item')
+            return item * 10
+
+        runner = ConcurrentRunner(max_workers=4, limits=UpstreamLimits())
+        results = runner.map(func, range(4), label='test')
+        self.assertEqual([results[0], results[1], results[3]], [0, 10, 30])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(runner.stats['test'], {'completed': 3, 'failed': 1, 'timed_out': 0, 'cancelled': 0})
+
+    def test_slow_item_times_out_without_holding_up_the_rest(self):
+        runner = ConcurrentRunner(max_workers=2, location_timeout=0.2, cycle_deadline=10, limits=UpstreamLimits())
+        start = time.monotonic()
+        results = runner.map(self.block, ['slow', 'fast'])
+
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertIsInstance(results[0], LocationTimeout)
+        self.assertNotIsInstance(results[0], LocationCancelled)
+        self.assertEqual(results[1], 'fast')
+        self.assertEqual(runner.stats['local']['timed_out'], 1)
+
+    def test_cycle_deadline_cancels_items_not_started(self):
+        called = []
+
+        def func(item):
+            called.append(item)
+            return self.block(item)
+
+        runner = ConcurrentRunner(max_workers=1, cycle_deadline=0.3, limits=UpstreamLimits())
+        results = runner.map(func, ['slow', 'a', 'b'])
+
+        self.assertIsInstance(results[0], LocationTimeout)
+        self.assertNotIsInstance(results[0], LocationCancelled)
+        self.assertIsInstance(results[1], LocationCancelled)
+        self.assertIsInstance(results[2], LocationCancelled)
+        self.assertEqual(runner.stats['local'], {'completed': 0, 'failed': 0, 'timed_out': 1, 'cancelled': 2})
+        # Items cancelled at the deadline are never called, even once a worker frees up
+        self.release.set()
+        time.sleep(0.2)
+        self.assertEqual(called, ['slow'])
+
+    def test_upstream_limit_caps_concurrent_calls(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def func(item):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return item
+
+        limits = UpstreamLimits({'weather': 2})
+        runner = ConcurrentRunner(max_workers=8, limits=limits)
+        self.assertEqual(runner.map(func, range(12), upstream='weather'), list(range(12)))
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(runner.stats['weather']['completed'], 12)
+
+        # Upstreams without a configured limit get a single slot
+        peak[0] = 0
+        runner.map(func, range(4), upstream='unknown')
+        self.assertEqual(peak[0], 1)
+
+
+class LocationDedupTests(TestCase):
+
+    def test_group_locations_by_cell(self):
+        locations = [(20.001, 78.001), (20.009, 78.004), (20.011, 78.001), (-33.9, 18.4), (20.001, 78.001)]
+        representatives, membership = group_locations(locations, cell_degrees=0.01)
+        self.assertEqual(membership, [0, 0, 1, 2, 0])
+        self.assertEqual(len(representatives), 3)
+        # Each group is evaluated at the mean of its members
+        np.testing.assert_allclose(representatives[0], (np.mean([20.001, 20.009, 20.001]), np.mean([78.001, 78.004, 78.001])))
+
+        # Without a cell size only identical coordinates share a group
+        _, membership = group_locations(locations, cell_degrees=0)
+        self.assertEqual(membership, [0, 1, 2, 3, 0])
+
+    def test_colocated_subscribers_share_one_evaluation(self):
+        coordinates = [(20.001, 78.001), (20.002, 78.003), (20.004, 78.002), (35.003, 139.003), (35.004, 139.004), (-33.9, 18.4)]
+        users = [mock.Mock(latitude=lat, longitude=lon) for lat, lon in coordinates]
+        evaluated = []
+
+        def risks(locations, runner=None):
+            evaluated.append(list(locations))
+            return [{'risk_level': i, 'details': f'location {i}'} for i in range(len(locations))]
+
+        with mock.patch('users.tasks.check_cyclone_risk_batch', side_effect=risks), \
+                mock.patch('users.tasks.check_earthquake_risk_batch', side_effect=risks):
+            cyclone_risks, earthquake_risks, stats = evaluate_subscriber_risks(users)
+
+        # One cyclone and one earthquake evaluation per group
+        self.assertEqual([len(locations) for locations in evaluated], [3, 3])
+        self.assertEqual([risk['risk_level'] for risk in cyclone_risks], [0, 0, 0, 1, 1, 2])
+        self.assertEqual([risk['risk_level'] for risk in earthquake_risks], [0, 0, 0, 1, 1, 2])
+        self.assertEqual((stats['subscribers'], stats['locations']), (6, 3))
+        self.assertEqual(stats['dedup_ratio'], 2.0)
+        self.assertAlmostEqual(stats['time_saved'], stats['elapsed'] / 3 * 3)
+
+
+class SubscriberChunkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1)
+        # bulk_create skips save(), leaving grid cells to the backfill
+        UserSubscription.objects.bulk_create([
+            UserSubscription(
+                phone_number='1234567890',
+                email=f'user{i}@example.com',
+                primary_location_name='Test',
+                latitude=rng.choice([17.385, rng.uniform(8, 35)]),
+                longitude=rng.choice([78.4867, rng.uniform(68, 97)]),
+            )
+            for i in range(103)
+        ])
+
+    def test_ranges_cover_every_subscriber_once(self):
+        self.assertEqual(backfill_grid_cells(), 103)
+        ranges = plan_subscriber_ranges(10)
+        self.assertEqual(len(ranges), 11)
+        self.assertEqual(sum(r['size'] for r in ranges), 103)
+
+        seen = []
+        for r in ranges:
+            for chunk in iter_subscriber_chunks(chunk_size=3, after=r['after'], last=r['last']):
+                self.assertLessEqual(len(chunk), 3)
+                seen.extend(subscription.pk for subscription in chunk)
+        self.assertEqual(sorted(seen), sorted(UserSubscription.objects.values_list('pk', flat=True)))
+
+
+@override_settings(RISK_CHUNK_SIZE=2, RISK_SHARD_RETRY_DELAY=0)
+class SubscriberShardRetryTests(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            UserSubscription.objects.create(
+                phone_number='1234567890',
+                email=f'user{i}@example.com',
+                primary_location_name='Test',
+                latitude=20.0 + i,
+                longitude=78.0,
+            )
+        self.shard = plan_subscriber_ranges(10)[0]
+        # Every subscriber has an earthquake risk, without calling the weather API
+        patcher = mock.patch('users.tasks.evaluate_subscriber_risks', side_effect=lambda users, runner=None: (
+            [{'risk_level': 0, 'details': ''}] * len(users),
+            [{'risk_level': 2, 'details': 'Test'}] * len(users),
+            {'locations': len(users), 'elapsed': 0.0, 'time_saved': 0.0},
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry_sends_alerts_that_failed_to_queue(self):
+        with mock.patch('users.tasks.send_alert_emails_task.delay', side_effect=[ConnectionError('broker down'), None, None, None]) as delay:
+            # Called directly, the task re-raises instead of scheduling its retry
+            with self.assertRaises(ConnectionError):
+                evaluate_subscriber_shard.run(self.shard)
+            stats = evaluate_subscriber_shard.run(self.shard)
+
+        sent = {alert[0] for call in delay.call_args_list[1:] for alert in call.args[0]}
+        self.assertEqual(sent, set(UserSubscription.objects.values_list('pk', flat=True)))
+        self.assertEqual(AlertLedger.objects.count(), 5)
+        self.assertEqual((stats['users'], stats['alerts'], stats['errors']), (5, 5, 0))
+
+    def test_failed_shard_counts_each_user_once(self):
+        # An earlier attempt queued the first chunk, the last one gets no further
+        with mock.patch('users.tasks.send_alert_emails_task.delay'):
+            evaluate_subscriber_shard.run(self.shard)
+        AlertLedger.objects.filter(pk__in=AlertLedger.objects.order_by('-pk').values('pk')[:3]).delete()
+
+        evaluate_subscriber_shard.push_request(retries=evaluate_subscriber_shard.max_retries)
+        try:
+            with mock.patch('users.tasks.send_alert_emails_task.delay', side_effect=ConnectionError('broker down')):
+                stats = evaluate_subscriber_shard.run(self.shard)
+        finally:
+            evaluate_subscriber_shard.pop_request()
+
+        self.assertTrue(stats['failed'])
+        self.assertEqual((stats['users'], stats['errors']), (5, 3))
+        self.assertEqual((stats['alerts'], stats['suppressed']), (0, 2))
+
+    def test_cycle_without_shards_dispatches_nothing(self):
+        with mock.patch('users.tasks.plan_subscriber_shards', return_value=[]), \
+                mock.patch('users.tasks.refresh_feed_snapshot'), \
+                mock.patch('users.tasks.chord') as chord:
+            summary = check_disaster_predictions()
+        chord.assert_not_called()
+        self.assertIn('Processed 0 users in 0 shards', summary)
+
+
+class EventWatcherTests(TestCase):
+
+    def setUp(self):
+        now = int(time.time() * 1000)
+        self.snapshot = FeedSnapshot(
+            latitudes=[20.0, 21.0], longitudes=[78.0, 79.0], magnitudes=[5.2, 2.1],
+            times=[now, now], depths=[10.0, 5.0], ids=['us1', 'us2'],
+        )
+        patcher = mock.patch('users.event_watch.fetch_feed_snapshot', side_effect=lambda previous=None, **kwargs: self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def poll(self, watcher):
+        events, _ = watcher.poll(feeds=['all_hour'], min_magnitude=4.0)
+        return [event['event_id'] for event in events]
+
+    def test_event_stays_pending_until_handled(self):
+        watcher = EventWatcher()
+        self.assertEqual(self.poll(watcher), ['us1'])
+        # The feed did not change, but the event was not handled yet
+        self.assertEqual(self.poll(watcher), ['us1'])
+
+        event = watcher.poll(feeds=['all_hour'], min_magnitude=4.0)[0][0]
+        self.assertTrue(watcher.claim(event))
+        watcher.mark_handled(event, 3)
+        self.assertEqual(self.poll(watcher), [])
+        self.assertEqual(HandledEvent.objects.get().alert_count, 3)
+        self.assertEqual(watcher.stats()['alerts'], 3)
+
+    def test_event_is_alerted_by_one_worker(self):
+        first, second = EventWatcher(), EventWatcher()
+        self.assertEqual(self.poll(first), ['us1'])
+        self.assertEqual(self.poll(second), ['us1'])
+
+        event = first.poll(feeds=['all_hour'], min_magnitude=4.0)[0][0]
+        self.assertTrue(first.claim(event))
+        self.assertFalse(second.claim(event))
+        self.assertEqual(self.poll(second), [])
+        # A worker that starts later skips it too
+        self.assertEqual(self.poll(EventWatcher()), [])
+
+    def test_released_event_is_polled_again(self):
+        watcher = EventWatcher()
+        event = watcher.poll(feeds=['all_hour'], min_magnitude=4.0)[0][0]
+        watcher.claim(event)
+        watcher.release(event)
+        self.assertEqual(self.poll(EventWatcher()), ['us1'])
+
+
+@override_settings(ALERT_COOLDOWN=3600)
+class EventAlertTests(TestCase):
+
+    def setUp(self):
+        self.user = UserSubscription.objects.create(
+            phone_number='1234567890',
+            email='user@example.com',
+            primary_location_name='Test',
+            latitude=20.0,
+            longitude=78.0,
+        )
+        now = int(time.time() * 1000)
+        self.events = [
+            {'event_id': event_id, 'latitude': 20.1, 'longitude': 78.1, 'magnitude': 5.5, 'time': now}
+            for event_id in ('us1', 'us2')
+        ]
+        patcher = mock.patch('users.tasks.check_earthquake_risk_batch', side_effect=lambda locations, snapshot=None: (
+            [{'risk_level': 2, 'details': 'Test'}] * len(locations)
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_distinct_events_within_cooldown_are_alerted(self):
+        with mock.patch('users.tasks.send_alert_emails_task.delay') as delay:
+            self.assertEqual(len(alert_event_subscribers(self.events[0], None)), 1)
+            # A second quake of the same level minutes later is a new hazard
+            self.assertEqual(len(alert_event_subscribers(self.events[1], None)), 1)
+            # The same event handled again is not
+            self.assertEqual(alert_event_subscribers(self.events[0], None), [])
+
+        self.assertEqual(delay.call_count, 2)
+        self.assertEqual([call.args[0][0][4] for call in delay.call_args_list], ['event:us1', 'event:us2'])
+        self.assertEqual(set(AlertLedger.objects.values_list('source', flat=True)), {'event:us1', 'event:us2'})
+
+
+class CountingWeatherClient(WeatherClient):
+    """WeatherClient whose upstream calls are counted instead of sent"""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(rate_limit=0, **kwargs)
+        self.calls = 0
+        self.failures = failures
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def _fetch(self, endpoint, cell):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.calls <= self.failures:
+            raise ConnectionError('upstream down')
+        return {'endpoint': endpoint, 'cell': cell}
+
+
+class WeatherClientTests(TestCase):
+
+    def test_nearby_locations_share_a_cached_call(self):
+        client = CountingWeatherClient(cache_ttl=60, grid_degrees=0.1)
+        first = client.current_weather(20.01, 78.01)
+        self.assertEqual(client.current_weather(20.04, 78.06), first)
+        self.assertEqual(client.calls, 1)
+        # Another endpoint or cell is a separate call
+        client.forecast(20.01, 78.01)
+        client.current_weather(20.5, 78.01)
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(client.stats()['hits'], 1)
+
+    def test_expired_entries_are_fetched_again(self):
+        client = CountingWeatherClient(cache_ttl=0)
+        client.current_weather(20.0, 78.0)
+        client.current_weather(20.0, 78.0)
+        self.assertEqual(client.calls, 2)
+
+    def test_concurrent_gets_share_one_call(self):
+        client = CountingWeatherClient(cache_ttl=60)
+        client.release.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.current_weather(20.0, 78.0))) for _ in range(2)]
+        threads[0].start()
+        self.assertTrue(client.started.wait(5))
+        threads[1].start()
+        deadline = time.monotonic() + 5
+        while client.stats()['coalesced'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        client.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0], results[1])
+
+    def test_errors_are_not_cached(self):
+        client = CountingWeatherClient(failures=1, cache_ttl=60)
+        with self.assertRaises(ConnectionError):
+            client.current_weather(20.0, 78.0)
+        self.assertEqual(client.current_weather(20.0, 78.0)['cell'], client.snap(20.0, 78.0))
+        self.assertEqual((client.calls, client.stats()['errors']), (2, 1))
+
+    def test_each_thread_has_its_own_session(self):
+        client = CountingWeatherClient()
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+        self.assertIs(client.session, client.session)
+        self.assertIsNot(sessions[0], client.session)
+
+
+class RateLimiterTests(TestCase):
+
+    def test_budget_is_enforced(self):
+        limiter = RateLimiter(2, 60.0)
+        limiter.acquire(max_wait=0)
+        limiter.acquire(max_wait=0)
+        with self.assertRaises(RateLimitError):
+            limiter.acquire(max_wait=0.01)
+
+    def test_tokens_refill_over_time(self):
+        limiter = RateLimiter(100, 1.0)
+        for _ in range(100):
+            limiter.acquire(max_wait=0)
+        start = time.monotonic()
+        limiter.acquire(max_wait=1.0)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class RejectingEmailBackend(EmailBackend):
+    """Locmem backend that counts connections and refuses mail to REJECTED addresses"""
+
+    REJECTED = set()
+    opened = 0
+
+    def open(self):
+        RejectingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & self.REJECTED:
+                raise ConnectionError(f'Recipient refused: {message.to[0]}')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='users.tests.RejectingEmailBackend', EMAIL_HOST_USER='alerts@example.com')
+class AlertEmailTests(TestCase):
+
+    def setUp(self):
+        RejectingEmailBackend.REJECTED = {'user1@example.com'}
+        RejectingEmailBackend.opened = 0
+        self.users = [
+            UserSubscription.objects.create(
+                phone_number='1234567890',
+                email=f'user{i}@example.com',
+                primary_location_name='Test',
+                latitude=20.0,
+                longitude=78.0,
+            )
+            for i in range(3)
+        ]
+
+    def test_failure_is_pinned_to_one_alert(self):
+        alerts = [(user, 'Cyclone Alert', 'Risk Level: 2') for user in self.users]
+        failed = send_alert_emails(alerts)
+
+        self.assertEqual([alert for alert, _ in failed], [alerts[1]])
+        self.assertEqual([message.to for message in mail.outbox], [['user0@example.com'], ['user2@example.com']])
+        # One connection for the batch, reopened once after the failure
+        self.assertEqual(RejectingEmailBackend.opened, 2)
+
+    def test_task_retries_only_failed_alerts(self):
+        alerts = [[user.pk, AlertLedger.CYCLONE, 'Cyclone Alert', 'Risk Level: 2', None] for user in self.users]
+        with mock.patch.object(send_alert_emails_task, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                send_alert_emails_task.run(alerts)
+
+        self.assertEqual(retry.call_args.kwargs['args'], [[alerts[1]]])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_task_releases_alerts_it_gives_up_on(self):
+        selected = [(user, AlertLedger.CYCLONE, 2, 'Cyclone Alert', 'Risk Level: 2') for user in self.users]
+        record_alerts(selected, source='event:us1')
+
+        send_alert_emails_task.push_request(retries=send_alert_emails_task.max_retries)
+        try:
+            send_alert_emails_task.run([
+                [user.pk, hazard, subject, message, 'event:us1'] for user, hazard, _, subject, message in selected
+            ])
+        finally:
+            send_alert_emails_task.pop_request()
+
+        self.assertEqual(
+            set(AlertLedger.objects.values_list('subscription_id', flat=True)),
+            {self.users[0].pk, self.users[2].pk},
+        )
+
+
+def usgs_feature(i, magnitude=4.5, coordinates=None, event_id=True, event_time=True, updated=True):
+    """One GeoJSON feature in the shape of the USGS summary feeds"""
+    properties = {'mag': magnitude, 'place': f'Place {i}', 'type': 'earthquake'}
+    if event_time:
+        properties['time'] = 1700000000000 + i * 60000
+    if updated:
+        properties['updated'] = 1700000000000 + i * 60000 + 5000
+    feature = {
+        'type': 'Feature',
+        'properties': properties,
+        'geometry': {'type': 'Point', 'coordinates': coordinates or [70.0 + i % 30, 10.0 + i % 20, 10.0]},
+    }
+    if event_id:
+        feature['id'] = f'us{i:06d}'
+    return feature
+
+
+@unittest.skipIf(ijson is None, "ijson is not installed")
+class FeedStreamParserTests(TestCase):
+
+    def assertParsesLikeGeojson(self, data, chunk_size=7):
+        raw = json.dumps(data).encode()
+        chunks = (raw[start:start + chunk_size] for start in range(0, len(raw), chunk_size))
+        streamed = parse_feed_stream(chunks, etag='"v1"')
+        expected = FeedSnapshot.from_geojson(data, etag='"v1"')
+
+        self.assertEqual(len(streamed), len(expected))
+        for column in ('latitudes', 'longitudes', 'magnitudes', 'times', 'depths', 'updated'):
+            np.testing.assert_array_equal(getattr(streamed, column), getattr(expected, column), err_msg=column)
+            self.assertEqual(getattr(streamed, column).dtype, getattr(expected, column).dtype)
+        self.assertEqual(streamed.ids.tolist(), expected.ids.tolist())
+        self.assertEqual(streamed.etag, '"v1"')
+        return streamed
+
+    def test_summary_feed_with_missing_values(self):
+        features = [usgs_feature(i) for i in range(5)] + [
+            usgs_feature(5, magnitude=None),
+            usgs_feature(6, coordinates=[120.5, -8.2, None]),
+            usgs_feature(7, coordinates=[-179.9, 51.3]),
+            usgs_feature(8, event_id=False, updated=False),
+            usgs_feature(9, event_time=False),
+            {'type': 'Feature', 'id': 'nogeometry', 'properties': {'mag': 3.0}, 'geometry': None},
+        ]
+        data = {
+            'type': 'FeatureCollection',
+            'metadata': {'generated': 1700000000000, 'title': 'USGS All Earthquakes, Past Week', 'count': len(features)},
+            'features': features,
+            'bbox': [-179.9, -8.2, 0, 120.5, 51.3, 10.0],
+        }
+        snapshot = self.assertParsesLikeGeojson(data)
+        self.assertEqual(len(snapshot), 10)
+        self.assertEqual(snapshot.magnitudes[5], 0.0)
+        self.assertTrue(np.isnan(snapshot.depths[6]) and np.isnan(snapshot.depths[7]))
+
+    def test_feed_without_count_grows_past_the_default_capacity(self):
+        data = {'type': 'FeatureCollection', 'features': [usgs_feature(i) for i in range(2500)]}
+        self.assertEqual(len(self.assertParsesLikeGeojson(data, chunk_size=4096)), 2500)
+
+    def test_fdsn_query_with_trailing_metadata(self):
+        # FDSN event queries can put metadata after the features, so the count arrives too late to preallocate
+        data = {
+            'type': 'FeatureCollection',
+            'features': [usgs_feature(i, magnitude=2.5 + i % 5) for i in range(1500)],
+            'metadata': {'url': 'https://earthquake.usgs.gov/fdsnws/event/1/query', 'count': 1500, 'api': '1.14.1'},
+        }
+        self.assertParsesLikeGeojson(data, chunk_size=1000)
+
+    def test_empty_feed(self):
+        data = {'type': 'FeatureCollection', 'metadata': {'count': 0}, 'features': []}
+        self.assertEqual(len(self.assertParsesLikeGeojson(data)), 0)
+
+
+class FeedSnapshotRefreshTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(usgs_feed, '_snapshot', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def snapshot(self, age=0):
+        return FeedSnapshot([1.0], [2.0], [4.5], [0], [10.0], fetched_at=time.time() - age)
+
+    def test_download_does_not_hold_the_snapshot_lock(self):
+        def load(previous):
+            self.assertFalse(usgs_feed._snapshot_lock.locked())
+            return fresh
+
+        fresh = self.snapshot()
+        with mock.patch.object(usgs_feed, '_load_snapshot', side_effect=load):
+            self.assertIs(refresh_feed_snapshot(), fresh)
+        self.assertIs(get_feed_snapshot(max_age=60), fresh)
+
+    def test_stale_snapshot_is_served_while_another_thread_refreshes(self):
+        stale = self.snapshot(age=600)
+        usgs_feed._snapshot = stale
+        started, release = threading.Event(), threading.Event()
+        fresh = self.snapshot()
+
+        def load(previous):
+            started.set()
+            release.wait(5)
+            return fresh
+
+        with mock.patch.object(usgs_feed, '_load_snapshot', side_effect=load) as loader:
+            refresher = threading.Thread(target=get_feed_snapshot, kwargs={'max_age': 60})
+            refresher.start()
+            self.assertTrue(started.wait(5))
+            # A second caller neither waits for the download nor starts another one
+            self.assertIs(get_feed_snapshot(max_age=60), stale)
+            release.set()
+            refresher.join(5)
+        self.assertEqual(loader.call_count, 1)
+        self.assertIs(get_feed_snapshot(max_age=60), fresh)
+
+    def test_failed_refresh_keeps_previous_snapshot(self):
+        stale = self.snapshot(age=600)
+        usgs_feed._snapshot = stale
+        with mock.patch.object(usgs_feed, '_load_snapshot', side_effect=ConnectionError('down')):
+            self.assertIs(get_feed_snapshot(max_age=60), stale)
+        # Backs off until the next refresh
+        self.assertLess(time.time() - stale.fetched_at, 60)
+
+
+class EarthquakeRiskCacheTests(TestCase):
+
+    def setUp(self):
+        now = int(time.time() * 1000)
+        self.events = {
+            'latitudes': [20.0, 25.0, 12.0], 'longitudes': [78.0, 85.0, 75.0], 'magnitudes': [5.1, 4.6, 3.9],
+            'times': [now - 3600000] * 3, 'depths': [10.0, 35.0, 5.0], 'ids': ['us1', 'us2', 'us3'],
+        }
+        self.cache = EarthquakeRiskCache(cell_degrees=0.01)
+        patcher = mock.patch('users.tasks.get_earthquake_risk_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Locations either well inside or well outside the radius of the event that changes, at (25, 85)
+        rng = random.Random(0)
+        points = [(rng.uniform(20, 30), rng.uniform(80, 90)) for _ in range(600)]
+        distances = haversine_distances(25.0, 85.0, [p[0] for p in points], [p[1] for p in points])
+        kept = [(point, distance) for point, distance in zip(points, distances)
+                if abs(distance - EARTHQUAKE_INFLUENCE_KM) > 10]
+        self.locations = [point for point, _ in kept]
+        self.near = {i for i, (_, distance) in enumerate(kept) if distance < EARTHQUAKE_INFLUENCE_KM}
+
+    def snapshot(self, magnitude=None):
+        """Feed snapshot of the events, with the one at (25, 85) updated to `magnitude` if given"""
+        columns = {name: list(values) for name, values in self.events.items()}
+        columns['updated'] = list(columns['times'])
+        if magnitude is not None:
+            columns['magnitudes'][1] = magnitude
+            columns['updated'][1] += 1000
+        return FeedSnapshot(**columns)
+
+    def test_changed_event_invalidates_only_nearby_locations(self):
+        first = self.snapshot()
+        results = check_earthquake_risk_batch(self.locations, snapshot=first, incremental=True)
+        self.assertEqual(results, check_earthquake_risk_batch(self.locations, snapshot=first, incremental=False))
+
+        second = self.snapshot(magnitude=6.2)
+        self.cache.sync(second)
+        cached = self.cache.get_many(self.locations)
+        self.assertTrue(self.near)
+        self.assertEqual({i for i, risk in enumerate(cached) if risk is None}, self.near)
+
+        results = check_earthquake_risk_batch(self.locations, snapshot=second, incremental=True)
+        self.assertEqual(results, check_earthquake_risk_batch(self.locations, snapshot=second, incremental=False))
+
+    def test_entries_survive_a_moved_group_representative(self):
+        snapshot = self.snapshot()
+        check_earthquake_risk_batch([(20.5051, 78.5051)], snapshot=snapshot, incremental=True)
+        # A new subscriber in the cell shifts its group's mean, but not the cell
+        self.assertIsNotNone(self.cache.get_many([(20.5059, 78.5042)])[0])
+        self.assertIsNone(self.cache.get_many([(20.5151, 78.5051)])[0])
+
+
+def scalar_haversine(lat1, lon1, lat2, lon2):
+    """Reference haversine distance in kilometers, one pair at a time"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def sample_points(rng, n):
+    """Points spread over the globe, with some around the antimeridian and the poles"""
+    lats = np.concatenate([rng.uniform(-90, 90, n), rng.uniform(-30, 30, n // 4), rng.uniform(85, 90, n // 4), rng.uniform(-90, -85, n // 4)])
+    lons = np.concatenate([rng.uniform(-180, 180, n), rng.choice([-1, 1], n // 4) * rng.uniform(178, 180, n // 4), rng.uniform(-180, 180, n // 2)])
+    return lats, lons
+
+
+class HaversineTests(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lats1, self.lons1 = sample_points(rng, 120)
+        self.lats2, self.lons2 = sample_points(rng, 80)
+        self.expected = np.array([
+            [scalar_haversine(a, b, c, d) for c, d in zip(self.lats2, self.lons2)]
+            for a, b in zip(self.lats1, self.lons1)
+        ])
+
+    def test_distances_match_scalar_reference(self):
+        for i in range(0, len(self.lats1), 17):
+            np.testing.assert_allclose(
+                haversine_distances(self.lats1[i], self.lons1[i], self.lats2, self.lons2), self.expected[i], atol=1e-6
+            )
+
+    def test_matrix_matches_scalar_reference(self):
+        np.testing.assert_allclose(haversine_matrix(self.lats1, self.lons1, self.lats2, self.lons2), self.expected, atol=1e-6)
+
+    def test_across_antimeridian_and_pole(self):
+        self.assertAlmostEqual(float(haversine_distances(0.0, 179.9, [0.0], [-179.9])[0]), scalar_haversine(0, 179.9, 0, -179.9), places=6)
+        self.assertLess(float(haversine_distances(89.9, 0.0, [89.9], [180.0])[0]), 23)
+        self.assertAlmostEqual(float(haversine_distances(0.0, 0.0, [0.0], [180.0])[0]), math.pi * EARTH_RADIUS_KM, places=3)
+
+    def test_chunked_matrix_matches_unchunked(self):
+        full = haversine_matrix(self.lats1, self.lons1, self.lats2, self.lons2)
+        for chunk_size in (1, 7, 64, 1000):
+            np.testing.assert_array_equal(
+                haversine_matrix(self.lats1, self.lons1, self.lats2, self.lons2, chunk_size=chunk_size), full
+            )
+        starts = [start for start, _ in iter_haversine_chunks(self.lats1, self.lons1, self.lats2, self.lons2, chunk_size=50)]
+        self.assertEqual(starts, list(range(0, len(self.lats1), 50)))
+
+    def test_float32_tolerance(self):
+        matrix = haversine_matrix(self.lats1, self.lons1, self.lats2, self.lons2, dtype=np.float32, chunk_size=32)
+        self.assertEqual(matrix.dtype, np.float32)
+        # Rounding is worst for near-antipodal pairs, about 1 km at 20000 km
+        np.testing.assert_allclose(matrix, self.expected, atol=2.0)
+
+        # Within a region, float32 errors stay in the meters
+        rng = np.random.default_rng(1)
+        lats, lons = rng.uniform(8, 35, 200), rng.uniform(68, 97, 200)
+        np.testing.assert_allclose(
+            haversine_matrix(lats, lons, lats, lons, dtype=np.float32), haversine_matrix(lats, lons, lats, lons), atol=0.01
+        )
+
+
+class GridIndexTests(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.lats, self.lons = sample_points(rng, 3000)
+
+    def assertMatchesBruteForce(self, index, lat, lon, km):
+        distances = haversine_distances(lat, lon, self.lats, self.lons)
+        expected = np.flatnonzero(distances < km)
+        indices, found = index.query_radius(lat, lon, km)
+        np.testing.assert_array_equal(indices, expected)
+        np.testing.assert_allclose(found, distances[expected])
+        return indices
+
+    def test_matches_brute_force(self):
+        queries = [(20.0, 78.0), (-33.9, 18.4), (0.0, 0.0), (60.0, -150.0)]
+        for cell_degrees in (0.5, 1.0, 5.0):
+            index = GridIndex(self.lats, self.lons, cell_degrees=cell_degrees)
+            for lat, lon in queries:
+                for km in (10, 300, 2500):
+                    self.assertMatchesBruteForce(index, lat, lon, km)
+
+    def test_antimeridian_and_poles(self):
+        index = GridIndex(self.lats, self.lons)
+        self.assertTrue(len(self.assertMatchesBruteForce(index, 5.0, 179.8, 500)))
+        self.assertTrue(len(self.assertMatchesBruteForce(index, -5.0, -179.8, 500)))
+        self.assertTrue(len(self.assertMatchesBruteForce(index, 89.9, 45.0, 300)))
+        self.assertTrue(len(self.assertMatchesBruteForce(index, -90.0, 0.0, 300)))
+        # A radius spanning more than half the globe covers every column
+        self.assertMatchesBruteForce(index, 10.0, 170.0, 15000)
+
+    def test_empty_index(self):
+        indices, distances = GridIndex([], []).query_radius(20.0, 78.0, 100)
+        self.assertEqual((len(indices), len(distances)), (0, 0))
+
+
+class AdaptiveRiskGridTests(TestCase):
+    """Quadtree grid over a synthetic feed with two earthquake clusters"""
+
+    CLUSTERS = [(20.0, 78.0), (28.0, 90.0)]
+
+    def setUp(self):
+        self.evaluated = []
+        patchers = [
+            mock.patch('users.tasks.check_earthquake_risk_batch', side_effect=self.earthquake_risks),
+            mock.patch('users.tasks.check_cyclone_risk_batch', side_effect=lambda points, **kwargs: [
+                {'risk_level': 0, 'details': 'Calm'} for _ in points
+            ]),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def level(self, lat, lon):
+        distance = min(scalar_haversine(lat, lon, *cluster) for cluster in self.CLUSTERS)
+        return 3 if distance < 80 else 2 if distance < 160 else 1 if distance < 300 else 0
+
+    def earthquake_risks(self, points, snapshot=None):
+        self.evaluated.extend(points)
+        return [{'risk_level': self.level(lat, lon), 'details': 'Synthetic'} for lat, lon in points]
+
+    def lattice(self, base_cells, max_depth):
+        intervals = base_cells * 2 ** max_depth
+        lats = np.linspace(*LAT_BOUNDS, intervals + 1)
+        lons = np.linspace(*LON_BOUNDS, intervals + 1)
+        return [(lat, lon) for lat in lats for lon in lons]
+
+    def test_refined_points_match_uniform_grid(self):
+        grid = compute_adaptive_risk_grid(base_cells=7, max_depth=3, budget=100000)
+        uniform = {(round(lat, 6), round(lon, 6)): self.level(lat, lon) for lat, lon in self.lattice(7, 3)}
+
+        adaptive = {
+            (round(lat, 6), round(lon, 6)): int(level)
+            for lat, lon, level in zip(grid.latitudes, grid.longitudes, grid.earthquake_levels)
+        }
+        evaluated = {(round(lat, 6), round(lon, 6)) for lat, lon in self.evaluated}
+        self.assertLessEqual(adaptive.keys(), uniform.keys())
+        for point in evaluated:
+            self.assertEqual(adaptive[point], uniform[point])
+        # Every high-risk point of the uniform grid is evaluated, at a fraction of the uniform cost
+        high = {point for point, level in uniform.items() if level >= 2}
+        self.assertTrue(high)
+        self.assertLessEqual(high, evaluated)
+        self.assertLess(len(evaluated), len(uniform) / 2)
+
+    def test_budget_limits_evaluations(self):
+        compute_adaptive_risk_grid(base_cells=7, max_depth=3, budget=150)
+        self.assertEqual(len(self.evaluated), len(set(self.evaluated)))
+        self.assertLessEqual(len(self.evaluated), 150)
+        # The base grid's corners are always evaluated
+        self.assertGreaterEqual(len(self.evaluated), 8 * 8)
+
+    def test_max_depth_limits_resolution(self):
+        grid = compute_adaptive_risk_grid(base_cells=7, max_depth=1, budget=100000)
+        lattice = {(round(lat, 6), round(lon, 6)) for lat, lon in self.lattice(7, 1)}
+        self.assertLessEqual({(round(lat, 6), round(lon, 6)) for lat, lon in zip(grid.latitudes, grid.longitudes)}, lattice)
+        self.assertLessEqual(len(self.evaluated), len(lattice))
+
+
+class RiskMapFrameTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RISK_GRID_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.grid = RiskGrid([10.0], [20.0], [2], [0], ['M4.5 nearby'], [''], generated_at=1700000000.0)
+        store_risk_grid('heatmap', self.grid)
+        patcher = mock.patch('users.risk_heatmap.render_risk_map_document', return_value='<html>map</html>')
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_request_renders_once(self):
+        response = self.client.get(reverse('risk_map_frame'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{heatmap_version(self.grid)}"')
+        self.assertEqual(response['Last-Modified'], http_date(self.grid.generated_at))
+        self.client.get(reverse('risk_map_frame'))
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_revalidation_does_not_render(self):
+        response = self.client.get(reverse('risk_map_frame'), HTTP_IF_NONE_MATCH=f'"{heatmap_version(self.grid)}"')
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('risk_map_frame'), HTTP_IF_MODIFIED_SINCE=http_date(self.grid.generated_at))
+        self.assertEqual(response.status_code, 304)
+        self.render.assert_not_called()
+
+    def test_recompute_with_same_contents_renders_new_legend(self):
+        etag = self.client.get(reverse('risk_map_frame'))['ETag']
+        recomputed = RiskGrid([10.0], [20.0], [2], [0], ['M4.5 nearby'], [''], generated_at=1700000600.0)
+        self.assertEqual(recomputed.version, self.grid.version)
+        store_risk_grid('heatmap', recomputed)
+
+        response = self.client.get(reverse('risk_map_frame'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(self.render.call_args.args[0].generated_at, 1700000600.0)
+
+    def test_negotiate_respects_q_values(self):
+        artifact = MapArtifact('test', artifact_dir())
+        artifact.write('<html>map</html>')
+        self.assertEqual(artifact.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(artifact.negotiate('deflate, gzip;q=0.5'), 'gzip')
+        self.assertIsNone(artifact.negotiate('gzip;q=0'))
+        self.assertIsNone(artifact.negotiate('GZIP; Q=0.000, deflate'))
+        self.assertIsNone(artifact.negotiate('*;q=0'))
+        self.assertEqual(artifact.negotiate('*'), artifact.available_encodings()[0])
+        self.assertIsNone(artifact.negotiate(''))
+        if 'br' in artifact.available_encodings():
+            self.assertEqual(artifact.negotiate('br;q=0.2, gzip;q=0.8'), 'gzip')
+            self.assertEqual(artifact.negotiate('br;q=0, *'), 'gzip')
+
+
+class RiskTileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RISK_GRID_DIR=directory.name, RISK_TILE_MAX_ZOOM=8)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.grid = RiskGrid(
+            [10.0, -20.0, 50.0, 0.0], [20.0, -60.0, 100.0, 0.0], [2, 0, 1, 3], [0, 1, 0, 0], [''] * 4, [''] * 4,
+            quakes=[(12.0, 25.0, 4.5, 1700000000000, float('nan')), (11.0, 21.0, 2.0, 1700000000000, 5.0)],
+            active_alerts=[{'latitude': 10.5, 'longitude': 20.5, 'primary_location_name': 'Test', 'last_alert_details': 'M4.5'}],
+            generated_at=1700000000.0,
+        )
+
+    def test_tile_bounds(self):
+        south, west, north, east = tile_bounds(0, 0, 0)
+        self.assertEqual((west, east), (-180, 180))
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(south, -85.0511, places=4)
+        # The four zoom 1 tiles meet at the equator and the prime meridian
+        self.assertEqual(tile_bounds(1, 1, 0)[:2], (0.0, 0.0))
+        self.assertAlmostEqual(tile_bounds(1, 0, 1)[2], 0.0)
+
+    def test_every_point_belongs_to_exactly_one_tile(self):
+        z = 3
+        counts = {}
+        for x in range(2 ** z):
+            for y in range(2 ** z):
+                for feature in build_tile(self.grid, z, x, y)['features']:
+                    key = (feature['properties']['kind'], tuple(feature['geometry']['coordinates']))
+                    counts[key] = counts.get(key, 0) + 1
+        self.assertEqual(set(counts.values()), {1})
+        # Points on the equator and prime meridian go to one side only
+        self.assertIn(('earthquake_risk', (0.0, 0.0)), counts)
+        self.assertEqual(len(counts), 6)
+
+    def test_tile_features(self):
+        # The zoom 2 tile covering lat 0..66, lon 0..90
+        tile = build_tile(self.grid, 2, 2, 1)
+        self.assertEqual(tile['version'], self.grid.version)
+        features = {feature['properties']['kind']: feature for feature in tile['features']}
+        self.assertEqual(sorted(features), ['alert', 'earthquake_risk', 'quake'])
+        self.assertEqual(features['earthquake_risk']['geometry']['coordinates'], [20.0, 10.0])
+        self.assertEqual(features['earthquake_risk']['properties']['risk_level'], 2)
+        # Only quakes above the marker magnitude, with a missing depth as null
+        self.assertEqual(features['quake']['properties'], {'kind': 'quake', 'magnitude': 4.5, 'time': 1700000000000, 'depth': None})
+        self.assertEqual(features['alert']['properties']['name'], 'Test')
+
+    def test_tile_view_revalidates(self):
+        store_risk_grid('heatmap', self.grid)
+        url = reverse('risk_tile', args=[2, 2, 1])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        self.assertEqual(len(json.loads(response.content)['features']), 3)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{self.grid.version}-2-2-1"')
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Another tile, or a new grid version, has a different ETag
+        self.assertEqual(self.client.get(reverse('risk_tile', args=[2, 1, 1]), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(reverse('risk_tile', args=[9, 0, 0])).status_code, 404)
+
+
+class RiskGridWeatherTests(TestCase):
+    """Grid refreshes use a coarse weather lattice on their own call budget"""
+
+    @override_settings(OPENWEATHERMAP_RATE_LIMIT=60, RISK_GRID_WEATHER_RATE_LIMIT=10)
+    def test_budgets_split_the_rate_limit(self):
+        self.assertEqual(budget_rate_limit('grid'), 10)
+        self.assertEqual(budget_rate_limit('alerts'), 50)
+        with override_settings(OPENWEATHERMAP_RATE_LIMIT=0):
+            self.assertEqual(budget_rate_limit('alerts'), 0)
+        self.assertIsNot(get_weather_client('grid'), get_weather_client('alerts'))
+
+    def test_cyclone_field_uses_nearest_lattice_point(self):
+        calls = []
+
+        def risks(points, runner=None, weather_client=None):
+            calls.append((list(points), weather_client))
+            return [{'risk_level': i, 'details': f'lattice {i}'} for i in range(len(points))]
+
+        with mock.patch('users.tasks.check_cyclone_risk_batch', side_effect=risks):
+            field = CycloneField.compute(points_per_axis=3)
+
+        # One batch of 3x3 lattice points through the grid budget
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(calls[0][0]), 9)
+        self.assertIs(calls[0][1], get_weather_client('grid'))
+        points = [(8.0, 68.0), (35.0, 97.0), (21.4, 82.4), (100.0, 0.0)]
+        self.assertEqual([risk['risk_level'] for risk in field.risks_at(points)], [0, 8, 4, 6])
+        self.assertTrue(field.covers(21.4, 82.4))
+        self.assertFalse(field.covers(100.0, 0.0))
+        self.assertEqual(CycloneField(1, [{'risk_level': 2}]).risks_at([(30.0, 90.0)]), [{'risk_level': 2}])
+
+
+class RiskGridNotReadyTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RISK_GRID_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.delete(REFRESH_REQUESTED_KEY)
+        self.addCleanup(cache.delete, REFRESH_REQUESTED_KEY)
+
+        patchers = [
+            mock.patch('users.tasks.refresh_risk_grid.delay'),
+            mock.patch('users.risk_heatmap.compute_named_risk_grid'),
+        ]
+        self.delay, self.compute = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_views_answer_not_ready_and_queue_one_refresh(self):
+        for url in (reverse('risk_data_api'), reverse('risk_tile', args=[2, 2, 1]), reverse('risk_map_frame')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '60')
+
+        response = self.client.get(reverse('risk_heatmap'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'being computed')
+        self.delay.assert_called_once_with()
+        self.compute.assert_not_called()
+
+    def test_stored_grid_is_served(self):
+        store_risk_grid('api', RiskGrid([10.0], [20.0], [2], [0], ['M4.5 nearby'], ['']))
+        response = self.client.get(reverse('risk_data_api'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['earthquake_risks']), 1)
+        self.delay.assert_not_called()
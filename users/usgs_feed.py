@@ -0,0 +1,323 @@
+import threading
+import time
+import logging
+import numpy as np
+import requests
+from django.conf import settings
+from .spatial_index import GridIndex
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from the response per chunk when streaming the feed
+STREAM_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_FEED_URL = 'https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson'
+
+
+class FeedSnapshot:
+    """
+    Columnar copy of one download of the USGS GeoJSON feed.
+
+    Each event is stored as one row across the numpy arrays, so risk checks
+    can query the whole month of data without touching the parsed JSON again.
+    """
+
+    def __init__(self, latitudes, longitudes, magnitudes, times, depths,
+                 etag=None, last_modified=None, fetched_at=None, ids=None, updated=None):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.magnitudes = np.asarray(magnitudes, dtype=np.float64)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.depths = np.asarray(depths, dtype=np.float64)
+        # USGS event ids and last update times, used to diff consecutive snapshots
+        self.ids = np.asarray(ids if ids is not None else [_event_key(*row) for row in zip(
+            self.latitudes.tolist(), self.longitudes.tolist(), self.times.tolist())], dtype=str)
+        self.updated = np.asarray(updated if updated is not None else self.times, dtype=np.int64)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self._index = None
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @property
+    def version(self):
+        """Identifier of the feed contents this snapshot was built from"""
+        return self.etag or self.last_modified or str(int(self.fetched_at))
+
+    @property
+    def index(self):
+        """Spatial index over the events, built on first use"""
+        if self._index is None:
+            self._index = GridIndex(self.latitudes, self.longitudes)
+        return self._index
+
+    def query_radius(self, lat, lon, km):
+        """Indices and distances of events strictly closer than km kilometers"""
+        return self.index.query_radius(lat, lon, km)
+
+    @classmethod
+    def from_geojson(cls, data, **kwargs):
+        """Build a snapshot from a parsed GeoJSON FeatureCollection"""
+        latitudes, longitudes, magnitudes, times, depths, ids, updated = [], [], [], [], [], [], []
+        for feature in data.get('features', []):
+            coords = (feature.get('geometry') or {}).get('coordinates') or []
+            if len(coords) < 2:
+                continue
+            properties = feature.get('properties') or {}
+            # Missing magnitudes count as 0, matching the old `.get('mag', 0)` default
+            magnitude = properties.get('mag')
+            depth = coords[2] if len(coords) > 2 and coords[2] is not None else np.nan
+            longitudes.append(coords[0])
+            latitudes.append(coords[1])
+            magnitudes.append(magnitude if magnitude is not None else 0.0)
+            times.append(properties.get('time') or 0)
+            depths.append(depth)
+            ids.append(feature.get('id') or _event_key(coords[1], coords[0], times[-1]))
+            updated.append(properties.get('updated') or times[-1])
+        return cls(latitudes, longitudes, magnitudes, times, depths, ids=ids, updated=updated, **kwargs)
+
+
+class _ColumnBuilder:
+    """Typed event columns filled row by row, grown by doubling when the count hint is exceeded"""
+
+    def __init__(self, capacity=0):
+        capacity = max(int(capacity or 0), 1024)
+        self.size = 0
+        self.latitudes = np.empty(capacity, dtype=np.float64)
+        self.longitudes = np.empty(capacity, dtype=np.float64)
+        self.magnitudes = np.empty(capacity, dtype=np.float64)
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.depths = np.empty(capacity, dtype=np.float64)
+        self.updated = np.empty(capacity, dtype=np.int64)
+        self.ids = [None] * capacity
+
+    def _grow(self):
+        capacity = len(self.latitudes) * 2
+        for name in ('latitudes', 'longitudes', 'magnitudes', 'times', 'depths', 'updated'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+        self.ids.extend([None] * (capacity - len(self.ids)))
+
+    def append(self, event_id, coords, magnitude, event_time, updated):
+        if len(coords) < 2:
+            return
+        if self.size == len(self.latitudes):
+            self._grow()
+        i = self.size
+        event_time = event_time or 0
+        self.longitudes[i] = coords[0]
+        self.latitudes[i] = coords[1]
+        # Same defaults as FeedSnapshot.from_geojson
+        self.depths[i] = coords[2] if len(coords) > 2 and coords[2] is not None else np.nan
+        self.magnitudes[i] = magnitude if magnitude is not None else 0.0
+        self.times[i] = event_time
+        self.updated[i] = updated or event_time
+        self.ids[i] = event_id or _event_key(coords[1], coords[0], event_time)
+        self.size += 1
+
+    def build(self, **kwargs):
+        n = self.size
+        return FeedSnapshot(
+            self.latitudes[:n], self.longitudes[:n], self.magnitudes[:n], self.times[:n], self.depths[:n],
+            ids=self.ids[:n], updated=self.updated[:n], **kwargs
+        )
+
+
+class _ChunkReader:
+    """File-like wrapper over an iterator of byte chunks, as ijson expects"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, size=-1):
+        # ijson probes with read(0) to detect bytes vs str
+        if size == 0:
+            return b''
+        return next(self._chunks, b'')
+
+
+def parse_feed_stream(chunks, **kwargs):
+    """
+    Build a FeedSnapshot from a GeoJSON feed arriving as byte chunks.
+
+    Only the fields risk checks use are pulled out of the token stream into
+    typed arrays, preallocated from metadata.count when the feed has one, so
+    memory stays proportional to the number of events rather than to the
+    size of the parsed JSON tree. Requires ijson.
+    """
+    columns = None
+    count_hint = 0
+    event_id = magnitude = event_time = updated = None
+    coords = []
+
+    for prefix, event, value in ijson.parse(_ChunkReader(chunks), use_float=True):
+        if prefix == 'metadata.count':
+            count_hint = value
+        elif prefix == 'features.item':
+            if event == 'start_map':
+                if columns is None:
+                    columns = _ColumnBuilder(count_hint)
+                event_id = magnitude = event_time = updated = None
+                coords = []
+            elif event == 'end_map':
+                columns.append(event_id, coords, magnitude, event_time, updated)
+        elif prefix == 'features.item.geometry.coordinates.item':
+            coords.append(value)
+        elif prefix == 'features.item.id':
+            event_id = value
+        elif prefix == 'features.item.properties.mag':
+            magnitude = value
+        elif prefix == 'features.item.properties.time':
+            event_time = int(value) if value is not None else None
+        elif prefix == 'features.item.properties.updated':
+            updated = int(value) if value is not None else None
+
+    return (columns or _ColumnBuilder()).build(**kwargs)
+
+
+def _event_key(lat, lon, event_time):
+    """Stand-in id for events that come without one"""
+    return f'{lat:.4f},{lon:.4f},{event_time}'
+
+
+def diff_snapshots(previous, current):
+    """
+    Locations of events that differ between two snapshots.
+
+    Events are matched by id. Added events and the new position of updated
+    events come from current, removed events and the old position of updated
+    events from previous.
+
+    Returns:
+        tuple: (latitudes, longitudes) arrays of changed event locations
+    """
+    if previous is current:
+        return np.empty(0), np.empty(0)
+
+    previous_updated = dict(zip(previous.ids.tolist(), previous.updated.tolist()))
+    current_updated = dict(zip(current.ids.tolist(), current.updated.tolist()))
+
+    changed_current = [
+        i for i, (event_id, updated) in enumerate(zip(current.ids.tolist(), current.updated.tolist()))
+        if previous_updated.get(event_id) != updated
+    ]
+    changed_previous = [
+        i for i, (event_id, updated) in enumerate(zip(previous.ids.tolist(), previous.updated.tolist()))
+        if current_updated.get(event_id) != updated
+    ]
+    return (
+        np.concatenate([current.latitudes[changed_current], previous.latitudes[changed_previous]]),
+        np.concatenate([current.longitudes[changed_current], previous.longitudes[changed_previous]]),
+    )
+
+
+_snapshot = None
+# Guards swapping _snapshot; never held while downloading
+_snapshot_lock = threading.Lock()
+# Lets a single thread download at a time while others keep using the current snapshot
+_refresh_lock = threading.Lock()
+
+
+def fetch_feed_snapshot(previous=None, url=None, timeout=15):
+    """
+    Download the USGS feed and parse it into a FeedSnapshot.
+
+    When a previous snapshot is given, the request is made conditional on its
+    ETag/Last-Modified and the previous snapshot is reused on a 304 response.
+    """
+    url = url or getattr(settings, 'USGS_FEED_URL', DEFAULT_FEED_URL)
+    headers = {}
+    if previous is not None:
+        if previous.etag:
+            headers['If-None-Match'] = previous.etag
+        if previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+
+    with requests.get(url, headers=headers, timeout=timeout, stream=ijson is not None) as response:
+        if response.status_code == 304 and previous is not None:
+            logger.debug("USGS feed not modified, reusing snapshot")
+            previous.fetched_at = time.time()
+            return previous
+        response.raise_for_status()
+
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if ijson is not None:
+            # Parse while downloading instead of materializing the whole feed as dicts
+            snapshot = parse_feed_stream(response.iter_content(STREAM_CHUNK_SIZE), **validators)
+        else:
+            snapshot = FeedSnapshot.from_geojson(response.json(), **validators)
+    logger.info(f"Loaded USGS feed snapshot with {len(snapshot)} events")
+    return snapshot
+
+
+def _load_snapshot(previous):
+    """Next snapshot from the configured source: the USGS feed, or the local catalog"""
+    if getattr(settings, 'USGS_FEED_SOURCE', 'feed') == 'catalog':
+        # Imported here because the earthquakes app imports this module
+        from earthquakes.catalog import catalog_snapshot
+        snapshot = catalog_snapshot(previous=previous)
+        snapshot.fetched_at = time.time()
+        return snapshot
+    return fetch_feed_snapshot(previous=previous)
+
+
+def _refresh():
+    """Load the next snapshot without holding _snapshot_lock, then swap it in"""
+    global _snapshot
+    previous = _snapshot
+    try:
+        snapshot = _load_snapshot(previous)
+    except Exception as e:
+        if previous is None:
+            raise
+        logger.error(f"Error refreshing USGS feed, keeping previous snapshot: {str(e)}")
+        # Back off until the next refresh instead of retrying on every risk check
+        previous.fetched_at = time.time()
+        return previous
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def refresh_feed_snapshot():
+    """Revalidate the shared snapshot against USGS, e.g. at the start of a check cycle"""
+    with _refresh_lock:
+        return _refresh()
+
+
+def get_feed_snapshot(max_age=None):
+    """
+    Get the shared USGS feed snapshot, refreshing it once it is older than
+    max_age seconds (USGS_FEED_MAX_AGE by default).
+
+    While one thread downloads, the others keep using the current snapshot and
+    only wait when there is none yet.
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'USGS_FEED_MAX_AGE', 300)
+    with _snapshot_lock:
+        snapshot = _snapshot
+    if snapshot is not None and time.time() - snapshot.fetched_at < max_age:
+        return snapshot
+
+    if not _refresh_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        # Another thread may have refreshed it while this one waited
+        if _snapshot is not None and _snapshot is not snapshot and time.time() - _snapshot.fetched_at < max_age:
+            return _snapshot
+        return _refresh()
+    finally:
+        _refresh_lock.release()
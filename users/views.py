@@ -6,8 +6,16 @@ from django.contrib.auth.decorators import login_required
 from .forms import SubscriptionForm
 import logging
 import json
-from django.http import JsonResponse
-from .risk_heatmap import generate_risk_heatmap, get_risk_data
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.clickjacking import xframe_options_sameorigin
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from datetime import datetime, timezone
+from functools import wraps
+from .risk_heatmap import RiskGridNotReady, get_heatmap_artifact, get_risk_data, get_risk_grid, heatmap_version
+from .risk_tiles import get_risk_tile, is_valid_tile
 
 logger = logging.getLogger(__name__)
 
@@ -176,12 +184,69 @@ def anonymous_subscription(request):
     
     return render(request, 'users/anonymous_form.html')  # Create a similar template
 
+# Seconds clients are asked to wait before retrying while the first grid is computed
+GRID_NOT_READY_RETRY_AFTER = 60
+
+def requires_risk_grid(view):
+    """Answer 503 with Retry-After instead of computing the grid when none is stored yet"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except RiskGridNotReady:
+            response = JsonResponse({'error': 'Risk grid is being computed'}, status=503)
+            response['Retry-After'] = str(GRID_NOT_READY_RETRY_AFTER)
+            return response
+    return wrapper
+
 def risk_heatmap_view(request):
-    """View for displaying the risk heatmap."""
-    return render(request, 'risk_heatmap.html', {
-        'map_html': generate_risk_heatmap()
-    })
+    """View for displaying the risk heatmap shell; map data loads per visible tile from risk_tile."""
+    context = {'tile_max_zoom': getattr(settings, 'RISK_TILE_DATA_ZOOM', 6)}
+    try:
+        grid = get_risk_grid('heatmap')
+        context.update(grid_ready=True, generated_at=datetime.fromtimestamp(grid.generated_at), is_stale=grid.is_stale())
+    except RiskGridNotReady:
+        context.update(grid_ready=False, is_stale=False)
+    return render(request, 'risk_heatmap.html', context)
+
+def _tile_etag(request, z, x, y):
+    return f"{get_risk_grid('heatmap').version}-{z}-{x}-{y}"
+
+@requires_risk_grid
+@gzip_page
+@condition(etag_func=_tile_etag)
+def risk_tile(request, z, x, y):
+    """Serve the GeoJSON features of one map tile, cached per tile and grid version."""
+    if not is_valid_tile(z, x, y):
+        raise Http404("Tile out of range")
+    content = get_risk_tile(get_risk_grid('heatmap'), z, x, y)
+    response = HttpResponse(content, content_type='application/geo+json')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# Both come from the stored grid, so a revalidated request never renders the map
+def _heatmap_etag(request):
+    return heatmap_version(get_risk_grid('heatmap'))
+
+def _heatmap_last_modified(request):
+    return datetime.fromtimestamp(get_risk_grid('heatmap').generated_at, tz=timezone.utc)
+
+@requires_risk_grid
+@xframe_options_sameorigin
+@condition(etag_func=_heatmap_etag, last_modified_func=_heatmap_last_modified)
+def risk_map_frame(request):
+    """Serve the rendered heatmap document, precompressed and revalidated with ETag/Last-Modified."""
+    artifact = get_heatmap_artifact()
+    encoding = artifact.negotiate(request.headers.get('Accept-Encoding'))
+    response = HttpResponse(artifact.read(encoding), content_type='text/html; charset=utf-8')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    # Let browsers keep the document but revalidate it on every refresh
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
+@requires_risk_grid
 def risk_data_api(request):
     """API endpoint for getting current risk data."""
     return JsonResponse(get_risk_data())
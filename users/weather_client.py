@@ -0,0 +1,199 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from .rate_limit import RateLimitError, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+OPENWEATHERMAP_BASE_URL = 'http://api.openweathermap.org/data/2.5'
+
+
+class WeatherRateLimitError(RateLimitError):
+    """Raised when the OpenWeatherMap call budget is exhausted for longer than allowed"""
+
+
+class WeatherClient:
+    """
+    OpenWeatherMap client shared by all cyclone checks.
+
+    Requests go through pooled keep-alive sessions and are cached per
+    endpoint and snapped lat/lon grid cell, so nearby locations share one
+    upstream call. Concurrent requests for the same cell wait on the call
+    already in flight instead of issuing their own.
+    """
+
+    def __init__(self, api_key=None, base_url=OPENWEATHERMAP_BASE_URL, cache_ttl=600,
+                 grid_degrees=0.1, rate_limit=60, rate_period=60.0, max_wait=30.0,
+                 timeout=10, pool_size=10, max_entries=50000):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache_ttl = cache_ttl
+        self.grid_degrees = grid_degrees
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter(rate_limit, rate_period) if rate_limit else None
+        self._local = threading.local()
+
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @property
+    def session(self):
+        # requests.Session is not thread-safe, so each risk worker thread keeps its own
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def snap(self, lat, lon):
+        """Snap coordinates to the center of their cache grid cell"""
+        size = self.grid_degrees
+        if not size:
+            return round(float(lat), 4), round(float(lon), 4)
+        return (
+            round((int(float(lat) // size) + 0.5) * size, 4),
+            round((int(float(lon) // size) + 0.5) * size, 4),
+        )
+
+    def get(self, endpoint, lat, lon):
+        """Get an OpenWeatherMap endpoint ('weather' or 'forecast') for a location"""
+        cell = self.snap(lat, lon)
+        key = (endpoint, cell)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                future = Future()
+                self._inflight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            data = self._fetch(endpoint, cell)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._evict_expired()
+            self._cache[key] = (time.monotonic() + self.cache_ttl, data)
+            del self._inflight[key]
+        future.set_result(data)
+        return data
+
+    def _fetch(self, endpoint, cell):
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.acquire(self.max_wait)
+            except RateLimitError:
+                raise WeatherRateLimitError("OpenWeatherMap rate limit budget exhausted")
+        response = self.session.get(
+            f'{self.base_url}/{endpoint}',
+            params={'lat': cell[0], 'lon': cell[1], 'appid': self.api_key, 'units': 'metric'},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+        if len(self._cache) >= self.max_entries:
+            # Still full of live entries, drop the oldest half
+            by_expiry = sorted(self._cache, key=lambda k: self._cache[k][0])
+            for key in by_expiry[:len(by_expiry) // 2]:
+                del self._cache[key]
+
+    def current_weather(self, lat, lon):
+        return self.get('weather', lat, lon)
+
+    def forecast(self, lat, lon):
+        return self.get('forecast', lat, lon)
+
+    def stats(self):
+        """Cache and request counters since the client was created"""
+        with self._lock:
+            requests_made = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'hit_rate': (self.hits + self.coalesced) / requests_made if requests_made else 0.0,
+                'cached_entries': len(self._cache),
+            }
+
+
+# Call budgets with their own client, and so their own rate limiter and cache
+WEATHER_BUDGETS = ('alerts', 'grid')
+
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def budget_rate_limit(budget):
+    """
+    OpenWeatherMap calls per minute for a budget.
+
+    Risk grids get RISK_GRID_WEATHER_RATE_LIMIT calls carved out of
+    OPENWEATHERMAP_RATE_LIMIT and subscriber alerts keep the rest, so
+    refreshing the grids never drains the calls alerts need. 0 is unlimited.
+    """
+    total = getattr(settings, 'OPENWEATHERMAP_RATE_LIMIT', 60)
+    grid = getattr(settings, 'RISK_GRID_WEATHER_RATE_LIMIT', 10)
+    if budget == 'grid':
+        return grid
+    if not total:
+        return 0
+    return max(total - grid, 1)
+
+
+def get_weather_client(budget='alerts'):
+    """Get the process-wide weather client of a call budget, configured from settings"""
+    if budget not in WEATHER_BUDGETS:
+        raise ValueError(f"Unknown weather budget: {budget}")
+    client = _clients.get(budget)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(budget)
+            if client is None:
+                client = _clients[budget] = WeatherClient(
+                    api_key=settings.OPENWEATHERMAP_API_KEY,
+                    cache_ttl=getattr(settings, 'OPENWEATHERMAP_CACHE_TTL', 600),
+                    grid_degrees=getattr(settings, 'OPENWEATHERMAP_GRID_DEGREES', 0.1),
+                    rate_limit=budget_rate_limit(budget),
+                    # The grid refresh runs in the background and can wait for its budget to refill
+                    max_wait=getattr(settings, 'RISK_GRID_REFRESH_INTERVAL', 600) if budget == 'grid' else 30.0,
+                    timeout=getattr(settings, 'OPENWEATHERMAP_TIMEOUT', 10),
+                )
+    return client